@@ -3,6 +3,8 @@ Imports and setup functionality
 """
 
 import api.logger
+import api.metrics
+import api.cache
 import api.setup
 import api.achievement
 import api.user
@@ -11,9 +13,14 @@ import api.group
 import api.annotations
 import api.auth
 import api.common
-import api.cache
+import api.catalog
+import api.flag_sharing
 import api.problem
+import api.reevaluation
+import api.unlocks
+import api.progression
 import api.stats
+import api.scoreboard
 import api.utilities
 import api.problem_feedback
 import api.admin
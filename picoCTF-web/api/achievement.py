@@ -1,7 +1,10 @@
 """ Module for interacting with the achievements """
 
-from importlib.machinery import SourceFileLoader
-from datetime import datetime
+import importlib.util
+import os
+import threading
+import time
+from datetime import datetime, timedelta
 from os.path import join
 
 import api
@@ -9,8 +12,18 @@ import pymongo
 from api.annotations import log_action
 from api.common import (check, InternalException, safe_fail,
                         SevereInternalException, validate, WebException)
+from pymongo.errors import DuplicateKeyError
 from voluptuous import Range, Required, Schema
 
+log = api.logger.use(__name__)
+
+# Number of events a worker claims at once.
+event_batch_size = 100
+# Seconds after which the events claimed by a worker that died are retried.
+event_claim_timeout = 300
+# Number of tries after which a failing event is dropped.
+event_max_attempts = 3
+
 achievement_schema = Schema({
     Required("name"):
     check(("The achievement's display name must be a string.", [str])),
@@ -124,6 +137,22 @@ def get_all_achievements(event=None, show_disabled=False):
         }).sort('score', pymongo.ASCENDING))
 
 
+@api.cache.memoize(timeout=60, fast=True, tags=["achievements"])
+def get_achievement_map():
+    """
+    Gets the enabled achievements by aid. Changing an achievement invalidates
+    the map of this process; other processes notice within a minute.
+
+    Returns:
+        A dict of achievements by aid. It is shared and must not be modified.
+    """
+
+    return {
+        achievement["aid"]: achievement
+        for achievement in get_all_achievements()
+    }
+
+
 def get_earned_achievement_instances(tid=None, uid=None, aid=None):
     """
     Gets the solved achievements for a given team or user.
@@ -167,6 +196,15 @@ def get_earned_aids(tid=None, uid=None, aid=None):
     ])
 
 
+def _earned_match(tid=None, uid=None):
+    if tid is not None:
+        return {"tid": tid}
+    elif uid is not None:
+        return {"uid": uid}
+    else:
+        raise InternalException("You must specify either a tid or uid")
+
+
 def set_earned_achievements_seen(tid=None, uid=None):
     """
     Sets all earned achievements from a team or user seen.
@@ -178,16 +216,40 @@ def set_earned_achievements_seen(tid=None, uid=None):
 
     db = api.common.get_conn()
 
-    match = {}
+    match = _earned_match(tid=tid, uid=uid)
+    match["seen"] = False
 
-    if tid is not None:
-        match.update({"tid": tid})
-    elif uid is not None:
-        match.update({"uid": uid})
-    else:
-        raise InternalException("You must specify either a tid or uid")
+    db.earned_achievements.update_many(match, {"$set": {"seen": True}})
 
-    db.earned_achievements.update(match, {"$set": {"seen": True}}, multi=True)
+
+def _get_displayed_instances(tid=None, uid=None):
+    """
+    Gets the earned instances of the enabled achievements of a team or user,
+    ordered by the time they were earned, and marks them seen. The instances
+    still carry the seen state from before.
+
+    Returns:
+        The list of instances without their data and the achievement map.
+    """
+
+    db = api.common.get_conn()
+
+    instances = list(
+        db.earned_achievements.find(
+            _earned_match(tid=tid, uid=uid), {
+                "_id": 0,
+                "data": 0,
+                "eid": 0
+            }).sort([("timestamp", pymongo.ASCENDING),
+                     ("aid", pymongo.ASCENDING)]))
+
+    if any(not instance.get("seen", False) for instance in instances):
+        set_earned_achievements_seen(tid=tid, uid=uid)
+
+    achievements = get_achievement_map()
+    return [
+        instance for instance in instances if instance["aid"] in achievements
+    ], achievements
 
 
 def get_earned_achievements_display(tid=None, uid=None):
@@ -202,22 +264,19 @@ def get_earned_achievements_display(tid=None, uid=None):
         A list of enabled achievements the team has earned.
     """
 
-    instance_achievements = get_earned_achievement_instances(tid=tid, uid=uid)
-    set_earned_achievements_seen(tid=tid, uid=uid)
+    instances, achievements = _get_displayed_instances(tid=tid, uid=uid)
 
-    for instance_achievement in instance_achievements:
-        achievement = get_achievement(aid=instance_achievement["aid"])
+    for instance in instances:
+        achievement = achievements[instance["aid"]]
 
         # Make sure not to override name or description.
-        achievement.pop("name")
-        achievement.pop("description")
-
-        instance_achievement.update(achievement)
-
-        # Make sure to remove sensitive data
-        instance_achievement.pop("data", None)
+        instance.update({
+            key: value
+            for key, value in achievement.items()
+            if key not in ["name", "description"]
+        })
 
-    return instance_achievements
+    return instances
 
 
 def get_earned_achievements(tid=None, uid=None):
@@ -231,14 +290,51 @@ def get_earned_achievements(tid=None, uid=None):
         List of solved achievement dictionaries
     """
 
-    achievements = get_earned_achievement_instances(tid=tid, uid=uid)
-    set_earned_achievements_seen(tid=tid, uid=uid)
+    instances, achievements = _get_displayed_instances(tid=tid, uid=uid)
 
-    for achievement in achievements:
-        achievement.update(get_achievement(aid=achievement["aid"]))
-        achievement.pop("data")
+    for instance in instances:
+        instance.update(achievements[instance["aid"]])
 
-    return achievements
+    return instances
+
+
+def get_teams_earned_achievements(tids, mark_seen=False):
+    """
+    Gets the solved achievements of several teams with a single query.
+
+    Args:
+        tids: the team ids
+        mark_seen: whether to mark the achievements seen
+    Returns:
+        A dict of lists of solved achievement dictionaries by tid, the same
+        as get_earned_achievements returns for each team.
+    """
+
+    db = api.common.get_conn()
+
+    match = {"tid": {"$in": list(tids)}}
+    instances = list(
+        db.earned_achievements.find(match, {
+            "_id": 0,
+            "data": 0,
+            "eid": 0
+        }).sort([("timestamp", pymongo.ASCENDING),
+                 ("aid", pymongo.ASCENDING)]))
+
+    if mark_seen and any(
+            not instance.get("seen", False) for instance in instances):
+        match["seen"] = False
+        db.earned_achievements.update_many(match, {"$set": {"seen": True}})
+
+    achievements = get_achievement_map()
+
+    result = {tid: [] for tid in tids}
+    for instance in instances:
+        if instance["aid"] in achievements:
+            instance.update(achievements[instance["aid"]])
+            result[instance["tid"]].append(instance)
+
+    return result
 
 
 def set_achievement_disabled(aid, disabled):
@@ -255,25 +351,250 @@ def set_achievement_disabled(aid, disabled):
     return update_achievement(aid, {"disabled": disabled})
 
 
-def get_processor(aid):
+class ProcessorRegistry(object):
+    """
+    Loaded achievement processor modules of this process.
+
+    Every processor file is compiled and executed once and kept by its path
+    together with the modification time and size it was loaded at. Looking a
+    processor up costs a stat of its file; a changed file is loaded again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processors = {}
+
+    def _load(self, path, signature):
+        start = time.perf_counter()
+
+        name = "achievement_processor_" + os.path.splitext(
+            os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        previous = self.processors.get(path)
+        self.processors[path] = {
+            "module": module,
+            "signature": signature,
+            "loaded": datetime.utcnow(),
+            "load_time": time.perf_counter() - start,
+            "loads": previous["loads"] + 1 if previous else 1
+        }
+
+        log.debug("Loaded achievement processor %s in %.3fs.", path,
+                  self.processors[path]["load_time"])
+        return module
+
+    def get(self, path):
+        """
+        Returns the processor module of a file, loading it if it is new or
+        changed since it was loaded.
+
+        Args:
+            path: the path of the processor file
+        Returns:
+            The processor module
+        """
+
+        path = os.path.abspath(path)
+
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        processor = self.processors.get(path)
+        if processor is not None and processor["signature"] == signature:
+            return processor["module"]
+
+        with self.lock:
+            processor = self.processors.get(path)
+            if processor is not None and processor["signature"] == signature:
+                return processor["module"]
+            return self._load(path, signature)
+
+    def warm(self, base_path):
+        """
+        Loads every processor file below a directory.
+
+        Args:
+            base_path: the processor base path
+        Returns:
+            The number of processors loaded.
+        """
+
+        loaded = 0
+        for directory, _, files in os.walk(base_path):
+            for filename in sorted(files):
+                if filename.endswith(".py"):
+                    path = join(directory, filename)
+                    try:
+                        self.get(path)
+                        loaded += 1
+                    except Exception as error:
+                        log.warning("Could not load achievement processor "
+                                    "%s: %s", path, error)
+        return loaded
+
+    def clear(self):
+        """
+        Discards every loaded processor.
+        """
+
+        with self.lock:
+            self.processors.clear()
+
+    def get_stats(self):
+        """
+        Returns the loaded processors.
+
+        Returns:
+            A dict of the load time, load count and load date by path.
+        """
+
+        return {
+            path: {
+                "load_time": processor["load_time"],
+                "loads": processor["loads"],
+                "loaded": processor["loaded"]
+            }
+            for path, processor in list(self.processors.items())
+        }
+
+
+processor_registry = ProcessorRegistry()
+
+
+def warm_processors():
+    """
+    Loads every processor below the configured processor base path.
+
+    Returns:
+        The number of processors loaded.
+    """
+
+    base_path = api.config.get_settings()["achievements"]["processor_base_path"]
+    return processor_registry.warm(base_path)
+
+
+def get_processor(aid, achievement=None):
     """
     Returns the processor module for a given achievement.
 
     Args:
         aid: the achievement id
+        achievement: the achievement, if it is already loaded
     Returns:
         The processor module
     """
 
     try:
-        path = get_achievement(aid=aid, show_disabled=True)["processor"]
+        if achievement is None:
+            achievement = get_achievement(aid=aid, show_disabled=True)
+        path = achievement["processor"]
         base_path = api.config.get_settings()["achievements"][
             "processor_base_path"]
-        return SourceFileLoader(path[:-3], join(base_path, path)).load_module()
+        return processor_registry.get(join(base_path, path))
     except FileNotFoundError:
         raise InternalException("Achievement processor is offline.")
 
 
+class AchievementContext(object):
+    """
+    Data shared by the processors that evaluate a batch of events.
+
+    Processors find it in data["context"]. Everything is loaded on first use
+    and then kept for the batch, so the processors of several events of the
+    same team do not load the same data again.
+    """
+
+    def __init__(self, tids=()):
+        self.achievements = {}
+        self.achievements_by_event = {}
+        self.solved_pids = {}
+        self.earned_aids = {}
+        self.pid_categories = None
+        self.pids_by_category = None
+
+        tids = set(tids)
+        if len(tids) > 0:
+            # The earned achievements of the whole batch in one query.
+            self.earned_aids = {tid: set() for tid in tids}
+            for earned in api.common.get_conn().earned_achievements.find({
+                    "tid": {
+                        "$in": list(tids)
+                    }
+            }, {
+                    "_id": 0,
+                    "tid": 1,
+                    "aid": 1
+            }):
+                self.earned_aids[earned["tid"]].add(earned["aid"])
+
+    def get_achievements(self, event):
+        """
+        Returns the enabled achievements of an event.
+        """
+
+        if event not in self.achievements_by_event:
+            achievements = get_all_achievements(event=event)
+            self.achievements_by_event[event] = achievements
+            for achievement in achievements:
+                self.achievements[achievement["aid"]] = achievement
+        return self.achievements_by_event[event]
+
+    def get_achievement(self, aid):
+        """
+        Returns an enabled achievement by aid.
+        """
+
+        if aid not in self.achievements:
+            self.achievements[aid] = get_achievement(aid=aid)
+        return self.achievements[aid]
+
+    def get_earned_aids(self, tid):
+        """
+        Returns the set of aids a team has earned.
+        """
+
+        if tid not in self.earned_aids:
+            self.earned_aids[tid] = get_earned_aids(tid=tid)
+        return self.earned_aids[tid]
+
+    def get_solved_pids(self, tid):
+        """
+        Returns the set of pids a team has solved.
+        """
+
+        if tid not in self.solved_pids:
+            self.solved_pids[tid] = set(api.problem.get_solved_pids(tid=tid))
+        return self.solved_pids[tid]
+
+    def get_pid_categories(self):
+        """
+        Returns the categories of the enabled problems by pid.
+        """
+
+        if self.pid_categories is None:
+            self.pid_categories = api.stats.get_pid_categories()
+        return self.pid_categories
+
+    def get_pids_by_category(self):
+        """
+        Returns the pids of the enabled problems by category.
+        """
+
+        if self.pids_by_category is None:
+            self.pids_by_category = api.stats.get_pids_by_category()
+        return self.pids_by_category
+
+    def get_categories(self):
+        """
+        Returns the categories of the enabled problems.
+        """
+
+        return sorted(self.get_pids_by_category())
+
+
 @log_action
 def process_achievement(aid, data):
     """
@@ -291,20 +612,31 @@ def process_achievement(aid, data):
     if data.get("tid", None) is None:
         data["tid"] = api.user.get_user(uid=data["uid"])["tid"]
 
-    get_achievement(aid=aid, show_disabled=True)
-    processor = get_processor(aid)
+    if data.get("context", None) is None:
+        data["context"] = AchievementContext()
+
+    achievement = data["context"].get_achievement(aid)
+    processor = get_processor(aid, achievement=achievement)
 
     return processor.process(api, data)
 
 
-def insert_earned_achievement(aid, data):
+def insert_earned_achievement(aid, data, eid=None, multiple=False):
     """
     Store earned achievement for a user/team.
 
+    An achievement is stored at most once per team, or at most once per
+    event if it can be earned multiple times, so events that are evaluated
+    again do not award it twice.
+
     Args:
         aid: the achievement id
         data: the data necessary to assess the achievement
               must include tid, uid
+        eid: the id of the event that earned the achievement
+        multiple: whether the achievement can be earned multiple times
+    Returns:
+        True if the achievement was stored, False if it already was.
     """
 
     db = api.common.get_conn()
@@ -312,25 +644,80 @@ def insert_earned_achievement(aid, data):
     tid, uid = data.pop("tid"), data.pop("uid")
     name, description = data.pop("name"), data.pop("description")
 
-    db.earned_achievements.insert({
-        "aid": aid,
-        "tid": tid,
-        "uid": uid,
-        "data": data,
-        "name": name,
-        "description": description,
-        "timestamp": datetime.utcnow().timestamp(),
-        "seen": False
-    })
+    try:
+        result = db.earned_achievements.update_one(
+            {
+                "aid": aid,
+                "tid": tid,
+                "eid": eid if multiple else None
+            }, {
+                "$setOnInsert": {
+                    "uid": uid,
+                    "data": data,
+                    "name": name,
+                    "description": description,
+                    "timestamp": datetime.utcnow().timestamp(),
+                    "seen": False
+                }
+            },
+            upsert=True)
+    except DuplicateKeyError:
+        return False
+
+    return result.upserted_id is not None
+
+
+def evaluate_achievements(event, data, context, eid):
+    """
+    Evaluates the achievements of an event and stores the earned ones.
+
+    Args:
+        event: event type, e.g., submit
+        data: dictionary with additional information necessary for assessment
+              must include tid, uid
+        context: the AchievementContext of the batch
+        eid: the id of the event
+    Returns:
+        The number of achievements earned.
+    """
+
+    tid = data["tid"]
+    earned_aids = context.get_earned_aids(tid)
+
+    earned = 0
+    for achievement in context.get_achievements(event):
+        aid = achievement["aid"]
+        multiple = achievement.get("multiple", False)
+        if aid in earned_aids and not multiple:
+            continue
+
+        achievement_data = dict(data, context=context)
+        acquired, instance_info = process_achievement(aid, achievement_data)
+
+        if acquired:
+            achievement_data.pop("context")
+            achievement_data.update({
+                "name": achievement.get("name"),
+                "description": achievement.get("description")
+            })
+            achievement_data.update(instance_info)
+
+            if insert_earned_achievement(aid, achievement_data, eid, multiple):
+                earned += 1
+            earned_aids.add(aid)
+
+    return earned
 
 
 def process_achievements(event, data):
     """
-    Process achievements of a type with data.
+    Process achievements of a type with data right away.
 
     Args:
         event: event type, e.g., submit
         data: dictionary with additional information necessary for assessment
+    Returns:
+        The number of achievements earned.
     """
 
     if data.get("uid", None) is None:
@@ -339,25 +726,157 @@ def process_achievements(event, data):
     if data.get("tid", None) is None:
         data["tid"] = api.user.get_user(uid=data["uid"])["tid"]
 
-    eligible_achievements = [
-        achievement for achievement in get_all_achievements(event=event) \
-            if achievement["aid"] not in get_earned_aids(tid=data["tid"]) \
-            or achievement.get("multiple", False)]
+    return evaluate_achievements(event, data,
+                                 AchievementContext([data["tid"]]),
+                                 api.common.token())
 
-    for achievement in eligible_achievements:
-        aid = achievement["aid"]
 
-        acquired, instance_info = process_achievement(aid, data)
+def queue_achievement_event(event, data):
+    """
+    Queues an event for the achievement worker instead of evaluating the
+    achievements during the request.
 
-        info = {
-            "name": achievement.get("name"),
-            "description": achievement.get("description")
+    Args:
+        event: event type, e.g., submit
+        data: dictionary with additional information necessary for assessment
+              must include tid, uid
+    """
+
+    # Nothing would ever process them; they must not fire once enabled.
+    if not api.config.get_settings()["achievements"]["enable_achievements"]:
+        return
+
+    db = api.common.get_conn()
+
+    db.achievement_events.insert_one({
+        "event": event,
+        "data": data,
+        "created": datetime.utcnow(),
+        "claim": None,
+        "claimed": None,
+        "attempts": 0
+    })
+
+
+def claim_achievement_events(limit=event_batch_size):
+    """
+    Claims the oldest pending events for this worker.
+
+    Events whose claim timed out are claimed again. The claim only applies to
+    events that are still claimable, so concurrent workers never share one.
+
+    Args:
+        limit: the maximum number of events to claim
+    Returns:
+        The claim token and the list of claimed events.
+    """
+
+    db = api.common.get_conn()
+
+    token = api.common.token()
+    now = datetime.utcnow()
+    claimable = {
+        "$or": [{
+            "claim": None
+        }, {
+            "claimed": {
+                "$lt": now - timedelta(seconds=event_claim_timeout)
+            }
+        }]
+    }
+
+    ids = [
+        event["_id"] for event in db.achievement_events.find(
+            claimable, {"_id": 1}).sort("created", pymongo.ASCENDING).limit(
+                limit)
+    ]
+    if len(ids) == 0:
+        return token, []
+
+    match = {"_id": {"$in": ids}}
+    match.update(claimable)
+    db.achievement_events.update_many(match, {
+        "$set": {
+            "claim": token,
+            "claimed": now
+        },
+        "$inc": {
+            "attempts": 1
         }
+    })
 
-        info.update(instance_info)
-        data.update(info)
-        if acquired:
-            insert_earned_achievement(aid, data)
+    return token, list(
+        db.achievement_events.find({
+            "claim": token
+        }).sort("created", pymongo.ASCENDING))
+
+
+def process_achievement_events(limit=event_batch_size):
+    """
+    Claims a batch of pending events and evaluates their achievements.
+
+    Evaluated events are removed. Failed events are retried once their claim
+    times out, and dropped after event_max_attempts tries.
+
+    Args:
+        limit: the maximum number of events to process
+    Returns:
+        A dict with the number of events, failed events and earned
+        achievements.
+    """
+
+    db = api.common.get_conn()
+
+    token, events = claim_achievement_events(limit)
+    if len(events) == 0:
+        return {"events": 0, "failed": 0, "earned": 0}
+
+    context = AchievementContext(event["data"]["tid"] for event in events)
+
+    done = []
+    dropped = []
+    earned = 0
+    earned_tids = set()
+    for event in events:
+        try:
+            count = evaluate_achievements(event["event"], dict(event["data"]),
+                                          context, str(event["_id"]))
+            done.append(event["_id"])
+            if count > 0:
+                earned += count
+                earned_tids.add(event["data"]["tid"])
+        except Exception as error:
+            log.warning("Could not evaluate achievement event %s: %s",
+                        event["_id"], error)
+            if event["attempts"] >= event_max_attempts:
+                log.error("Dropping achievement event %s after %d attempts.",
+                          event["_id"], event["attempts"])
+                dropped.append(event["_id"])
+
+    if len(done) + len(dropped) > 0:
+        db.achievement_events.delete_many({
+            "_id": {
+                "$in": done + dropped
+            },
+            "claim": token
+        })
+
+    if len(earned_tids) > 0:
+        api.cache.invalidate(*[api.cache.tag("tid", tid) for tid in earned_tids])
+
+    return {
+        "events": len(events),
+        "failed": len(events) - len(done),
+        "earned": earned
+    }
+
+
+def count_pending_achievement_events():
+    """
+    Returns the number of events waiting for the achievement worker.
+    """
+
+    return api.common.get_conn().achievement_events.count()
 
 
 def insert_achievement(achievement):
@@ -384,7 +903,7 @@ def insert_achievement(achievement):
         raise WebException("achievement with identical name already exists.")
 
     db.achievements.insert(achievement)
-    api.cache.fast_cache.clear()
+    api.cache.invalidate("achievements")
 
     return achievement["aid"]
 
@@ -417,6 +936,6 @@ def update_achievement(aid, updated_achievement):
     achievement["aid"] = aid
 
     db.achievements.update({"aid": aid}, achievement)
-    api.cache.fast_cache.clear()
+    api.cache.invalidate("achievements")
 
     return achievement
@@ -28,6 +28,7 @@ def give_admin_role(name=None, uid=None):
         "admin": True,
         "teacher": True
     }})
+    api.auth.invalidate_request_identity()
 
 
 def give_teacher_role(name=None, uid=None):
@@ -43,6 +44,7 @@ def give_teacher_role(name=None, uid=None):
 
     user = api.user.get_user(name=name, uid=uid)
     db.users.update({"uid": user["uid"]}, {"$set": {"teacher": True}})
+    api.auth.invalidate_request_identity()
 
 
 def set_problem_availability(pid, disabled):
@@ -60,6 +62,7 @@ def set_problem_availability(pid, disabled):
     if len(problem["instances"]) > 0:
         result = api.problem.update_problem(pid, {"disabled": disabled})
         api.cache.clear_all()
+        api.scoreboard.rebuild_solver_scores([pid])
     else:
         raise WebException(
             "You cannot change the availability of \"{}\".".format(
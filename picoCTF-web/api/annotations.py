@@ -1,6 +1,7 @@
 """ API annotations and assorted wrappers. """
 
 import json
+import time
 import traceback
 from datetime import datetime
 from functools import wraps
@@ -9,7 +10,7 @@ import api
 import bson
 from api.common import (InternalException, SevereInternalException, WebError,
                         WebException, WebSuccess)
-from flask import abort, request, session
+from flask import abort, request, Response, session
 
 write_logs_to_db = False  # Default value, can be overwritten by api.py
 
@@ -56,32 +57,58 @@ def api_wrapper(f):
 
     @wraps(f)
     def wrapper(*args, **kwds):
-        web_result = {}
-        wrapper_log = api.logger.use(f.__module__)
-        try:
-            web_result = f(*args, **kwds)
-        except WebException as error:
-            web_result = WebError(_get_message(error), error.data)
-        except InternalException as error:
-            message = _get_message(error)
-            if type(error) == SevereInternalException:
-                wrapper_log.critical(traceback.format_exc())
-                web_result = WebError(
-                    "There was a critical internal error. Contact an administrator."
-                )
-            else:
-                wrapper_log.error(traceback.format_exc())
-                web_result = WebError(message)
-        except Exception as error:
-            wrapper_log.error(traceback.format_exc())
-            web_result = WebError(
-                "An error occurred. Please contact an administrator.")
-
-        return bson.json_util.dumps(web_result)
+        start = time.perf_counter()
+        web_result = _call_route(f, *args, **kwds)
+
+        if isinstance(web_result, Response):
+            response = web_result
+            size = response.calculate_content_length() or 0
+            error = response.status_code >= 400
+        elif isinstance(web_result, str):
+            # Already serialized, see WebSuccessSerialized
+            response = web_result
+            size = len(response)
+            error = False
+        else:
+            response = bson.json_util.dumps(web_result)
+            size = len(response)
+            error = isinstance(web_result,
+                               dict) and web_result.get("status") == 0
+
+        api.metrics.record_request(api.metrics.get_endpoint_name(),
+                                   time.perf_counter() - start, size, error)
+        return response
 
     return wrapper
 
 
+def _call_route(f, *args, **kwds):
+    """
+    Calls a routing function and turns exceptions into web errors.
+    Routing functions may also return a flask Response or an already
+    serialized string, which are passed through unchanged.
+    """
+
+    wrapper_log = api.logger.use(f.__module__)
+    try:
+        return f(*args, **kwds)
+    except WebException as error:
+        return WebError(_get_message(error), error.data)
+    except InternalException as error:
+        message = _get_message(error)
+        if type(error) == SevereInternalException:
+            wrapper_log.critical(traceback.format_exc())
+            return WebError(
+                "There was a critical internal error. Contact an administrator."
+            )
+        else:
+            wrapper_log.error(traceback.format_exc())
+            return WebError(message)
+    except Exception as error:
+        wrapper_log.error(traceback.format_exc())
+        return WebError("An error occurred. Please contact an administrator.")
+
+
 def require_login(f):
     """
     Wraps routing functions that require a user to be logged in
@@ -6,6 +6,7 @@ Problem management script.
 import argparse
 import glob
 import logging
+import multiprocessing
 import shutil
 import sys
 from os import makedirs, path, walk
@@ -124,6 +125,68 @@ def clear_collections(args):
         db[collection].remove()
 
 
+def index_database(args):
+    api.setup.index_mongo()
+
+
+def backfill_key_hashes(args):
+    updated, duplicates = api.problem.backfill_submission_key_hashes()
+    logging.info("Added key hashes to {} submissions, skipped {} duplicates".
+                 format(updated, duplicates))
+
+
+def reevaluate_submissions(args):
+
+    def progress(done, total, result):
+        logging.info("[{}/{}] {}: {} of {} submissions changed".format(
+            done, total, result["pid"], result["changed"],
+            result["submissions"]))
+
+    summary = api.reevaluation.reevaluate_submissions(
+        pids=args.pids or None,
+        processes=args.processes,
+        progress=progress)
+    logging.warning(
+        "Re-evaluated {} submissions of {} problems: {} changed, {} teams affected".
+        format(summary["submissions"], summary["problems"], summary["changed"],
+               len(summary["tids"])))
+
+
+def rebuild_scoreboard(args):
+    count = api.scoreboard.rebuild_team_scores()
+    logging.info("Rebuilt the scores of {} teams".format(count))
+
+
+def check_scoreboard(args):
+    inconsistencies = api.scoreboard.check_team_scores()
+    for inconsistency in inconsistencies:
+        logging.warning(json_util.dumps(inconsistency))
+
+    if len(inconsistencies) > 0:
+        logging.critical(
+            "Found {} inconsistent team scores. Run 'scoreboard rebuild' to fix them.".
+            format(len(inconsistencies)))
+        exit(1)
+
+
+def backfill_first_solves(args):
+    count = api.scoreboard.backfill_first_solves()
+    logging.info("Recorded the first solves of {} problems".format(count))
+
+
+def stats_report(args):
+    report = api.stats.get_stats_report(eligible=not args.ineligible)
+    output = get_output_file(args.output)
+    api.stats.write_stats_report(report, output, args.format)
+    if output != sys.stdout:
+        output.close()
+
+
+def backfill_flag_sharing(args):
+    count = api.flag_sharing.backfill_flag_sharing()
+    logging.info("Flagged {} submissions of other teams' flags".format(count))
+
+
 def get_output_file(output):
     if output == sys.stdout:
         return output
@@ -291,6 +354,18 @@ def main():
         default=sys.stdout)
     parser_problems_migrate.set_defaults(func=migrate_problems)
 
+    parser_problems_reevaluate = subparser_problems.add_parser(
+        "reevaluate", help="Re-grade the submissions of problems")
+    parser_problems_reevaluate.add_argument(
+        "pids", nargs="*", help="Problems to re-grade, defaults to all")
+    parser_problems_reevaluate.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of worker processes")
+    parser_problems_reevaluate.set_defaults(func=reevaluate_submissions)
+
     # Achievements
     parser_achievements = subparser.add_parser(
         'achievements', help='Deal with Achievements')
@@ -315,6 +390,65 @@ def main():
         "collections", nargs="+", help="Collections to clear")
     parser_database_clear.set_defaults(func=clear_collections)
 
+    parser_database_index = subparser_database.add_parser(
+        "index", help="Ensure the collections are indexed")
+    parser_database_index.set_defaults(func=index_database)
+
+    parser_database_key_hashes = subparser_database.add_parser(
+        "backfill-key-hashes",
+        help="Add key hashes to submissions made before they were recorded")
+    parser_database_key_hashes.set_defaults(func=backfill_key_hashes)
+
+    parser_database_flag_sharing = subparser_database.add_parser(
+        "backfill-flag-sharing",
+        help="Flag the stored submissions of other teams' flags")
+    parser_database_flag_sharing.set_defaults(func=backfill_flag_sharing)
+
+    # Scoreboard
+    parser_scoreboard = subparser.add_parser(
+        "scoreboard", help="Deal with the team score table")
+    subparser_scoreboard = parser_scoreboard.add_subparsers(
+        help="Select one of the following actions")
+
+    parser_scoreboard_rebuild = subparser_scoreboard.add_parser(
+        "rebuild", help="Rebuild the team score table from the submissions")
+    parser_scoreboard_rebuild.set_defaults(func=rebuild_scoreboard)
+
+    parser_scoreboard_check = subparser_scoreboard.add_parser(
+        "check", help="Check the team score table against the submissions")
+    parser_scoreboard_check.set_defaults(func=check_scoreboard)
+
+    parser_scoreboard_first_solves = subparser_scoreboard.add_parser(
+        "backfill-first-solves",
+        help="Rebuild the first solve of every problem from the submissions")
+    parser_scoreboard_first_solves.set_defaults(func=backfill_first_solves)
+
+    # Stats
+    parser_stats = subparser.add_parser(
+        "stats", help="Compute competition statistics")
+    subparser_stats = parser_stats.add_subparsers(
+        help="Select one of the following actions")
+
+    parser_stats_report = subparser_stats.add_parser(
+        "report", help="Write the post competition statistics report")
+    parser_stats_report.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        help="Output file",
+        default=sys.stdout)
+    parser_stats_report.add_argument(
+        "-f",
+        "--format",
+        choices=["json", "csv"],
+        default="json",
+        help="Output format")
+    parser_stats_report.add_argument(
+        "--ineligible",
+        action="store_true",
+        help="Include ineligible teams")
+    parser_stats_report.set_defaults(func=stats_report)
+
     args = parser.parse_args()
     if args.silent:
         logging.basicConfig(level=logging.CRITICAL, stream=sys.stdout)
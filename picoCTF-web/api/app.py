@@ -45,6 +45,10 @@ def config_app(*args, **kwargs):
 
     settings = api.config.get_settings()
 
+    api.cache.fast_cache.configure(
+        max_entries=app.config["FAST_CACHE_MAX_ENTRIES"],
+        max_bytes=app.config["FAST_CACHE_MAX_BYTES"])
+
     if settings["email"]["enable_email"]:
         app.config["MAIL_SERVER"] = settings["email"]["smtp_url"]
         app.config["MAIL_PORT"] = settings["email"]["smtp_port"]
@@ -56,6 +60,11 @@ def config_app(*args, **kwargs):
 
         api.email.mail = Mail(app)
 
+    try:
+        api.achievement.warm_processors()
+    except Exception as error:
+        log.warning("Could not load the achievement processors: %s", error)
+
     app.register_blueprint(api.routes.user.blueprint, url_prefix="/api/user")
     app.register_blueprint(api.routes.team.blueprint, url_prefix="/api/team")
     app.register_blueprint(api.routes.stats.blueprint, url_prefix="/api/stats")
@@ -66,7 +75,13 @@ def config_app(*args, **kwargs):
     app.register_blueprint(
         api.routes.achievements.blueprint, url_prefix="/api/achievements")
 
-    api.logger.setup_logs({"verbose": 2})
+    api.logger.setup_logs({
+        "verbose": 2,
+        "stats_queue_size": app.config["STATS_LOG_QUEUE_SIZE"],
+        "stats_batch_size": app.config["STATS_LOG_BATCH_SIZE"],
+        "stats_flush_interval": app.config["STATS_LOG_FLUSH_INTERVAL"],
+        "stats_full_policy": app.config["STATS_LOG_FULL_POLICY"]
+    })
     return app
 
 
@@ -91,8 +106,13 @@ def after_request(response):
             session['token'] = csrf_token
             response.set_cookie('token', csrf_token, domain=domain)
 
+    if app.config.get("REPORT_MONGO_COMMANDS", False):
+        response.headers.add('X-Mongo-Commands',
+                             str(api.common.get_request_command_count()))
+
     # JB: This is a hack. We need a better solution
-    if request.path[0:19] != "/api/autogen/serve/":
+    if request.path[0:19] != "/api/autogen/serve/" and \
+            response.mimetype != "text/plain":
         response.mimetype = 'application/json'
     return response
 
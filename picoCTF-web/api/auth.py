@@ -1,17 +1,25 @@
 """ Module dealing with authentication to the api """
 
+from copy import deepcopy
+
 import api
 import bcrypt
 from api.annotations import log_action
 from api.common import InternalException, safe_fail, validate, WebException
 from api.user import check
-from flask import session
+from flask import g, has_request_context, session
 from voluptuous import Length, Required, Schema
 
 log = api.logger.use(__name__)
 
 debug_disable_general_login = False
 
+# The request's user and team are loaded without their bulky fields. The
+# team's instance assignments are loaded separately, only by the requests
+# that need them, see get_request_team_instances.
+request_user_projection = {"_id": 0, "extdata": 0}
+request_team_projection = {"_id": 0, "instances": 0, "password": 0}
+
 user_login_schema = Schema({
     Required('username'):
     check(("Usernames must be between 3 and 50 characters.",
@@ -85,6 +93,120 @@ def logout():
     """
 
     session.clear()
+    invalidate_request_identity()
+
+
+def get_request_uid():
+    """
+    Gets the uid stored in the session of the current request without
+    checking that the account is still enabled.
+
+    Returns:
+        The uid or None outside of a request or when nobody is logged in.
+    """
+
+    if has_request_context():
+        return session.get("uid", None)
+    return None
+
+
+def _load_request_user():
+    """
+    Loads the session's user document once per request.
+    """
+
+    uid = get_request_uid()
+    if uid is None:
+        return None
+
+    if "request_user" not in g:
+        db = api.common.get_conn()
+        g.request_user = db.users.find_one({
+            "uid": uid
+        }, request_user_projection)
+
+    return g.request_user
+
+
+def get_request_user():
+    """
+    Gets the document of the user logged into the current request.
+    The document is read from the database at most once per request.
+
+    Returns:
+        A copy of the user document or None.
+    """
+
+    user = _load_request_user()
+    return deepcopy(user) if user is not None else None
+
+
+def get_request_tid():
+    """
+    Gets the team id of the user logged into the current request.
+
+    Returns:
+        The tid or None.
+    """
+
+    user = _load_request_user()
+    return user["tid"] if user is not None else None
+
+
+def get_request_team():
+    """
+    Gets the team document of the user logged into the current request.
+    The document is read from the database at most once per request.
+
+    Returns:
+        A copy of the team document or None.
+    """
+
+    tid = get_request_tid()
+    if tid is None:
+        return None
+
+    if "request_team" not in g:
+        db = api.common.get_conn()
+        g.request_team = db.teams.find_one({
+            "tid": tid
+        }, request_team_projection)
+
+    return deepcopy(g.request_team) if g.request_team is not None else None
+
+
+def get_request_team_instances():
+    """
+    Gets the instance assignments of the team of the user logged into the
+    current request. They are read from the database at most once per request.
+
+    Returns:
+        A copy of the dict of assigned iids by pid, or None.
+    """
+
+    tid = get_request_tid()
+    if tid is None:
+        return None
+
+    if "request_team_instances" not in g:
+        db = api.common.get_conn()
+        team = db.teams.find_one({"tid": tid}, {"_id": 0, "instances": 1})
+        g.request_team_instances = team["instances"] if team else None
+
+    instances = g.request_team_instances
+    return dict(instances) if instances is not None else None
+
+
+def invalidate_request_identity():
+    """
+    Forgets the user and team documents loaded for the current request.
+    Must be called after writing to the users or teams collections.
+    """
+
+    if has_request_context():
+        g.pop("request_user", None)
+        g.pop("request_team", None)
+        g.pop("request_team_instances", None)
 
 
 def is_logged_in():
@@ -97,7 +219,7 @@ def is_logged_in():
 
     logged_in = "uid" in session
     if logged_in:
-        user = safe_fail(api.user.get_user, uid=session["uid"])
+        user = _load_request_user()
         if not user or user["disabled"]:
             logout()
             return False
@@ -2,27 +2,343 @@
 Caching Library
 """
 
+import builtins
+import inspect
+import sys
+import threading
 import time
+from collections import defaultdict, OrderedDict
 from functools import wraps
 
 import api
 from bson import datetime, json_util
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 log = api.logger.use(__name__)
 
 no_cache = False
-fast_cache = {}
 _mongo_index = None
 
+# Default limits of the in-process tier. Overridden by FAST_CACHE_MAX_ENTRIES
+# and FAST_CACHE_MAX_BYTES in the app configuration.
+default_max_entries = 10000
+default_max_bytes = 64 * 1024 * 1024
+
+# Minimum number of seconds between two sweeps of expired entries.
+sweep_interval = 30
+
+# Arguments of memoized functions that automatically become dependency tags.
+tagged_arguments = ["tid", "uid", "pid", "gid"]
+
+# Invalidations are recorded in mongo so that the in-process tier of every
+# other process drops the same entries. A process checks for new records at
+# most every fast_sync_interval seconds, which bounds how long it serves a
+# result invalidated elsewhere. Records are kept for invalidation_retention
+# seconds; a process that did not check for longer clears its whole tier.
+# fast_sync_margin allows for clock differences between the processes.
+fast_sync_interval = 2
+fast_sync_margin = 1
+invalidation_retention = 600
+
+_fast_synced_at = None
+_fast_sync_lock = threading.Lock()
+
+# Seconds a single flight recomputation may hold its lease, and the number of
+# seconds other workers wait for it before recomputing themselves.
+lease_timeout = 30
+lease_wait = 5
+lease_poll_interval = 0.1
+
+
+def _estimate_size(value, depth=0):
+    """
+    Roughly estimates the memory used by a cached value.
+
+    Args:
+        value: the value
+        depth: recursion depth, nested containers below 8 levels are not counted
+    Returns:
+        The estimated size in bytes.
+    """
+
+    size = sys.getsizeof(value)
+    if depth >= 8:
+        return size
+
+    if isinstance(value, dict):
+        size += sum(
+            _estimate_size(k, depth + 1) + _estimate_size(v, depth + 1)
+            for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_estimate_size(item, depth + 1) for item in value)
+
+    return size
+
+
+class FastCache(object):
+    """
+    Bounded, thread safe LRU store backing memoize(fast=True).
+
+    Entries expire after their timeout and the least recently used entries
+    are evicted once either the entry count or the byte budget is exceeded.
+    Hits, misses, expirations and evictions are counted per function.
+    """
+
+    def __init__(self, max_entries=default_max_entries,
+                 max_bytes=default_max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._tags = defaultdict(builtins.set)
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    def configure(self, max_entries=None, max_bytes=None):
+        """
+        Changes the limits of the cache, evicting entries if necessary.
+        """
+
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key, default=None):
+        """
+        Gets a value from the cache.
+
+        Args:
+            key: the cache key
+            default: returned if the key is missing or expired
+        Returns:
+            The cached value.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key, None)
+            function = key.split("$", 1)[0]
+
+            if entry is None:
+                self._counters[function]["misses"] += 1
+                return default
+
+            if entry["expires"] is not None and entry["expires"] < time.time():
+                self._remove(key)
+                self._counters[function]["expirations"] += 1
+                self._counters[function]["misses"] += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self._counters[function]["hits"] += 1
+            return entry["result"]
+
+    def set(self, key, value, timeout=None, tags=None):
+        """
+        Stores a value in the cache.
+
+        Args:
+            key: the cache key
+            value: the value
+            timeout: seconds the value stays valid
+            tags: dependency tags used to invalidate the entry
+        """
+
+        size = _estimate_size(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = {
+                "result": value,
+                "expires": time.time() + timeout if timeout is not None else None,
+                "size": size,
+                "tags": tags or []
+            }
+            self._bytes += size
+            for tag in tags or []:
+                self._tags[tag].add(key)
+
+            if time.time() - self._last_sweep > sweep_interval:
+                self.sweep()
+
+            self._evict()
+
+    def delete(self, key):
+        """
+        Removes a key from the cache if it is present.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, *tags):
+        """
+        Removes every entry carrying any of the given tags.
+
+        Returns:
+            The number of removed entries.
+        """
+
+        with self._lock:
+            keys = builtins.set()
+            for tag in tags:
+                keys.update(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+
+        return len(keys)
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def sweep(self):
+        """
+        Removes every expired entry.
+
+        Returns:
+            The number of removed entries.
+        """
+
+        now = time.time()
+        with self._lock:
+            expired = [
+                key for key, entry in self._entries.items()
+                if entry["expires"] is not None and entry["expires"] < now
+            ]
+            for key in expired:
+                self._remove(key)
+                self._counters[key.split("$", 1)[0]]["expirations"] += 1
+            self._last_sweep = now
+
+        return len(expired)
+
+    def get_stats(self):
+        """
+        Returns the size of the cache and the per-function counters.
+        """
+
+        with self._lock:
+            entries = defaultdict(int)
+            sizes = defaultdict(int)
+            for key, entry in self._entries.items():
+                function = key.split("$", 1)[0]
+                entries[function] += 1
+                sizes[function] += entry["size"]
+
+            functions = {}
+            for function in self._counters.keys() | entries.keys():
+                counters = self._counters[function]
+                functions[function] = {
+                    "hits": counters["hits"],
+                    "misses": counters["misses"],
+                    "expirations": counters["expirations"],
+                    "evictions": counters["evictions"],
+                    "entries": entries[function],
+                    "bytes": sizes[function]
+                }
+
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "functions": functions
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        for tag in entry["tags"]:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._counters[key.split("$", 1)[0]]["evictions"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+fast_cache = FastCache()
+_missing = object()
+
+# Every VersionedSnapshot, rebuilt by clear_all.
+_snapshots = []
+
 
 def clear_all():
     """
-    Clears the cache.
+    Clears the cache and rebuilds every per-process snapshot.
     """
 
     db = api.common.get_conn()
     db.cache.remove()
     fast_cache.clear()
+    _record_invalidation([], clear=True)
+
+    for snapshot in _snapshots:
+        snapshot.invalidate()
+
+
+def tag(name, value):
+    """
+    Returns the dependency tag for an argument value, e.g. tid:<tid>.
+    """
+
+    return "{}:{}".format(name, value)
+
+
+def get_tags(f, *args, **kwargs):
+    """
+    Returns the dependency tags of a memoized function call. These are the
+    static tags given to memoize and a tag for every tid, uid, pid or gid
+    argument of the call.
+
+    Args:
+        f: the memoized function
+        args: positional arguments
+        kwargs: keyword arguments
+    Returns:
+        The list of tags.
+    """
+
+    tags = list(getattr(f, "cache_tags", []))
+
+    try:
+        arguments = inspect.signature(f).bind_partial(*args,
+                                                      **kwargs).arguments
+    except TypeError:
+        arguments = kwargs
+
+    for name in tagged_arguments:
+        if arguments.get(name, None) is not None:
+            tags.append(tag(name, arguments[name]))
+
+    return tags
 
 
 def get_mongo_key(f, *args, **kwargs):
@@ -71,6 +387,31 @@ def get_key(f, *args, **kwargs):
     return key
 
 
+def _get_partial_key(key):
+    """
+    Returns the part of a mongo key that is used to look up an entry.
+    We aren't interested in matching the unordered kwargs.
+    """
+
+    partial_key = key.copy()
+    partial_key.pop("kwargs", None)
+    return partial_key
+
+
+def get_entry(key):
+    """
+    Get the full mongo cache entry of a key, including its freshness.
+
+    Args:
+        key: mongo cache key
+    Returns:
+        The entry or None if it does not exist.
+    """
+
+    db = api.common.get_conn()
+    return db.cache.find_one(_get_partial_key(key))
+
+
 def get(key, fast=False):
     """
     Get a key from the cache.
@@ -83,21 +424,16 @@ def get(key, fast=False):
     """
 
     if fast:
-        return fast_cache.get(key, None)
-
-    db = api.common.get_conn()
-
-    # We aren't interested in matching the unordered kwargs.
-    partial_key = key.copy()
-    partial_key.pop("kwargs", None)
+        sync_fast_cache()
+        return fast_cache.get(key)
 
-    cached_result = db.cache.find_one(partial_key)
+    cached_result = get_entry(key)
 
     if cached_result:
         return cached_result["value"]
 
 
-def set(key, value, timeout=None, fast=False):
+def set(key, value, timeout=None, fast=False, tags=None, stale=None):
     """
     Set a key in the cache.
 
@@ -105,42 +441,111 @@ def set(key, value, timeout=None, fast=False):
         key: The cache key.
         timeout: Time the key is valid.
         fast: whether or not to use the fast cache
+        tags: dependency tags used to invalidate the key
+        stale: additional time an expired mongo entry is kept to be served
+               while it is recomputed
     """
 
     if fast:
-        fast_cache[key] = {
-            "result": value,
-            "timeout": timeout,
-            "set_time": time.time()
-        }
+        fast_cache.set(key, value, timeout=timeout, tags=tags)
         return
 
     db = api.common.get_conn()
 
     update = key.copy()
-    update.update({"value": value})
+    update.update({"value": value, "tags": tags or []})
 
     if timeout is not None:
-        expireAt = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
-        update.update({"expireAt": expireAt})
+        now = datetime.datetime.utcnow()
+        fresh_until = now + datetime.timedelta(seconds=timeout)
+        update.update({
+            "freshUntil": fresh_until,
+            "expireAt": fresh_until + datetime.timedelta(seconds=stale or 0)
+        })
 
-    db.cache.update(key, update, upsert=True)
+    db.cache.update(_get_partial_key(key), update, upsert=True)
 
 
-def timed_out(info):
+def is_fresh(entry):
     """
-    Determines if a fast_cache entry has been timed out
+    Determines if a mongo cache entry has not yet timed out.
     """
 
-    return int(time.time()) - info['set_time'] > info['timeout']
+    fresh_until = entry.get("freshUntil", None)
+    return fresh_until is None or fresh_until > datetime.datetime.utcnow()
 
 
-def memoize(timeout=None, fast=False):
+def get_lease_id(key):
+    """
+    Returns the id of the recomputation lease of a mongo cache key.
+    """
+
+    return api.common.hash(json_util.dumps(_get_partial_key(key)))
+
+
+def acquire_lease(lease_id, duration=None):
+    """
+    Tries to acquire a lease recorded in mongo. Only one worker can hold a
+    lease at a time. Leases that are not released expire after their duration.
+
+    Args:
+        lease_id: the lease identifier
+        duration: seconds the lease is held at most
+    Returns:
+        The owner token of the lease if it was acquired, None otherwise.
+    """
+
+    db = api.common.get_conn()
+
+    now = datetime.datetime.utcnow()
+    expire_at = now + datetime.timedelta(seconds=duration or lease_timeout)
+    owner = api.common.token()
+
+    try:
+        db.cache_leases.find_one_and_update(
+            {
+                "_id": lease_id,
+                "expireAt": {
+                    "$lt": now
+                }
+            }, {"$set": {
+                "expireAt": expire_at,
+                "owner": owner
+            }},
+            upsert=True)
+        return owner
+    except DuplicateKeyError:
+        return None
+
+
+def release_lease(lease_id, owner):
+    """
+    Releases a lease acquired with acquire_lease. A lease that expired and
+    was acquired by another worker in the meantime is left alone.
+
+    Args:
+        lease_id: the lease identifier
+        owner: the owner token returned by acquire_lease
+    """
+
+    db = api.common.get_conn()
+    db.cache_leases.remove({"_id": lease_id, "owner": owner})
+
+
+def memoize(timeout=None, fast=False, tags=None, single_flight=False,
+            stale=None):
     """
     Cache a function based on its arguments.
 
     Args:
         timeout: Time the result stays valid in the cache.
+        fast: Whether to use the in-process cache instead of mongo.
+        tags: Static dependency tags, e.g. ["problems"]. Tags for the tid,
+              uid, pid and gid arguments are added automatically.
+        single_flight: On a miss, only one worker recomputes the result under
+                       a lease while the others wait for it.
+        stale: Seconds an expired result is still served while a single
+               background recomputation refreshes it.
     Returns:
         The functions result.
     """
@@ -148,11 +553,97 @@ def memoize(timeout=None, fast=False):
     assert (not fast or (fast and timeout is not None)
            ), "You cannot set fast cache without a timeout!"
 
+    assert not (fast and (single_flight or stale is not None)
+               ), "Single flight and stale results require the mongo cache!"
+
+    assert (stale is None or timeout is not None
+           ), "You cannot serve stale results without a timeout!"
+
     def decorator(f):
         """
         Inner decorator
         """
 
+        def compute(key, *args, **kwargs):
+            """
+            Calls the function and stores its result.
+            """
+
+            function_result = f(*args, **kwargs)
+            set(key,
+                function_result,
+                timeout=timeout,
+                fast=fast,
+                tags=get_tags(wrapper, *args, **kwargs),
+                stale=stale)
+
+            return function_result
+
+        def revalidate(key, lease_id, owner, *args, **kwargs):
+            """
+            Recomputes a stale result and releases the lease. Runs in its own
+            thread, so it needs an app context of its own.
+            """
+
+            with api.app.app.app_context():
+                try:
+                    compute(key, *args, **kwargs)
+                except Exception:
+                    log.exception("Could not revalidate %s", key["function"])
+                finally:
+                    release_lease(lease_id, owner)
+
+        def compute_single_flight(key, *args, **kwargs):
+            """
+            Recomputes a missing result in at most one worker at a time.
+            """
+
+            lease_id = get_lease_id(key)
+            owner = acquire_lease(lease_id)
+
+            if owner is not None:
+                try:
+                    return compute(key, *args, **kwargs)
+                finally:
+                    release_lease(lease_id, owner)
+
+            deadline = time.time() + lease_wait
+            while time.time() < deadline:
+                time.sleep(lease_poll_interval)
+                entry = get_entry(key)
+                if entry is not None and is_fresh(entry):
+                    return entry["value"]
+
+            # The lease holder is taking too long, compute it ourselves.
+            return compute(key, *args, **kwargs)
+
+        def lookup(*args, **kwargs):
+            """
+            Mongo cache lookup honoring single flight and stale results.
+            """
+
+            key = get_mongo_key(f, *args, **kwargs)
+            entry = get_entry(key)
+
+            if entry is not None and is_fresh(entry):
+                return entry["value"]
+
+            if entry is not None and stale is not None:
+                lease_id = get_lease_id(key)
+                owner = acquire_lease(lease_id)
+                if owner is not None:
+                    threading.Thread(
+                        target=revalidate,
+                        args=(key, lease_id, owner) + args,
+                        kwargs=kwargs,
+                        daemon=True).start()
+                return entry["value"]
+
+            if single_flight:
+                return compute_single_flight(key, *args, **kwargs)
+
+            return compute(key, *args, **kwargs)
+
         @wraps(f)
         def wrapper(*args, **kwargs):
             """
@@ -163,36 +654,232 @@ def memoize(timeout=None, fast=False):
                 kwargs.pop("cache", None)
                 return f(*args, **kwargs)
 
-            key = get_key(f, *args, **kwargs) if fast else get_mongo_key(
-                f, *args, **kwargs)
-            cached_result = get(key, fast=fast)
+            if not fast:
+                if no_cache:
+                    return compute(
+                        get_mongo_key(f, *args, **kwargs), *args, **kwargs)
+                return lookup(*args, **kwargs)
 
-            if cached_result is None or no_cache or (fast and
-                                                     timed_out(cached_result)):
-                function_result = f(*args, **kwargs)
-                set(key, function_result, timeout=timeout, fast=fast)
+            key = get_key(f, *args, **kwargs)
+            sync_fast_cache()
+            cached_result = fast_cache.get(key, _missing)
 
-                return function_result
+            if cached_result is _missing or no_cache:
+                return compute(key, *args, **kwargs)
 
-            return cached_result['result'] if fast else cached_result
+            return cached_result
+
+        wrapper.cache_tags = tags or []
+        wrapper.cache_timeout = timeout
+        wrapper.cache_fast = fast
+        wrapper.cache_stale = stale
 
         return wrapper
 
     return decorator
 
 
-def invalidate_memoization(f, *keys):
+def refresh(f, *args, **kwargs):
     """
-    Invalidate a memoized function.
+    Recomputes a memoized function and stores the result in the cache.
 
     Args:
-        f: the function
-        You must pass all arguments given to the function to accurately invalidate it.
+        f: the memoized function
+        args: positional arguments
+        kwargs: keyword arguments
+    Returns:
+        The functions result.
+    """
+
+    result = f(cache=False, *args, **kwargs)
+
+    if f.cache_fast:
+        key = get_key(f, *args, **kwargs)
+    else:
+        key = get_mongo_key(f, *args, **kwargs)
+
+    set(key,
+        result,
+        timeout=f.cache_timeout,
+        fast=f.cache_fast,
+        tags=get_tags(f, *args, **kwargs),
+        stale=f.cache_stale)
+
+    return result
+
+
+def invalidate(*tags):
+    """
+    Invalidates every memoized result that depends on any of the given tags.
+    The mongo tier and the in-process tier of this process are invalidated
+    right away, the in-process tier of other processes within
+    fast_sync_interval seconds, see sync_fast_cache.
+
+    Args:
+        tags: dependency tags, e.g. tag("tid", tid) or "problems"
+    """
+
+    db = api.common.get_conn()
+    db.cache.remove({"tags": {"$in": list(tags)}})
+
+    fast_cache.invalidate(*tags)
+    _record_invalidation(tags)
+
+
+def _record_invalidation(tags, clear=False):
+    """
+    Records an invalidation for the in-process tier of the other processes.
+    """
+
+    db = api.common.get_conn()
+
+    now = datetime.datetime.utcnow()
+    db.cache_invalidations.insert_one({
+        "tags": list(tags),
+        "clear": clear,
+        "at": now,
+        "expireAt": now + datetime.timedelta(seconds=invalidation_retention)
+    })
+
+
+def sync_fast_cache(force=False):
+    """
+    Applies the invalidations recorded by other processes since the last
+    check to the in-process tier. Checks at most every fast_sync_interval
+    seconds unless forced.
+
+    Args:
+        force: check regardless of the time of the last check
+    """
+
+    global _fast_synced_at
+
+    now = datetime.datetime.utcnow()
+    with _fast_sync_lock:
+        since = _fast_synced_at
+        if not force and since is not None and \
+                (now - since).total_seconds() < fast_sync_interval:
+            return
+        _fast_synced_at = now
+
+    if since is None:
+        # Nothing was cached before the first check could have been missed.
+        return
+
+    if (now - since).total_seconds() > invalidation_retention:
+        fast_cache.clear()
+        return
+
+    db = api.common.get_conn()
+
+    tags = builtins.set()
+    for record in db.cache_invalidations.find({
+            "at": {
+                "$gte": since - datetime.timedelta(seconds=fast_sync_margin)
+            }
+    }, {
+            "_id": 0,
+            "tags": 1,
+            "clear": 1
+    }):
+        if record["clear"]:
+            fast_cache.clear()
+            return
+        tags.update(record["tags"])
+
+    if len(tags) > 0:
+        fast_cache.invalidate(*tags)
+
+
+def get_version(name):
+    """
+    Returns the current value of a named version counter. Per-process
+    structures derived from the database compare it against the version
+    they were built from to notice changes made by other processes.
+
+    Args:
+        name: the counter name, e.g. "bundles"
+    Returns:
+        The version, 0 if the counter was never bumped.
     """
 
     db = api.common.get_conn()
 
-    search = {"function": "{}.{}".format(f.__module__, f.__name__)}
-    search.update({"$or": list(keys)})
+    version = db.versions.find_one({"name": name}, {"_id": 0, "version": 1})
+    return version["version"] if version is not None else 0
+
+
+def bump_version(name):
+    """
+    Increments a named version counter.
+
+    Args:
+        name: the counter name
+    Returns:
+        The new version.
+    """
+
+    db = api.common.get_conn()
+
+    version = db.versions.find_one_and_update(
+        {"name": name}, {"$inc": {"version": 1}},
+        projection={"_id": 0, "version": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER)
+    return version["version"]
+
+
+class VersionedSnapshot(object):
+    """
+    Per-process structure derived from the database, such as the problem
+    catalog. It is rebuilt when its version counter changes. The counter is
+    checked at most every check_interval seconds, so other processes see a
+    change after at most that long; the process making the change rebuilds
+    on its next access.
+    """
+
+    def __init__(self, name, build, check_interval=2):
+        """
+        Args:
+            name: the name of the version counter
+            build: function building the structure from the database
+            check_interval: minimum seconds between two version checks
+        """
+
+        self.name = name
+        self.build = build
+        self.check_interval = check_interval
+
+        self.value = None
+        self.version = None
+        self.checked_at = 0
+        self.lock = threading.RLock()
+
+        _snapshots.append(self)
+
+    def get(self):
+        """
+        Returns the structure, rebuilding it if the version changed.
+        """
+
+        with self.lock:
+            now = time.time()
+            if self.value is None or now - self.checked_at >= self.check_interval:
+                # Read the version first so a concurrent change is seen later.
+                version = get_version(self.name)
+                if self.value is None or version != self.version:
+                    self.value = self.build()
+                    self.version = version
+                self.checked_at = now
+
+            return self.value
+
+    def invalidate(self):
+        """
+        Signals a change of the underlying data to every process and drops
+        the structure of this process.
+        """
 
-    db.cache.remove(search)
+        bump_version(self.name)
+        with self.lock:
+            self.value = None
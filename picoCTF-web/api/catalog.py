@@ -0,0 +1,144 @@
+"""
+In-memory problem catalog.
+
+The problems change only when an admin loads problems or changes their
+availability, but nearly every request reads them. Every process keeps a
+snapshot of the problems collection indexed by pid, name, sanitized name,
+category, instance id and flag, and rebuilds it when the "catalog" version
+changes.
+
+The snapshot is shared between requests and must not be modified. The
+accessors of api.problem hand out shallow copies.
+"""
+
+from collections import defaultdict
+
+import api
+
+log = api.logger.use(__name__)
+
+
+class Catalog(object):
+    """
+    Snapshot of all problems.
+    """
+
+    def __init__(self, problems):
+        # Same order as sorting by score and then name in mongo
+        self.problems = tuple(
+            sorted(problems, key=lambda p: (p["score"], p["name"])))
+
+        self.by_pid = {}
+        self.by_name = {}
+        self.by_sanitized_name = {}
+        self.by_category = defaultdict(list)
+        self.instances = {}
+        self.instance_pids = {}
+        self.flag_iids = {}
+        self.flag_instances = defaultdict(list)
+
+        for problem in self.problems:
+            self.by_pid[problem["pid"]] = problem
+            self.by_name[problem["name"]] = problem
+            if "sanitized_name" in problem:
+                self.by_sanitized_name[problem["sanitized_name"]] = problem
+            self.by_category[problem["category"]].append(problem)
+
+            for instance in problem.get("instances", []):
+                if "iid" in instance:
+                    self.instances[instance["iid"]] = instance
+                    self.instance_pids[instance["iid"]] = problem["pid"]
+                    if "flag" in instance:
+                        self.flag_iids.setdefault(instance["flag"],
+                                                  instance["iid"])
+                        self.flag_instances[instance["flag"]].append(
+                            (problem["pid"], instance["iid"]))
+
+        self.by_category = {
+            category: tuple(problems)
+            for category, problems in self.by_category.items()
+        }
+        self.flag_instances = {
+            flag: tuple(instances)
+            for flag, instances in self.flag_instances.items()
+        }
+
+        self.enabled = tuple(p for p in self.problems if not p["disabled"])
+        self.enabled_by_category = {
+            category: tuple(p for p in problems if not p["disabled"])
+            for category, problems in self.by_category.items()
+        }
+        self.categories = sorted(self.by_category)
+        self.enabled_categories = sorted(
+            category
+            for category, problems in self.enabled_by_category.items()
+            if len(problems) > 0)
+
+    def find(self, category=None, show_disabled=False):
+        """
+        Returns the problems of a category, or of every category.
+
+        Args:
+            category: Optional category
+            show_disabled: Whether to include disabled problems
+        Returns:
+            Tuple of problems sorted by score and name.
+        """
+
+        if category is None:
+            return self.problems if show_disabled else self.enabled
+
+        if show_disabled:
+            return self.by_category.get(category, ())
+        return self.enabled_by_category.get(category, ())
+
+    def get_instance(self, pid, iid):
+        """
+        Returns an instance of a problem by iid.
+
+        Args:
+            pid: the problem id
+            iid: the instance id
+        Returns:
+            The instance, or None if the problem has no such instance.
+        """
+
+        if self.instance_pids.get(iid) != pid:
+            return None
+        return self.instances[iid]
+
+
+def _build_catalog():
+    db = api.common.get_conn()
+    return Catalog(db.problems.find({}, {"_id": 0}))
+
+
+_catalog = api.cache.VersionedSnapshot("catalog", _build_catalog)
+
+
+def get_catalog():
+    """
+    Returns the problem catalog, rebuilding it if the problems changed.
+
+    Returns:
+        The Catalog.
+    """
+
+    return _catalog.get()
+
+
+def invalidate_catalog():
+    """
+    Signals that the problems changed. Every process rebuilds its catalog.
+    """
+
+    _catalog.invalidate()
+
+
+def get_version():
+    """
+    Returns the catalog version the current catalog was built from.
+    """
+
+    get_catalog()
+    return _catalog.version
@@ -4,7 +4,9 @@ from hashlib import md5
 
 import api
 import bcrypt
-from pymongo import MongoClient
+from bson import json_util
+from flask import g, has_request_context
+from pymongo import monitoring, MongoClient
 from pymongo.errors import ConnectionFailure, InvalidName
 from voluptuous import Invalid, MultipleInvalid
 from werkzeug.contrib.cache import SimpleCache
@@ -15,6 +17,46 @@ __connection = None
 __client = None
 
 
+class RequestCommandCounter(monitoring.CommandListener):
+    """
+    Counts the mongo commands issued while handling the current request and
+    records their duration per collection in api.metrics.
+    """
+
+    def __init__(self):
+        self.collections = {}
+
+    def started(self, event):
+        if has_request_context():
+            g.mongo_commands = g.get("mongo_commands", 0) + 1
+
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = "$cmd"
+        self.collections[event.request_id] = collection
+
+    def succeeded(self, event):
+        api.metrics.record_command(
+            self.collections.pop(event.request_id, "$cmd"),
+            event.duration_micros / 1e6)
+
+    def failed(self, event):
+        api.metrics.record_command(
+            self.collections.pop(event.request_id, "$cmd"),
+            event.duration_micros / 1e6,
+            failed=True)
+
+
+def get_request_command_count():
+    """
+    Returns the number of mongo commands issued by the current request so far.
+    """
+
+    return g.get("mongo_commands", 0) if has_request_context() else 0
+
+
 def get_conn():
     """
     Get a database connection
@@ -37,7 +79,8 @@ def get_conn():
                                                   conf["MONGO_PORT"],
                                                   conf["MONGO_DB_NAME"])
 
-            __client = MongoClient(uri)
+            __client = MongoClient(
+                uri, event_listeners=[RequestCommandCounter()])
             __connection = __client[conf["MONGO_DB_NAME"]]
         except ConnectionFailure:
             raise SevereInternalException(
@@ -50,6 +93,17 @@ def get_conn():
     return __connection
 
 
+def reset_conn():
+    """
+    Discards the database connection of this process. Must be called in
+    processes forked after the connection was made.
+    """
+
+    global __client, __connection
+    __client = None
+    __connection = None
+
+
 def token():
     """
     Generate a token, should be random but does not have to be secure necessarily. Speed is a priority.
@@ -89,6 +143,15 @@ def WebSuccess(message=None, data=None):
     return {"status": 1, "message": message, "data": data}
 
 
+def WebSuccessSerialized(data, message=None):
+    """
+    Successful web request wrapper for data that is already serialized.
+    """
+
+    return '{{"status": 1, "message": {}, "data": {}}}'.format(
+        json_util.dumps(message), data)
+
+
 def WebError(message=None, data=None):
     """
     Unsuccessful web request wrapper.
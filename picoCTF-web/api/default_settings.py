@@ -9,3 +9,20 @@ SECRET_KEY = "INSECURE_DEFAULT_CHANGE_ME"
 SESSION_COOKIE_DOMAIN = None
 SESSION_COOKIE_PATH = "/"
 SESSION_COOKIE_NAME = "flask"
+
+# Limits of the per-process memoize(fast=True) cache
+FAST_CACHE_MAX_ENTRIES = 10000
+FAST_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Statistics logging queue. Records are written to mongo in batches of up
+# to STATS_LOG_BATCH_SIZE every STATS_LOG_FLUSH_INTERVAL seconds. When the
+# queue is full records are either dropped ("drop") or the request waits
+# for room ("block").
+STATS_LOG_QUEUE_SIZE = 10000
+STATS_LOG_BATCH_SIZE = 100
+STATS_LOG_FLUSH_INTERVAL = 1.0
+STATS_LOG_FULL_POLICY = "drop"
+
+# Report the number of mongo commands of each request in the
+# X-Mongo-Commands response header
+REPORT_MONGO_COMMANDS = False
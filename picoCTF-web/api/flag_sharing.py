@@ -0,0 +1,260 @@
+"""
+Flag sharing detection.
+
+A team that submits the flag of another instance of a problem than its own
+most likely got it from the teams that instance belongs to. The catalog
+indexes the problem instances by flag, so submit_key checks every incorrect
+submission with a single dictionary lookup and records the hits right away.
+
+Detections are kept in the flag_sharing collection with the instance, the
+teams it belongs to and the groups the submitting team is a member of, so
+team and classroom pages read them with a single indexed query.
+backfill_flag_sharing rebuilds the collection from the stored submissions,
+e.g. after problems were loaded or submissions were re-evaluated.
+"""
+
+import api
+import pymongo
+
+log = api.logger.use(__name__)
+
+flagged_projection = {"_id": 0, "refresh": 0}
+
+# Number of submissions fetched per round trip while backfilling.
+backfill_batch_size = 1000
+
+
+def find_shared_instances(pid, key):
+    """
+    Finds the instances of a problem whose flag is the submitted key.
+
+    Args:
+        pid: the problem id
+        key: the submitted key
+    Returns:
+        A list of iids.
+    """
+
+    return [
+        iid
+        for instance_pid, iid in api.catalog.get_catalog().flag_instances.get(
+            key, ()) if instance_pid == pid
+    ]
+
+
+def get_instance_owners(pid, iids):
+    """
+    Finds the teams that were assigned instances of a problem.
+
+    Args:
+        pid: the problem id
+        iids: the instance ids
+    Returns:
+        A dict of lists of tids by iid.
+    """
+
+    db = api.common.get_conn()
+
+    owners = {iid: [] for iid in iids}
+    for team in db.teams.find({
+            "instances." + pid: {
+                "$in": list(iids)
+            }
+    }, {
+            "_id": 0,
+            "tid": 1,
+            "instances." + pid: 1
+    }):
+        owners[team["instances"][pid]].append(team["tid"])
+
+    return owners
+
+
+def _flagged(submission, iid, owners, gids, username, problem_name):
+    """
+    Builds the flag_sharing document of a submission.
+    """
+
+    flagged = {
+        key: value
+        for key, value in submission.items() if key not in ["_id", "refresh"]
+    }
+    flagged.update({
+        "iid": iid,
+        "owners": owners,
+        "gids": gids,
+        "username": username,
+        "problem_name": problem_name
+    })
+    if "key_hash" not in flagged:
+        flagged["key_hash"] = api.common.hash(flagged["key"])
+    return flagged
+
+
+def _key(flagged):
+    return {
+        "tid": flagged["tid"],
+        "pid": flagged["pid"],
+        "key_hash": flagged["key_hash"]
+    }
+
+
+def check_submission(submission, username, problem_name):
+    """
+    Records an incorrect submission if its key is the flag of another team's
+    instance.
+
+    Args:
+        submission: the submission
+        username: the name of the submitting user
+        problem_name: the name of the problem
+    Returns:
+        True if the submission was flagged.
+    """
+
+    db = api.common.get_conn()
+
+    iids = find_shared_instances(submission["pid"], submission["key"])
+    if len(iids) == 0:
+        return False
+
+    owners = get_instance_owners(submission["pid"], iids)
+    for iid in iids:
+        # The team's own flag can be wrong, e.g. with a custom grader.
+        if submission["tid"] in owners[iid]:
+            return False
+
+    iid = iids[0]
+    gids = api.group.get_team_gids([submission["tid"]])[submission["tid"]]
+    flagged = _flagged(submission, iid, owners[iid], gids, username,
+                       problem_name)
+    db.flag_sharing.replace_one(_key(flagged), flagged, upsert=True)
+
+    log.info("Team %s submitted the flag of instance %s of %s.",
+             submission["tid"], iid, submission["pid"])
+    return True
+
+
+def backfill_flag_sharing(pids=None):
+    """
+    Rebuilds the flagged submissions by streaming the stored incorrect
+    submissions through the flag index once.
+
+    Args:
+        pids: the problems to rebuild, defaults to every problem
+    Returns:
+        The number of flagged submissions.
+    """
+
+    db = api.common.get_conn()
+    catalog = api.catalog.get_catalog()
+
+    token = api.common.token()
+
+    match = {
+        "correct": False,
+        "key": {
+            "$in": list(catalog.flag_instances)
+        }
+    }
+    if pids is not None:
+        match["pid"] = {"$in": list(pids)}
+
+    candidates = []
+    for submission in db.submissions.find(match, {
+            "_id": 0
+    }).batch_size(backfill_batch_size):
+        iids = find_shared_instances(submission["pid"], submission["key"])
+        if len(iids) > 0:
+            candidates.append((submission, iids))
+
+    # Instance assignments of every team, loaded once.
+    owners = {}
+    if len(candidates) > 0:
+        for team in db.teams.find({}, {"_id": 0, "tid": 1, "instances": 1}):
+            for pid, iid in team.get("instances", {}).items():
+                owners.setdefault(iid, []).append(team["tid"])
+
+    shared = []
+    for submission, iids in candidates:
+        if not any(submission["tid"] in owners.get(iid, []) for iid in iids):
+            shared.append((submission, iids[0]))
+
+    tids = set(submission["tid"] for submission, iid in shared)
+    gids = api.group.get_team_gids(tids)
+    usernames = {
+        user["uid"]: user["username"]
+        for user in db.users.find({
+            "uid": {
+                "$in": list(set(submission["uid"] for submission, iid in shared))
+            }
+        }, {
+            "_id": 0,
+            "uid": 1,
+            "username": 1
+        })
+    }
+
+    flagged = []
+    for submission, iid in shared:
+        document = _flagged(submission, iid, owners.get(iid, []),
+                            gids[submission["tid"]],
+                            usernames.get(submission["uid"]),
+                            catalog.by_pid[submission["pid"]]["name"])
+        document["refresh"] = token
+        flagged.append(
+            pymongo.ReplaceOne(_key(document), document, upsert=True))
+
+    if len(flagged) > 0:
+        db.flag_sharing.bulk_write(flagged, ordered=False)
+
+    # Whatever was not found again is no longer flagged.
+    stale = {"refresh": {"$ne": token}}
+    if pids is not None:
+        stale["pid"] = {"$in": list(pids)}
+    db.flag_sharing.delete_many(stale)
+
+    return len(flagged)
+
+
+def sync_team_groups(tid):
+    """
+    Updates the groups of a team's flagged submissions after it joined or
+    left a group.
+
+    Args:
+        tid: the team id
+    """
+
+    db = api.common.get_conn()
+
+    db.flag_sharing.update_many({
+        "tid": tid
+    }, {"$set": {
+        "gids": api.group.get_team_gids([tid])[tid]
+    }})
+
+
+def get_flagged_submissions(tids=None, gid=None):
+    """
+    Gets the flagged submissions.
+
+    Args:
+        tids: optional list of teams to restrict the submissions to
+        gid: optional group whose members' submissions to return
+    Returns:
+        A list of submissions with the username and problem name, ordered by
+        time.
+    """
+
+    db = api.common.get_conn()
+
+    match = {}
+    if tids is not None:
+        match["tid"] = {"$in": list(tids)}
+    if gid is not None:
+        match["gids"] = gid
+
+    return list(
+        db.flag_sharing.find(match, flagged_projection).sort(
+            "timestamp", pymongo.ASCENDING))
@@ -85,6 +85,52 @@ def get_group(gid=None, name=None, owner_tid=None):
     return group
 
 
+def get_team_gids(tids):
+    """
+    Finds the groups teams are members of, using the index on the members.
+
+    Args:
+        tids: the team ids
+    Returns:
+        A dict of lists of gids by tid.
+    """
+
+    db = api.common.get_conn()
+
+    gids = {tid: [] for tid in tids}
+    for group in db.groups.find({
+            "members": {
+                "$in": list(tids)
+            }
+    }, {
+            "_id": 0,
+            "gid": 1,
+            "members": 1
+    }):
+        for tid in group["members"]:
+            if tid in gids:
+                gids[tid].append(group["gid"])
+
+    return gids
+
+
+def invalidate_team_groups(*tids):
+    """
+    Invalidates the cached results of the groups teams are members of, e.g.
+    after their scores changed.
+
+    Args:
+        tids: the team ids
+    """
+
+    gids = set()
+    for team_gids in get_team_gids(tids).values():
+        gids.update(team_gids)
+
+    if len(gids) > 0:
+        api.cache.invalidate(*[api.cache.tag("gid", gid) for gid in gids])
+
+
 def get_teacher_information(gid):
     """
     Retrieves the team information for all teams in a group.
@@ -97,11 +143,9 @@ def get_teacher_information(gid):
 
     group = get_group(gid=gid)
 
-    member_information = []
-    for tid in group["teachers"]:
-        team_information = api.team.get_team_information(tid=tid)
+    member_information = api.team.get_teams_information(group["teachers"])
+    for team_information in member_information:
         team_information["teacher"] = True
-        member_information.append(team_information)
 
     return member_information
 
@@ -116,16 +160,26 @@ def get_member_information(gid):
         A list of team information
     """
 
+    db = api.common.get_conn()
+
     group = get_group(gid=gid)
 
-    member_information = []
-    for tid in group["members"]:
-        team = api.team.get_team(tid=tid)
-        if team["size"] > 0:
-            member_information.append(
-                api.team.get_team_information(tid=team["tid"]))
+    nonempty = set(
+        team["tid"]
+        for team in db.teams.find({
+            "tid": {
+                "$in": group["members"]
+            },
+            "size": {
+                "$gt": 0
+            }
+        }, {
+            "_id": 0,
+            "tid": 1
+        }))
 
-    return member_information
+    return api.team.get_teams_information(
+        [tid for tid in group["members"] if tid in nonempty])
 
 
 @log_action
@@ -156,6 +210,8 @@ def create_group(tid, group_name):
         "gid": gid
     })
 
+    api.scoreboard.refresh_team_visibility(tid)
+
     return gid
 
 
@@ -194,6 +250,10 @@ def change_group_settings(gid, settings):
 
     db.groups.update({"gid": group["gid"]}, {"$set": {"settings": settings}})
 
+    if group["settings"]["hidden"] != settings["hidden"]:
+        for tid in [group["owner"]] + group["teachers"] + group["members"]:
+            api.scoreboard.refresh_team_visibility(tid)
+
 
 @log_action
 def join_group(gid, tid, teacher=False):
@@ -216,6 +276,9 @@ def join_group(gid, tid, teacher=False):
             api.admin.give_teacher_role(uid=uid)
 
     db.groups.update({'gid': gid}, {'$push': {role_group: tid}})
+    api.cache.invalidate(api.cache.tag("gid", gid))
+    api.scoreboard.refresh_team_visibility(tid)
+    api.flag_sharing.sync_team_groups(tid)
 
 
 def sync_teacher_status(tid, uid):
@@ -237,6 +300,7 @@ def sync_teacher_status(tid, uid):
     }, {"$set": {
         "teacher": active_teacher_roles > 0
     }})
+    api.auth.invalidate_request_identity()
 
 
 @log_action
@@ -264,6 +328,10 @@ def leave_group(gid, tid):
     if roles["member"]:
         db.groups.update({'gid': gid}, {'$pull': {"members": tid}})
 
+    api.cache.invalidate(api.cache.tag("gid", gid))
+    api.scoreboard.refresh_team_visibility(tid)
+    api.flag_sharing.sync_team_groups(tid)
+
 
 def switch_role(gid, tid, role):
     """
@@ -312,6 +380,9 @@ def switch_role(gid, tid, role):
     else:
         raise InternalException("Only supported roles are member and teacher.")
 
+    api.cache.invalidate(api.cache.tag("gid", gid))
+    api.flag_sharing.sync_team_groups(tid)
+
     # Disable promotion or demotion of teacher account
     #for uid in api.team.get_team_uids(tid=team["tid"]):
     #    sync_teacher_status(tid, uid)
@@ -328,7 +399,13 @@ def delete_group(gid):
 
     db = api.common.get_conn()
 
+    group = get_group(gid=gid)
     db.groups.remove({'gid': gid})
+    db.flag_sharing.update_many({"gids": gid}, {"$pull": {"gids": gid}})
+    api.cache.invalidate(api.cache.tag("gid", gid))
+
+    for tid in [group["owner"]] + group["teachers"] + group["members"]:
+        api.scoreboard.refresh_team_visibility(tid)
 
 
 def get_all_groups():
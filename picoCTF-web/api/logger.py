@@ -2,8 +2,12 @@
 Manage loggers for the api.
 """
 
+import atexit
 import logging
 import logging.handlers
+import os
+import queue
+import threading
 import time
 from datetime import datetime
 from sys import stdout
@@ -16,10 +20,18 @@ from flask import has_request_context, request
 critical_error_timeout = 600
 log = logging.getLogger(__name__)
 
+stats_handler = None
+
 
 class StatsHandler(logging.StreamHandler):
     """
     Logs statistical information into the mongodb.
+
+    Records are turned into documents in the logging thread and put on a
+    bounded queue. A background thread drains the queue and writes the
+    documents in batches. When the queue is full the record is either
+    dropped or the caller blocks until there is room, depending on the
+    full_policy.
     """
 
     time_format = "%H:%M:%S %Y-%m-%d"
@@ -83,13 +95,150 @@ class StatsHandler(logging.StreamHandler):
             lambda pid, source, result=None: {"pid": pid, "source": source}
     }
 
-    def __init__(self):
+    def __init__(self,
+                 queue_size=10000,
+                 batch_size=100,
+                 flush_interval=1.0,
+                 full_policy="drop"):
 
         logging.StreamHandler.__init__(self)
 
+        if full_policy not in ["drop", "block"]:
+            raise ValueError(
+                "Unknown full policy '{}'.".format(full_policy))
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.worker = None
+        self.worker_pid = None
+        self.worker_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+        self.counters_lock = threading.Lock()
+        self.counters = {"queued": 0, "written": 0, "dropped": 0, "failed": 0}
+
+        atexit.register(self.close)
+
+    def _count(self, counter, amount=1):
+        with self.counters_lock:
+            self.counters[counter] += amount
+
+    def _worker_running(self):
+        return self.worker_pid == os.getpid() and self.worker.is_alive()
+
+    def _ensure_worker(self):
+        """
+        Starts the writer thread on first use. Threads do not survive a
+        fork, so a worker process started from a preloaded app gets its own.
+        """
+
+        if self._worker_running():
+            return
+
+        with self.worker_lock:
+            if not self._worker_running():
+                if self.worker_pid != os.getpid():
+                    # Records queued by the parent belong to the parent.
+                    self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.stopping.clear()
+                self.worker = threading.Thread(
+                    target=self._run, name="stats-log-writer", daemon=True)
+                self.worker_pid = os.getpid()
+                self.worker.start()
+
+    def _next_batch(self):
+        """
+        Waits up to flush_interval for the first document and then takes
+        whatever else is already queued, up to batch_size documents.
+        """
+
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        if len(batch) == 0:
+            return
+
+        try:
+            api.common.get_conn().statistics.insert_many(batch, ordered=False)
+            self._count("written", len(batch))
+        except Exception as error:
+            self._count("failed", len(batch))
+            log.warning("Could not write %d statistics records: %s",
+                        len(batch), error)
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def _run(self):
+        while not self.stopping.is_set() or not self.queue.empty():
+            self._write(self._next_batch())
+
+    def enqueue(self, document):
+        """
+        Puts a document on the write queue according to the full policy.
+
+        Args:
+            document: the statistics document
+        """
+
+        self._ensure_worker()
+
+        try:
+            self.queue.put(document, block=self.full_policy == "block")
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+
+    def flush(self):
+        """
+        Blocks until every queued record has been written.
+        """
+
+        if self.worker is not None and self._worker_running():
+            self.queue.join()
+
+    def close(self):
+        """
+        Writes the remaining records and stops the writer thread.
+        """
+
+        if self.worker is not None and self.worker_pid == os.getpid():
+            self.stopping.set()
+            self.worker.join()
+        logging.StreamHandler.close(self)
+
+    def get_stats(self):
+        """
+        Returns the queue counters.
+
+        Returns:
+            A dict with the queue depth and the queued, written, dropped
+            and failed record counts.
+        """
+
+        with self.counters_lock:
+            stats = dict(self.counters)
+
+        stats.update({
+            "depth": self.queue.qsize(),
+            "max_size": self.queue.maxsize,
+            "full_policy": self.full_policy
+        })
+        return stats
+
     def emit(self, record):
         """
-        Store record into the db.
+        Queue record to be stored into the db.
         """
 
         information = get_request_information()
@@ -120,7 +269,7 @@ class StatsHandler(logging.StreamHandler):
 
                 information["action"].update(action_result)
 
-            api.common.get_conn().statistics.insert(information)
+            self.enqueue(information)
 
 
 class ExceptionHandler(logging.StreamHandler):
@@ -177,6 +326,19 @@ class SevereHandler(logging.handlers.SMTPHandler):
             self.messages[record.msg] = time.time()
 
 
+def get_stats_queue_stats():
+    """
+    Returns the counters of the statistics write queue.
+
+    Returns:
+        The StatsHandler queue counters, or None before the loggers are set up.
+    """
+
+    if stats_handler is None:
+        return None
+    return stats_handler.get_stats()
+
+
 def set_level(name, level):
     """
     Get and set log level of a given logger.
@@ -227,9 +389,21 @@ def get_request_information():
 
         if api.auth.is_logged_in():
 
-            user = api.user.get_user()
-            team = api.user.get_team()
-            groups = api.team.get_groups()
+            # The user and team are already loaded for this request.
+            user = api.auth.get_request_user()
+            team = api.auth.get_request_team()
+            groups = api.common.get_conn().groups.find({
+                "$or": [{
+                    "owner": team["tid"]
+                }, {
+                    "teachers": team["tid"]
+                }, {
+                    "members": team["tid"]
+                }]
+            }, {
+                "_id": 0,
+                "name": 1
+            })
 
             information["user"] = {
                 "username": user["username"],
@@ -268,7 +442,18 @@ def setup_logs(args):
         severe_error_log.setLevel(logging.CRITICAL)
         log.root.addHandler(severe_error_log)
 
-    stats_log = StatsHandler()
+    global stats_handler
+
+    if stats_handler is not None:
+        stats_handler.close()
+        log.root.removeHandler(stats_handler)
+
+    stats_log = StatsHandler(
+        queue_size=args.get("stats_queue_size", 10000),
+        batch_size=args.get("stats_batch_size", 100),
+        flush_interval=args.get("stats_flush_interval", 1.0),
+        full_policy=args.get("stats_full_policy", "drop"))
     stats_log.setLevel(logging.INFO)
+    stats_handler = stats_log
 
     log.root.addHandler(stats_log)
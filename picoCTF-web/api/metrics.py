@@ -0,0 +1,320 @@
+"""
+Request and database metrics.
+
+api_wrapper records the latency, response size and outcome of every API
+request, and the mongo command listener records the number and duration of
+the commands issued while handling it, per collection. The metrics are kept
+in memory per process and served at /api/admin/metrics as JSON or in the
+Prometheus text exposition format.
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+
+import api
+from flask import g, has_request_context, request
+
+log = api.logger.use(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds.
+latency_buckets = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    float("inf")
+]
+
+# Upper bounds of the response size histogram buckets, in bytes.
+size_buckets = [
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+    float("inf")
+]
+
+quantiles = [0.5, 0.95, 0.99]
+
+
+class Histogram(object):
+    """
+    Cumulative bucket histogram in the Prometheus style.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by interpolating within its bucket.
+
+        Args:
+            q: the quantile between 0 and 1
+        Returns:
+            The estimated value, or None if nothing was observed.
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        lower = 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count > 0 and seen + count >= rank:
+                upper = min(bound, self.max)
+                if upper <= lower:
+                    return upper
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count else None,
+            "quantiles": {str(q): self.quantile(q) for q in quantiles}
+        }
+
+
+class EndpointMetrics(object):
+    """
+    Metrics of a single API endpoint.
+    """
+
+    def __init__(self):
+        self.latency = Histogram(latency_buckets)
+        self.size = Histogram(size_buckets)
+        self.errors = 0
+        self.mongo_commands = 0
+        self.mongo_time = 0
+        self.collections = defaultdict(lambda: {"commands": 0, "time": 0})
+
+    def to_dict(self):
+        requests = self.latency.count
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "latency": self.latency.to_dict(),
+            "response_size": self.size.to_dict(),
+            "mongo": {
+                "commands": self.mongo_commands,
+                "time": self.mongo_time,
+                "commands_per_request":
+                    self.mongo_commands / requests if requests else None,
+                "collections": dict(self.collections)
+            }
+        }
+
+
+_lock = threading.Lock()
+_endpoints = defaultdict(EndpointMetrics)
+_collections = defaultdict(lambda: {"commands": 0, "failures": 0, "time": 0})
+_started = time.time()
+
+
+def record_command(collection, duration, failed=False):
+    """
+    Records a finished mongo command. Called by the command listener.
+
+    Args:
+        collection: the collection the command operated on
+        duration: the command duration in seconds
+        failed: whether the command failed
+    """
+
+    with _lock:
+        stats = _collections[collection]
+        stats["commands"] += 1
+        stats["time"] += duration
+        if failed:
+            stats["failures"] += 1
+
+    if has_request_context():
+        if "mongo_collections" not in g:
+            g.mongo_collections = defaultdict(lambda: [0, 0])
+        stats = g.mongo_collections[collection]
+        stats[0] += 1
+        stats[1] += duration
+
+
+def record_request(endpoint, duration, size, error):
+    """
+    Records a finished API request along with the mongo commands it issued.
+
+    Args:
+        endpoint: the endpoint name
+        duration: the request duration in seconds
+        size: the response size in bytes
+        error: whether the request failed
+    """
+
+    commands = g.get("mongo_collections", {}) if has_request_context() else {}
+
+    with _lock:
+        metrics = _endpoints[endpoint]
+        metrics.latency.observe(duration)
+        metrics.size.observe(size)
+        if error:
+            metrics.errors += 1
+
+        for collection, (count, command_time) in commands.items():
+            metrics.mongo_commands += count
+            metrics.mongo_time += command_time
+            stats = metrics.collections[collection]
+            stats["commands"] += count
+            stats["time"] += command_time
+
+
+def get_endpoint_name():
+    """
+    Returns the metrics name of the current request's endpoint.
+    """
+
+    if not has_request_context():
+        return "unknown"
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+    return "{} {}".format(request.method, rule)
+
+
+def get_metrics():
+    """
+    Returns the metrics collected by this process.
+
+    Returns:
+        A dict of endpoint and collection metrics.
+    """
+
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "uptime": time.time() - _started,
+            "endpoints": {
+                endpoint: metrics.to_dict()
+                for endpoint, metrics in _endpoints.items()
+            },
+            "collections": {
+                collection: dict(stats)
+                for collection, stats in _collections.items()
+            }
+        }
+
+
+def reset_metrics():
+    """
+    Discards the metrics collected by this process.
+    """
+
+    global _started
+
+    with _lock:
+        _endpoints.clear()
+        _collections.clear()
+        _started = time.time()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        "\"", "\\\"")
+
+
+def _labels(**labels):
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value))
+                          for name, value in sorted(labels.items())) + "}"
+
+
+def _bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def get_prometheus_metrics():
+    """
+    Renders the metrics collected by this process in the Prometheus text
+    exposition format.
+
+    Returns:
+        The metrics as a string.
+    """
+
+    lines = []
+
+    def metric(name, kind, description):
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+
+    with _lock:
+        endpoints = sorted(_endpoints.items())
+        collections = sorted(_collections.items())
+
+        for name, attribute, description in [
+            ("picoctf_request_duration_seconds", "latency",
+             "API request latency."),
+            ("picoctf_response_size_bytes", "size", "API response size.")
+        ]:
+            metric(name, "histogram", description)
+            for endpoint, metrics in endpoints:
+                histogram = getattr(metrics, attribute)
+                for bound, count in histogram.cumulative_counts():
+                    lines.append("{}_bucket{} {}".format(
+                        name, _labels(endpoint=endpoint, le=_bound(bound)),
+                        count))
+                lines.append("{}_sum{} {}".format(
+                    name, _labels(endpoint=endpoint), histogram.sum))
+                lines.append("{}_count{} {}".format(
+                    name, _labels(endpoint=endpoint), histogram.count))
+
+        metric("picoctf_request_errors_total", "counter",
+               "API requests that returned an error.")
+        for endpoint, metrics in endpoints:
+            lines.append("picoctf_request_errors_total{} {}".format(
+                _labels(endpoint=endpoint), metrics.errors))
+
+        metric("picoctf_request_mongo_commands_total", "counter",
+               "Mongo commands issued by API requests.")
+        for endpoint, metrics in endpoints:
+            for collection, stats in sorted(metrics.collections.items()):
+                lines.append("picoctf_request_mongo_commands_total{} {}".format(
+                    _labels(endpoint=endpoint, collection=collection),
+                    stats["commands"]))
+
+        metric("picoctf_request_mongo_seconds_total", "counter",
+               "Time spent in mongo commands issued by API requests.")
+        for endpoint, metrics in endpoints:
+            for collection, stats in sorted(metrics.collections.items()):
+                lines.append("picoctf_request_mongo_seconds_total{} {}".format(
+                    _labels(endpoint=endpoint, collection=collection),
+                    stats["time"]))
+
+        for name, field, description in [
+            ("picoctf_mongo_commands_total", "commands", "Mongo commands."),
+            ("picoctf_mongo_command_failures_total", "failures",
+             "Failed mongo commands."),
+            ("picoctf_mongo_command_seconds_total", "time",
+             "Time spent in mongo commands.")
+        ]:
+            metric(name, "counter", description)
+            for collection, stats in collections:
+                lines.append("{}{} {}".format(
+                    name, _labels(collection=collection), stats[field]))
+
+    return "\n".join(lines) + "\n"
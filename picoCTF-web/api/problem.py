@@ -12,6 +12,7 @@ from api.annotations import log_action
 from api.common import (check, InternalException, safe_fail,
                         SevereInternalException, validate, WebException)
 from bson import json_util
+from pymongo.errors import DuplicateKeyError
 from voluptuous import Length, Range, Required, Schema, ALLOW_EXTRA
 
 submission_schema = Schema({
@@ -117,6 +118,10 @@ SANITATION_KEYS = [
 
 DEBUG_KEY = None
 
+# Seconds a serialized problem view stays in the in-process cache. Views are
+# keyed by version, so this only bounds the memory held by unused views.
+problem_view_timeout = 600
+
 
 def get_all_categories(show_disabled=False):
     """
@@ -128,13 +133,11 @@ def get_all_categories(show_disabled=False):
         The set of distinct problem categories.
     """
 
-    db = api.common.get_conn()
-
-    match = {}
-    if not show_disabled:
-        match.update({"disabled": False})
+    catalog = api.catalog.get_catalog()
 
-    return db.problems.find(match).distinct("category")
+    if show_disabled:
+        return list(catalog.categories)
+    return list(catalog.enabled_categories)
 
 
 def set_instance_ids(problem, sid):
@@ -214,7 +217,8 @@ def insert_problem(problem, sid=None):
                 problem["name"]))
 
     db.problems.insert(problem)
-    api.cache.fast_cache.clear()
+    api.catalog.invalidate_catalog()
+    api.cache.invalidate("problems")
 
     return problem["pid"]
 
@@ -233,7 +237,8 @@ def remove_problem(pid):
     problem = get_problem(pid=pid)
 
     db.problems.remove({"pid": pid})
-    api.cache.fast_cache.clear()
+    api.catalog.invalidate_catalog()
+    api.cache.invalidate("problems")
 
     return problem
 
@@ -264,7 +269,8 @@ def update_problem(pid, updated_problem):
     """
 
     db.problems.update({"pid": pid}, problem)
-    api.cache.fast_cache.clear()
+    api.catalog.invalidate_catalog()
+    api.cache.invalidate("problems")
 
     return problem
 
@@ -284,20 +290,18 @@ def search_problems(*conditions):
     return list(db.problems.find({"$or": list(conditions)}, {"_id": 0}))
 
 
-def assign_instance_to_team(pid, tid=None, reassign=False):
+def choose_instance(pid, team):
     """
-    Assigns an instance of problem pid to team tid. Updates it in the database.
+    Picks a random instance of problem pid for a team. When sharding is
+    enabled only instances on the team's shell server are considered.
 
     Args:
         pid: the problem id
-        tid: the team id
-        reassign: whether or not we should assign over an old assignment
-
+        team: the team object
     Returns:
-        The iid that was assigned
+        The iid of the chosen instance
     """
 
-    team = api.team.get_team(tid=tid)
     problem = get_problem(pid=pid)
 
     available_instances = problem["instances"]
@@ -308,11 +312,6 @@ def assign_instance_to_team(pid, tid=None, reassign=False):
             filter(lambda i: i.get("server_number") == team.get("server_number", 1),
                    problem["instances"]))
 
-    if pid in team["instances"] and not reassign:
-        raise InternalException(
-            "Team with tid {} already has an instance of pid {}.".format(
-                tid, pid))
-
     if len(available_instances) == 0:
         if settings["shell_servers"]["enable_sharding"]:
             raise InternalException(
@@ -323,14 +322,106 @@ def assign_instance_to_team(pid, tid=None, reassign=False):
                 "Problem {} has no instances to assign.".format(pid))
 
     instance_number = randint(0, len(available_instances) - 1)
-    iid = available_instances[instance_number]["iid"]
+    return available_instances[instance_number]["iid"]
 
-    team["instances"][pid] = iid
+
+def assign_instance_to_team(pid, tid=None, reassign=False):
+    """
+    Assigns an instance of problem pid to team tid. Updates it in the database.
+
+    Args:
+        pid: the problem id
+        tid: the team id
+        reassign: whether or not we should assign over an old assignment
+
+    Returns:
+        The iid that was assigned
+    """
 
     db = api.common.get_conn()
-    db.teams.update({"tid": tid}, {"$set": team})
 
-    return instance_number
+    team = api.team.get_team(tid=tid)
+    tid = team["tid"]
+
+    if pid in api.team.get_team_instances(tid) and not reassign:
+        raise InternalException(
+            "Team with tid {} already has an instance of pid {}.".format(
+                tid, pid))
+
+    iid = choose_instance(pid, team)
+
+    query = {"tid": tid}
+    if not reassign:
+        query["instances." + pid] = {"$exists": False}
+
+    result = db.teams.update_one(query, {
+        "$set": {
+            "instances." + pid: iid
+        },
+        "$inc": {
+            "problem_view_version": 1
+        }
+    })
+    api.auth.invalidate_request_identity()
+
+    if result.matched_count == 0:
+        # A concurrent request assigned an instance first.
+        iid = db.teams.find_one({"tid": tid}, {"_id": 0})["instances"][pid]
+
+    return iid
+
+
+def assign_instances_to_team(pids, tid):
+    """
+    Assigns instances of all problems in pids the team does not have an
+    instance of yet, in a single update. Assignments made concurrently by
+    other requests are kept; their pids are skipped.
+
+    Args:
+        pids: the problem ids
+        tid: the team id
+    Returns:
+        A dict of the newly assigned iids by pid
+    """
+
+    db = api.common.get_conn()
+
+    team = api.team.get_team(tid=tid)
+    instances = api.team.get_team_instances(tid)
+    missing = [pid for pid in pids if pid not in instances]
+
+    assigned = {}
+    while len(missing) > 0:
+        choices = {pid: choose_instance(pid, team) for pid in missing}
+
+        query = {"tid": tid}
+        for pid in missing:
+            query["instances." + pid] = {"$exists": False}
+
+        result = db.teams.update_one(query, {
+            "$set": {
+                "instances." + pid: iid
+                for pid, iid in choices.items()
+            },
+            "$inc": {
+                "problem_view_version": 1
+            }
+        })
+
+        if result.matched_count == 1:
+            assigned = choices
+            break
+
+        # Another request assigned some of the pids. Retry with the rest.
+        team = db.teams.find_one({"tid": tid}, {"_id": 0})
+        if team is None:
+            raise InternalException("Team does not exist.")
+        missing = [pid for pid in missing if pid not in team["instances"]]
+
+    if len(assigned) > 0:
+        api.auth.invalidate_request_identity()
+
+    return assigned
 
 
 def get_instance_data(pid, tid):
@@ -345,17 +436,17 @@ def get_instance_data(pid, tid):
         The instance dictionary
     """
 
-    instance_map = api.team.get_team(tid=tid)["instances"]
-    problem = get_problem(pid=pid)
+    instance_map = api.team.get_team_instances(tid)
+    catalog = api.catalog.get_catalog()
 
     if pid not in instance_map:
         iid = assign_instance_to_team(pid, tid)
     else:
         iid = instance_map[pid]
 
-    for instance in problem["instances"]:
-        if instance["iid"] == iid:
-            return instance
+    instance = catalog.get_instance(pid, iid)
+    if instance is not None:
+        return copy(instance)
 
     # Cannot find assigned instance. Reassign instance and recurse.
     assign_instance_to_team(pid, tid, reassign=True)
@@ -384,6 +475,23 @@ def get_problem_instance(pid, tid):
     return problem
 
 
+def check_flag(flag, key):
+    """
+    Checks a submitted key against an instance's flag.
+
+    Args:
+        flag: the flag of the instance
+        key: user's submission
+    Returns:
+        True if the key is correct.
+    """
+
+    correct = flag in key
+    if not correct and DEBUG_KEY is not None:
+        correct = DEBUG_KEY in key
+    return correct
+
+
 def grade_problem(pid, key, tid=None):
     """
     Grades the problem with its associated flag.
@@ -402,12 +510,19 @@ def grade_problem(pid, key, tid=None):
     if tid is None:
         tid = api.user.get_user()["tid"]
 
-    problem = get_problem(pid=pid)
-    instance = get_instance_data(pid, tid)
+    catalog = api.catalog.get_catalog()
+    problem = catalog.by_pid.get(pid)
+    if problem is None:
+        # Raises the usual exception for unknown problems
+        problem = get_problem(pid=pid)
 
-    correct = instance['flag'] in key
-    if not correct and DEBUG_KEY is not None:
-        correct = DEBUG_KEY in key
+    # Fast path: the team's current assignment is a known instance.
+    iid = api.team.get_team_instances(tid).get(pid)
+    instance = catalog.get_instance(pid, iid)
+    if instance is None:
+        instance = get_instance_data(pid, tid)
+
+    correct = check_flag(instance['flag'], key)
 
     return {
         "correct": correct,
@@ -471,33 +586,67 @@ def submit_key(tid, pid, key, method, uid=None, ip=None):
         'eligible': eligibility,
         'category': problem['category'],
         'correct': result['correct'],
+        'key_hash': api.common.hash(key),
     }
 
-    if (key, pid) in [(submission["key"], submission["pid"])
-                      for submission in get_submissions(tid=tid)]:
+    # The unique (tid, pid, key_hash) index makes the insert fail atomically
+    # if the team already tried this key, even for concurrent submissions.
+    try:
+        inserted = db.submissions.update_one(
+            {
+                "tid": tid,
+                "pid": pid,
+                "key_hash": submission["key_hash"]
+            }, {
+                "$setOnInsert": submission
+            },
+            upsert=True).upserted_id is not None
+    except DuplicateKeyError:
+        inserted = False
+
+    if not inserted:
         exp = WebException(
             "You or one of your teammates have already tried this solution.")
         exp.data = {'code': 'repeat'}
         raise exp
 
-    db.submissions.insert(submission)
-
     if submission["correct"]:
-        api.cache.invalidate_memoization(
-            api.stats.get_score, {"kwargs.tid": tid}, {"kwargs.uid": uid})
-        api.cache.invalidate_memoization(get_unlocked_pids, {"args": tid})
-        api.cache.invalidate_memoization(
-            get_solved_problems, {"kwargs.tid": tid}, {"kwargs.uid": uid})
-
-        api.cache.invalidate_memoization(api.stats.get_score_progression,
-                                         {"kwargs.tid": tid},
-                                         {"kwargs.uid": uid})
-
-        api.achievement.process_achievements("submit", {
+        api.scoreboard.record_solve(tid, pid, problem["score"],
+                                    submission["timestamp"])
+        api.stats.count_solve(pid)
+        if eligibility:
+            api.scoreboard.record_first_solve(pid, tid, uid,
+                                              submission["timestamp"])
+
+        # Hand out instances of the problems this solve unlocked right away.
+        solved_names = set(p["sanitized_name"]
+                           for p in get_solved_problems(tid=tid))
+        newly_unlocked = api.unlocks.get_graph().newly_unlocked(
+            solved_names, problem["sanitized_name"])
+        if len(newly_unlocked) > 0:
+            by_sanitized_name = api.catalog.get_catalog().by_sanitized_name
+            unlocked_pids = [
+                by_sanitized_name[name]["pid"] for name in newly_unlocked
+                if name in by_sanitized_name and
+                not by_sanitized_name[name]["disabled"]
+            ]
+            safe_fail(assign_instances_to_team, unlocked_pids, tid)
+
+        api.team.bump_problem_view_version(tid)
+
+        # Scores, solved and unlocked problems of the team and user changed.
+        api.cache.invalidate(
+            api.cache.tag("tid", tid), api.cache.tag("uid", uid), "scoreboard")
+        api.group.invalidate_team_groups(tid)
+
+        api.achievement.queue_achievement_event("submit", {
             "uid": uid,
             "tid": tid,
             "pid": pid
         })
+    else:
+        safe_fail(api.flag_sharing.check_submission, submission,
+                  user["username"], problem["name"])
 
     return result
 
@@ -575,6 +724,41 @@ def get_submissions(pid=None,
     return list(db.submissions.find(match, {"_id": 0}))
 
 
+def backfill_submission_key_hashes():
+    """
+    Adds the key_hash field to submissions made before it existed, so the
+    unique submission index also covers them. Repeated submissions of the
+    same key by a team keep no key_hash except for the first one.
+
+    Returns:
+        A tuple of the number of updated and skipped duplicate submissions.
+    """
+
+    db = api.common.get_conn()
+
+    updated = 0
+    duplicates = 0
+    for submission in db.submissions.find({
+            "key_hash": {
+                "$exists": False
+            }
+    }, {
+            "_id": 1,
+            "key": 1
+    }).sort("timestamp", pymongo.ASCENDING):
+        try:
+            db.submissions.update_one({
+                "_id": submission["_id"]
+            }, {"$set": {
+                "key_hash": api.common.hash(submission["key"])
+            }})
+            updated += 1
+        except DuplicateKeyError:
+            duplicates += 1
+
+    return updated, duplicates
+
+
 def clear_all_submissions():
     """
     Removes all submissions from the database.
@@ -583,6 +767,7 @@ def clear_all_submissions():
     if DEBUG_KEY is not None:
         db = api.common.get_conn()
         db.submissions.remove()
+        db.team_scores.remove()
         api.cache.clear_all()
     else:
         raise InternalException("DEBUG Mode must be enabled")
@@ -603,7 +788,7 @@ def clear_submissions(uid=None, tid=None, pid=None):
     match = {}
 
     if pid is not None:
-        match.update({"pid", pid})
+        match.update({"pid": pid})
     elif uid is not None:
         match.update({"uid": uid})
     elif tid is not None:
@@ -611,7 +796,45 @@ def clear_submissions(uid=None, tid=None, pid=None):
     else:
         raise InternalException("You must supply either a tid, uid, or pid")
 
-    return db.submissions.remove(match)
+    # Only the teams and problems of the cleared solves need rebuilding.
+    solved = list(
+        db.submissions.find(
+            dict(match, correct=True), {
+                "_id": 0,
+                "tid": 1,
+                "uid": 1,
+                "pid": 1
+            }))
+    tids = set(submission["tid"] for submission in solved)
+    uids = set(submission["uid"] for submission in solved)
+    pids = set(submission["pid"] for submission in solved)
+
+    # The users' current teams are credited with their solves too.
+    tids.update(user["tid"] for user in db.users.find({
+        "uid": {
+            "$in": list(uids)
+        }
+    }, {
+        "_id": 0,
+        "tid": 1
+    }))
+
+    result = db.submissions.remove(match)
+    db.flag_sharing.remove(match)
+
+    for solver in tids:
+        safe_fail(api.scoreboard.rebuild_team_score, solver)
+        api.team.bump_problem_view_version(solver)
+    if len(pids) > 0:
+        api.scoreboard.backfill_first_solves(pids)
+        api.stats.rebuild_solve_counts(pids)
+
+    tags = [api.cache.tag("tid", solver) for solver in tids] + \
+        [api.cache.tag("uid", solver) for solver in uids] + \
+        [api.cache.tag("pid", solved_pid) for solved_pid in pids]
+    api.cache.invalidate("scoreboard", *tags)
+
+    return result
 
 
 def invalidate_submissions(pid=None, uid=None, tid=None):
@@ -648,41 +871,24 @@ def reevaluate_submissions_for_problem(pid):
         pid: the pid of the problem to be reevaluated.
     """
 
-    db = api.common.get_conn()
-
     get_problem(pid=pid)
 
-    keys = {}
-    for submission in get_submissions(pid=pid):
-        key = submission["key"]
-        if key not in keys:
-            result = grade_problem(pid, key, submission["tid"])
-            if result["correct"] != submission["correct"]:
-                keys[key] = result["correct"]
-            else:
-                keys[key] = None
-
-    for key, change in keys.items():
-        if change is not None:
-            db.submissions.update(
-                {
-                    "key": key
-                }, {"$set": {
-                    "correct": change
-                }}, multi=True)
+    return api.reevaluation.reevaluate_submissions([pid])
 
 
-def reevaluate_all_submissions():
+def reevaluate_all_submissions(processes=1, progress=None):
     """
     In the case of the problem being updated, this will reevaluate all submissions.
+
+    Args:
+        processes: number of worker processes
+        progress: optional progress callback, see api.reevaluation
     """
 
-    api.cache.clear_all()
-    for problem in get_all_problems(show_disabled=True):
-        reevaluate_submissions_for_problem(problem["pid"])
+    return api.reevaluation.reevaluate_submissions(
+        processes=processes, progress=progress)
 
 
-@api.cache.memoize(timeout=60, fast=True)
 def get_problem(pid=None, name=None, tid=None, show_disabled=True):
     """
     Gets a single problem.
@@ -695,14 +901,16 @@ def get_problem(pid=None, name=None, tid=None, show_disabled=True):
         The problem dictionary from the database
     """
 
-    db = api.common.get_conn()
+    catalog = api.catalog.get_catalog()
 
     match = {}
 
     if pid is not None:
         match.update({'pid': pid})
+        problem = catalog.by_pid.get(pid)
     elif name is not None:
         match.update({'name': name})
+        problem = catalog.by_name.get(name)
     else:
         raise InternalException("Must supply pid or display name")
 
@@ -711,15 +919,14 @@ def get_problem(pid=None, name=None, tid=None, show_disabled=True):
 
     if not show_disabled:
         match.update({"disabled": False})
-
-    db = api.common.get_conn()
-    problem = db.problems.find_one(match, {"_id": 0})
+        if problem is not None and problem["disabled"]:
+            problem = None
 
     if problem is None:
         raise SevereInternalException("Could not find problem! You gave " +
                                       str(match))
 
-    return problem
+    return copy(problem)
 
 
 def get_all_problems(category=None, show_disabled=False, basic_only=False):
@@ -734,25 +941,18 @@ def get_all_problems(category=None, show_disabled=False, basic_only=False):
         List of problems from the database
     """
 
-    db = api.common.get_conn()
-
-    match = {}
-    if category is not None:
-        match.update({'category': category})
-
-    if not show_disabled:
-        match.update({'disabled': False})
-
-    # Return all except objectID
-    projection = {"_id": 0}
+    problems = api.catalog.get_catalog().find(
+        category=category, show_disabled=show_disabled)
 
     # Return only name, category, score
     if basic_only:
-        projection.update({"name": 1, "category": 1, "score": 1})
+        return [{
+            "name": problem["name"],
+            "category": problem["category"],
+            "score": problem["score"]
+        } for problem in problems]
 
-    return list(
-        db.problems.find(match, projection).sort([('score', pymongo.ASCENDING),
-                                                  ('name', pymongo.ASCENDING)]))
+    return [copy(problem) for problem in problems]
 
 
 @api.cache.memoize()
@@ -767,6 +967,8 @@ def get_solved_problems(tid=None, uid=None, category=None, show_disabled=False):
         List of solved problem dictionaries
     """
 
+    db = api.common.get_conn()
+
     if uid is not None and tid is None:
         team = api.user.get_team(uid=uid)
     else:
@@ -774,28 +976,109 @@ def get_solved_problems(tid=None, uid=None, category=None, show_disabled=False):
 
     members = api.team.get_team_uids(tid=team["tid"])
 
-    submissions = get_submissions(
-        tid=tid, uid=uid, category=category, correctness=True)
+    # The given user's or team's submissions and those of all current members
+    if uid is not None:
+        owner = {"uid": uid}
+    else:
+        owner = {"tid": team["tid"]}
 
-    for uid in members:
-        submissions += get_submissions(
-            uid=uid, category=category, correctness=True)
+    match = {"$or": [owner, {"uid": {"$in": members}}], "correct": True}
+    if category is not None:
+        match["category"] = category
 
-    pids = []
-    result = []
+    submissions = db.submissions.find(match, {
+        "_id": 0,
+        "pid": 1,
+        "timestamp": 1
+    }).sort("timestamp", pymongo.ASCENDING)
 
-    # Team submissions will take precedence because they appear first in the submissions list.
+    # The earliest correct submission of a problem is its solve time.
+    pids = []
+    solve_times = {}
     for submission in submissions:
-        if submission["pid"] not in pids:
+        if submission["pid"] not in solve_times:
             pids.append(submission["pid"])
-            problem = unlocked_filter(get_problem(pid=submission["pid"]), True)
-            problem["solve_time"] = submission["timestamp"]
-            if not problem["disabled"] or show_disabled:
-                result.append(problem)
+            solve_times[submission["pid"]] = submission["timestamp"]
+
+    return _build_solved_problems(pids, solve_times, show_disabled)
+
+
+def _build_solved_problems(pids, solve_times, show_disabled=False):
+    """
+    Returns the solved problems of a list of pids ordered by solve time.
+    """
+
+    problems = api.catalog.get_catalog().by_pid
+
+    result = []
+    for pid in pids:
+        if pid not in problems:
+            continue
+        problem = unlocked_filter(problems[pid], True)
+        problem["solve_time"] = solve_times[pid]
+        if not problem["disabled"] or show_disabled:
+            result.append(problem)
 
     return result
 
 
+def get_teams_solved_problems(members):
+    """
+    Gets the solved problems of several teams with a single query.
+
+    Args:
+        members: a dict of the uids of every team's members by tid
+    Returns:
+        A dict of lists of solved problem dictionaries by tid, the same as
+        get_solved_problems returns for each team.
+    """
+
+    db = api.common.get_conn()
+
+    teams_of_uid = {}
+    for tid, uids in members.items():
+        for uid in uids:
+            teams_of_uid.setdefault(uid, set()).add(tid)
+
+    submissions = db.submissions.find({
+        "$or": [{
+            "tid": {
+                "$in": list(members)
+            }
+        }, {
+            "uid": {
+                "$in": list(teams_of_uid)
+            }
+        }],
+        "correct": True
+    }, {
+        "_id": 0,
+        "tid": 1,
+        "uid": 1,
+        "pid": 1,
+        "timestamp": 1
+    }).sort("timestamp", pymongo.ASCENDING)
+
+    pids = {tid: [] for tid in members}
+    solve_times = {tid: {} for tid in members}
+    for submission in submissions:
+        # A submission counts for the team it was made for and for the
+        # current team of its user.
+        tids = set(teams_of_uid.get(submission["uid"], ()))
+        if submission["tid"] in members:
+            tids.add(submission["tid"])
+
+        for tid in tids:
+            if submission["pid"] not in solve_times[tid]:
+                pids[tid].append(submission["pid"])
+                solve_times[tid][submission["pid"]] = submission["timestamp"]
+
+    return {
+        tid: _build_solved_problems(pids[tid], solve_times[tid])
+        for tid in members
+    }
+
+
 def get_solved_pids(*args, **kwargs):
     """
     Gets the solved pids for a given team or user.
@@ -822,24 +1105,12 @@ def is_problem_unlocked(problem, solved):
         solved: the list of solved problem objects
     """
 
-    unlocked = True
-
-    for bundle in get_all_bundles():
-        if problem["sanitized_name"] in bundle["problems"]:
-            if "dependencies" in bundle and bundle["dependencies_enabled"]:
-                if problem["sanitized_name"] in bundle["dependencies"]:
-                    dependency = bundle["dependencies"][problem[
-                        "sanitized_name"]]
-                    weightsum = sum(
-                        dependency['weightmap'].get(p['sanitized_name'], 0)
-                        for p in solved)
-                    if weightsum < dependency['threshold']:
-                        unlocked = False
-
-    return unlocked
+    solved_names = set(p["sanitized_name"] for p in solved)
+    return api.unlocks.get_graph().is_unlocked(problem["sanitized_name"],
+                                               solved_names)
 
 
-@api.cache.memoize()
+@api.cache.memoize(tags=["problems", "bundles"])
 def get_unlocked_pids(tid, category=None):
     """
     Gets the unlocked pids for a given team.
@@ -852,16 +1123,15 @@ def get_unlocked_pids(tid, category=None):
     """
     # Note: Do NOT limit solved problems to category for proper weight count
     solved = get_solved_problems(tid=tid, category=None)
-    team = api.team.get_team(tid=tid)
+    solved_names = set(p["sanitized_name"] for p in solved)
+    graph = api.unlocks.get_graph()
 
     unlocked = []
     for problem in get_all_problems(category=category):
-        if is_problem_unlocked(problem, solved):
+        if graph.is_unlocked(problem["sanitized_name"], solved_names):
             unlocked.append(problem["pid"])
 
-    for pid in unlocked:
-        if pid not in team["instances"]:
-            assign_instance_to_team(pid, tid)
+    assign_instances_to_team(unlocked, tid)
 
     return unlocked
 
@@ -931,14 +1201,16 @@ def count_all_problems(category=None):
         category: category name
         count: number of problems in that category
     """
+    catalog = api.catalog.get_catalog()
+
     if category is None:
-        categories = get_all_categories(show_disabled=False)
+        categories = catalog.enabled_categories
     else:
         categories = [category]
     result = {}
 
     for cat in categories:
-        result[cat] = len(get_all_problems(cat))
+        result[cat] = len(catalog.find(category=cat))
 
     return result
 
@@ -955,21 +1227,42 @@ def get_visible_problems(tid, category=None):
         List of visible problem dictionaries
     """
 
-    all_problems = get_all_problems(category=category, show_disabled=False)
-    unlocked_pids = get_unlocked_pids(tid, category=category)
-    solved_pids = get_solved_pids(tid=tid)
+    solve_counts = api.stats.get_solve_counts()
 
     result = []
+    for problem in _build_visible_problems(tid, category):
+        problem["solves"] = solve_counts.get(problem["pid"], 0)
+        result.append(problem)
+
+    return result
+
+
+def _build_visible_problems(tid, category):
+    """
+    Returns the unlocked problems of a team merged with their assigned
+    instances, without solve counts.
+    """
+
+    catalog = api.catalog.get_catalog()
+    unlocked_pids = set(get_unlocked_pids(tid, category=category))
+    solved_pids = set(get_solved_pids(tid=tid))
+    instances = api.team.get_team_instances(tid)
 
     result = []
     # locked = []
 
-    for problem in all_problems:
+    for problem in catalog.find(category=category):
         if problem["pid"] in unlocked_pids:
+            instance = catalog.get_instance(problem["pid"],
+                                            instances.get(problem["pid"]))
+            if instance is None:
+                instance = get_instance_data(problem["pid"], tid)
+
+            visible = copy(problem)
+            visible.pop("instances")
+            visible.update(instance)
             result.append(
-                unlocked_filter(
-                    get_problem_instance(problem["pid"], tid),
-                    problem["pid"] in solved_pids))
+                unlocked_filter(visible, problem["pid"] in solved_pids))
 
         # Disable locked problem display.
         # else:
@@ -981,6 +1274,51 @@ def get_visible_problems(tid, category=None):
     return result
 
 
+def get_problem_view(tid, category=None):
+    """
+    Returns the sanitized visible problems of a team as a serialized JSON
+    list, for the problem list endpoint.
+
+    The problems are serialized once per team and stored in the in-process
+    cache under the team's problem_view_version and the catalog and bundles
+    versions, so any solve, instance reassignment or problem change makes a
+    new view. Solve counts change all the time and are spliced into the
+    serialized problems on every call.
+
+    Args:
+        tid: The team id
+        category: Optional parameter to restrict which problems are returned
+    Returns:
+        The JSON list of visible problems
+    """
+
+    # Read the versions before building so a concurrent change makes a new key.
+    key = api.cache.get_key(
+        get_problem_view,
+        tid=tid,
+        category=category,
+        team_version=api.team.get_team(tid=tid).get("problem_view_version", 0),
+        catalog_version=api.catalog.get_version(),
+        bundles_version=api.unlocks.get_version())
+
+    view = api.cache.fast_cache.get(key)
+    if view is None:
+        view = [(problem["pid"], json_util.dumps(sanitize_problem_data(problem)))
+                for problem in _build_visible_problems(tid, category)]
+        api.cache.fast_cache.set(
+            key,
+            view,
+            timeout=problem_view_timeout,
+            tags=[api.cache.tag("tid", tid)])
+
+    solve_counts = api.stats.get_solve_counts()
+
+    # Every fragment is a serialized object; add the solves before its "}".
+    return "[" + ", ".join(
+        '{}, "solves": {}}}'.format(fragment[:-1], solve_counts.get(pid, 0))
+        for pid, fragment in view) + "]"
+
+
 def get_unlocked_problems(tid, category=None):
     """
     Gets the unlocked problems for a given team.
@@ -1018,6 +1356,8 @@ def insert_bundle(bundle):
     bundle["dependencies_enabled"] = False
 
     db.bundles.insert(bundle)
+    api.unlocks.rebuild_graph()
+    api.cache.invalidate("bundles")
 
 
 def load_published(data):
@@ -1039,8 +1379,14 @@ def load_published(data):
         for bundle in data["bundles"]:
             insert_bundle(bundle)
 
+    api.catalog.invalidate_catalog()
     api.cache.clear_all()
 
+    # Only the teams that solved the published problems can change score.
+    # insert_problem sets the pid of every problem, inserted or updated.
+    api.scoreboard.rebuild_solver_scores(
+        [problem["pid"] for problem in data["problems"]])
+
 
 def get_bundle(bid):
     """
@@ -1075,6 +1421,8 @@ def update_bundle(bid, updates):
     bundle["bid"] = bid
 
     db.bundles.update({"bid": bid}, {"$set": bundle})
+    api.unlocks.rebuild_graph()
+    api.cache.invalidate("bundles")
 
 
 def get_all_bundles():
@@ -1097,8 +1445,8 @@ def set_bundle_dependencies_enabled(bid, enabled):
         enabled:
     """
 
+    # update_bundle rebuilds the unlock graph.
     update_bundle(bid, {"dependencies_enabled": enabled})
-    api.cache.clear_all()
 
 
 def sanitize_problem_data(data):
@@ -105,7 +105,7 @@ def add_problem_feedback(pid, uid, feedback):
             "feedback": feedback
         })
 
-        api.achievement.process_achievements("review", {
+        api.achievement.queue_achievement_event("review", {
             "uid": uid,
             "tid": team['tid'],
             "pid": pid
@@ -0,0 +1,191 @@
+"""
+Score progression series.
+
+Every team score row keeps a compact progression array with one
+[epoch seconds, points] pair per solve, appended by
+api.scoreboard.record_solve. The cumulative score series of a team is
+computed from it without touching the submissions, and graphs are served
+downsampled to a fixed number of points or bucketed to a time resolution,
+so their size does not grow with the number of solves.
+"""
+
+import api
+
+log = api.logger.use(__name__)
+
+# Number of points of a graph series unless another view is requested.
+default_points = 100
+
+# Bucket sizes in seconds of the supported resolutions.
+resolutions = {"minute": 60, "hour": 3600, "day": 86400}
+
+
+def cumulate(progression):
+    """
+    Turns the per-solve points of a progression into a cumulative series.
+
+    Args:
+        progression: list of [epoch, points] pairs in any order
+    Returns:
+        A list of [epoch, score] pairs ordered by time.
+    """
+
+    series = []
+    score = 0
+    for epoch, points in sorted(progression, key=lambda entry: entry[0]):
+        score += points
+        series.append([epoch, score])
+    return series
+
+
+def _last_per_bucket(series, bucket_of):
+    """
+    Keeps the last point of every bucket of a time ordered series.
+    """
+
+    result = []
+    last_bucket = None
+    for epoch, score in series:
+        bucket = bucket_of(epoch)
+        if bucket == last_bucket:
+            result[-1] = [epoch, score]
+        else:
+            result.append([epoch, score])
+            last_bucket = bucket
+    return result
+
+
+def downsample(series, points):
+    """
+    Reduces a cumulative series to at most a number of points by splitting
+    its time span into equal buckets and keeping the last point of each.
+    The final score is always kept.
+
+    Args:
+        series: list of [epoch, score] pairs ordered by time
+        points: the maximum number of points
+    Returns:
+        The downsampled series.
+    """
+
+    points = max(points, 1)
+    if len(series) <= points:
+        return series
+
+    start = series[0][0]
+    width = (series[-1][0] - start) / points
+    if width == 0:
+        return series[-1:]
+
+    return _last_per_bucket(
+        series, lambda epoch: min(int((epoch - start) / width), points - 1))
+
+
+def bucket(series, seconds):
+    """
+    Reduces a cumulative series to the score at the end of every time bucket
+    that contains a solve. Points are placed at the start of their bucket.
+
+    Args:
+        series: list of [epoch, score] pairs ordered by time
+        seconds: the bucket size
+    Returns:
+        The bucketed series.
+    """
+
+    return [[epoch - epoch % seconds, score]
+            for epoch, score in _last_per_bucket(
+                series, lambda epoch: epoch // seconds)]
+
+
+def view(progression, points=default_points, resolution=None):
+    """
+    Builds the requested view of a progression.
+
+    Args:
+        progression: list of [epoch, points] pairs
+        points: maximum number of points, None for every solve
+        resolution: optional name of a bucket resolution, overrides points
+    Returns:
+        A list of [epoch, score] pairs ordered by time.
+    """
+
+    series = cumulate(progression)
+
+    if resolution is not None:
+        if resolution not in resolutions:
+            raise api.common.WebException(
+                "Unknown resolution, use one of: {}.".format(
+                    ", ".join(sorted(resolutions))))
+        return bucket(series, resolutions[resolution])
+
+    if points is not None:
+        return downsample(series, points)
+
+    return series
+
+
+def to_score_progression(series):
+    """
+    Converts a series into the format of api.stats.get_score_progression.
+
+    Args:
+        series: list of [epoch, score] pairs
+    Returns:
+        A list of dictionaries containing score and time
+    """
+
+    return [{"score": score, "time": epoch} for epoch, score in series]
+
+
+def get_progressions(tids, points=default_points, resolution=None):
+    """
+    Gets the score series of several teams with a single query.
+
+    Args:
+        tids: the team ids
+        points: maximum number of points per team, None for every solve
+        resolution: optional name of a bucket resolution, overrides points
+    Returns:
+        A dict of [epoch, score] series by tid.
+    """
+
+    db = api.common.get_conn()
+
+    progressions = {tid: None for tid in tids}
+    for row in db.team_scores.find({
+            "tid": {
+                "$in": list(tids)
+            }
+    }, {
+            "_id": 0,
+            "tid": 1,
+            "progression": 1
+    }):
+        progressions[row["tid"]] = row.get("progression")
+
+    result = {}
+    for tid, progression in progressions.items():
+        if progression is None:
+            # Rows written before progressions were recorded.
+            progression = [[
+                int(problem["solve_time"].timestamp()), problem["score"]
+            ] for problem in api.problem.get_solved_problems(tid=tid)]
+        result[tid] = view(progression, points=points, resolution=resolution)
+
+    return result
+
+
+def get_progression(tid, points=default_points, resolution=None):
+    """
+    Gets the score series of a team.
+
+    Args:
+        tid: the team id
+        points: maximum number of points, None for every solve
+        resolution: optional name of a bucket resolution, overrides points
+    Returns:
+        A list of [epoch, score] pairs ordered by time.
+    """
+
+    return get_progressions([tid], points=points, resolution=resolution)[tid]
@@ -0,0 +1,203 @@
+"""
+Submission re-evaluation.
+
+Re-grades the stored submissions of problems after their flags changed.
+Every problem is handled on its own: its submissions are streamed from a
+cursor and graded against the flags of the teams' assigned instances, which
+are loaded once per problem. Corrections are written with one bulk write per
+problem, scoped to the problem, the key and the affected teams. Problems can
+be spread over a pool of worker processes.
+
+Afterwards only the cached results of the affected teams, users and problems
+are invalidated and only the affected team score rows, first solves and
+flagged submissions are rebuilt.
+"""
+
+import multiprocessing
+from collections import defaultdict
+
+import api
+from api.common import safe_fail
+from pymongo import UpdateMany
+
+log = api.logger.use(__name__)
+
+
+def _init_worker():
+    """
+    Pool initializer. Mongo clients must not be shared across a fork.
+    """
+
+    api.common.reset_conn()
+
+
+def get_team_flags(pid):
+    """
+    Returns the flag of every team's assigned instance of a problem.
+
+    Args:
+        pid: the problem id
+    Returns:
+        A dict of flags by tid. Teams without a valid assignment are missing.
+    """
+
+    db = api.common.get_conn()
+    catalog = api.catalog.get_catalog()
+
+    flags = {}
+    for team in db.teams.find({
+            "instances." + pid: {
+                "$exists": True
+            }
+    }, {
+            "_id": 0,
+            "tid": 1,
+            "instances." + pid: 1
+    }):
+        instance = catalog.get_instance(pid, team["instances"][pid])
+        if instance is not None:
+            flags[team["tid"]] = instance["flag"]
+
+    return flags
+
+
+def reevaluate_problem(pid):
+    """
+    Re-grades and corrects the submissions of a single problem.
+
+    Args:
+        pid: the problem id
+    Returns:
+        A dict with the pid, the number of submissions and corrected
+        submissions, and the tids and uids whose submissions changed.
+    """
+
+    db = api.common.get_conn()
+
+    flags = get_team_flags(pid)
+
+    # tids of every (key, new correctness) pair that changed
+    changes = defaultdict(set)
+    uids = set()
+    skipped = set()
+
+    count = 0
+    for submission in db.submissions.find({
+            "pid": pid
+    }, {
+            "_id": 0,
+            "tid": 1,
+            "uid": 1,
+            "key": 1,
+            "correct": 1
+    }):
+        count += 1
+        tid = submission["tid"]
+
+        if tid not in flags and tid not in skipped:
+            # No assignment or it is gone; assign an instance like grading does.
+            instance = safe_fail(api.problem.get_instance_data, pid, tid)
+            if instance is None:
+                skipped.add(tid)
+            else:
+                flags[tid] = instance["flag"]
+
+        if tid in skipped:
+            continue
+
+        correct = api.problem.check_flag(flags[tid], submission["key"])
+        if correct != submission["correct"]:
+            changes[(submission["key"], correct)].add(tid)
+            uids.add(submission["uid"])
+
+    if len(skipped) > 0:
+        log.warning("Could not re-evaluate the submissions of %d teams for %s.",
+                    len(skipped), pid)
+
+    modified = 0
+    if len(changes) > 0:
+        result = db.submissions.bulk_write(
+            [
+                UpdateMany({
+                    "pid": pid,
+                    "key": key,
+                    "tid": {
+                        "$in": sorted(tids)
+                    },
+                    "correct": not correct
+                }, {"$set": {
+                    "correct": correct
+                }}) for (key, correct), tids in changes.items()
+            ],
+            ordered=False)
+        modified = result.modified_count
+
+    return {
+        "pid": pid,
+        "submissions": count,
+        "changed": modified,
+        "tids": sorted(set().union(*changes.values())),
+        "uids": sorted(uids)
+    }
+
+
+def reevaluate_submissions(pids=None, processes=1, progress=None):
+    """
+    Re-grades the submissions of the given problems.
+
+    Args:
+        pids: the problems to re-evaluate, defaults to every problem
+        processes: number of worker processes, 1 runs in this process
+        progress: optional function called with (done, total, result) after
+                  every problem
+    Returns:
+        A dict with the number of problems, submissions and corrected
+        submissions and the tids whose scores were rebuilt.
+    """
+
+    if pids is None:
+        pids = [p["pid"] for p in api.catalog.get_catalog().problems]
+
+    summary = {"problems": len(pids), "submissions": 0, "changed": 0}
+    pids_changed = set()
+    tids = set()
+    uids = set()
+
+    def collect(results):
+        for done, result in enumerate(results, 1):
+            summary["submissions"] += result["submissions"]
+            summary["changed"] += result["changed"]
+            if result["changed"] > 0:
+                pids_changed.add(result["pid"])
+                tids.update(result["tids"])
+                uids.update(result["uids"])
+            if progress is not None:
+                progress(done, len(pids), result)
+
+    if processes > 1 and len(pids) > 1:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        try:
+            collect(pool.imap_unordered(reevaluate_problem, pids))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        collect(reevaluate_problem(pid) for pid in pids)
+
+    tags = [api.cache.tag("tid", tid) for tid in tids] + \
+        [api.cache.tag("uid", uid) for uid in uids] + \
+        [api.cache.tag("pid", pid) for pid in pids_changed]
+    if len(tags) > 0:
+        api.cache.invalidate(*tags)
+
+    if len(pids_changed) > 0:
+        safe_fail(api.scoreboard.backfill_first_solves, pids_changed)
+        safe_fail(api.flag_sharing.backfill_flag_sharing, pids_changed)
+        safe_fail(api.stats.rebuild_solve_counts, pids_changed)
+
+    for tid in tids:
+        safe_fail(api.scoreboard.rebuild_team_score, tid)
+        api.team.bump_problem_view_version(tid)
+
+    summary["tids"] = sorted(tids)
+    return summary
@@ -3,7 +3,7 @@ import bson
 from api.annotations import (api_wrapper, log_action, require_admin,
                              require_login, require_teacher)
 from api.common import WebError, WebSuccess
-from flask import (Blueprint, Flask, render_template, request,
+from flask import (Blueprint, Flask, render_template, request, Response,
                    send_from_directory, session)
 
 blueprint = Blueprint("admin_api", __name__)
@@ -61,6 +61,46 @@ def dismiss_exceptions_hook():
         return WebError(message="You must supply a trace to hide.")
 
 
+@blueprint.route('/cache', methods=['GET'])
+@api_wrapper
+@require_admin
+def get_cache_stats_hook():
+    return WebSuccess(data=api.cache.fast_cache.get_stats())
+
+
+@blueprint.route('/metrics', methods=['GET'])
+@api_wrapper
+@require_admin
+def get_metrics_hook():
+    if request.args.get("format") == "prometheus":
+        return Response(
+            api.metrics.get_prometheus_metrics(),
+            mimetype="text/plain; version=0.0.4")
+    return WebSuccess(data=api.metrics.get_metrics())
+
+
+@blueprint.route('/metrics/reset', methods=['POST'])
+@api_wrapper
+@require_admin
+def reset_metrics_hook():
+    api.metrics.reset_metrics()
+    return WebSuccess("Metrics have been reset.")
+
+
+@blueprint.route('/logging', methods=['GET'])
+@api_wrapper
+@require_admin
+def get_logging_stats_hook():
+    return WebSuccess(data=api.logger.get_stats_queue_stats())
+
+
+@blueprint.route('/achievements/processors', methods=['GET'])
+@api_wrapper
+@require_admin
+def get_achievement_processors_hook():
+    return WebSuccess(data=api.achievement.processor_registry.get_stats())
+
+
 @blueprint.route("/problems/submissions", methods=["GET"])
 @api_wrapper
 @require_admin
@@ -70,6 +110,13 @@ def get_problem():
     return WebSuccess(data=submission_data)
 
 
+@blueprint.route("/problems/first_solves", methods=["GET"])
+@api_wrapper
+@require_admin
+def get_first_solves_hook():
+    return WebSuccess(data=api.scoreboard.get_first_solves())
+
+
 @blueprint.route("/problems/availability", methods=["POST"])
 @api_wrapper
 @require_admin
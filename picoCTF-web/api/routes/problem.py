@@ -4,7 +4,7 @@ import api
 from api.annotations import (api_wrapper, block_after_competition,
                              block_before_competition, check_csrf, log_action,
                              require_admin, require_login, require_teacher)
-from api.common import WebError, WebSuccess
+from api.common import WebError, WebSuccess, WebSuccessSerialized
 from flask import (Blueprint, Flask, render_template, request,
                    send_from_directory, session)
 
@@ -17,9 +17,9 @@ blueprint = Blueprint("problem_api", __name__)
 @require_login
 @block_before_competition(WebError("The competition has not begun yet!"))
 def get_visible_problems_hook(category):
-    visible_problems = api.problem.get_visible_problems(
+    problem_view = api.problem.get_problem_view(
         api.user.get_user()['tid'], category=category)
-    return WebSuccess(data=api.problem.sanitize_problem_data(visible_problems))
+    return WebSuccessSerialized(problem_view)
 
 
 @blueprint.route('/all', defaults={'category': None}, methods=['GET'])
@@ -24,6 +24,33 @@ def get_team_solved_problems_hook():
     return WebSuccess(data=stats)
 
 
+# Upper bound of the points parameter of the progression routes.
+max_progression_points = 1000
+
+
+def _get_progression_view():
+    """
+    Reads the requested progression view: points, the maximum number of
+    points per series, or resolution, e.g. "minute", and compact to get
+    [epoch, score] pairs. Only the given parameters are returned, so the
+    default view shares its cache entry with the cache_stats daemon.
+    Returns None if points is not a number.
+    """
+
+    view = {}
+    if "points" in request.args:
+        try:
+            points = int(request.args["points"])
+        except ValueError:
+            return None
+        view["points"] = min(max(points, 1), max_progression_points)
+    if "resolution" in request.args:
+        view["resolution"] = request.args["resolution"]
+    if request.args.get("compact", "false") == "true":
+        view["compact"] = True
+    return view
+
+
 @blueprint.route('/team/score_progression', methods=['GET'])
 @api_wrapper
 @require_login
@@ -33,8 +60,22 @@ def get_team_score_progression():
 
     tid = api.user.get_team()["tid"]
 
-    return WebSuccess(
-        data=api.stats.get_score_progression(tid=tid, category=category))
+    if category is not None:
+        return WebSuccess(
+            data=api.stats.get_score_progression(tid=tid, category=category))
+
+    view = _get_progression_view()
+    if view is None:
+        return WebError("The points must be a number.")
+
+    series = api.progression.get_progression(
+        tid,
+        points=view.get("points", api.progression.default_points),
+        resolution=view.get("resolution"))
+    if not view.get("compact", False):
+        series = api.progression.to_score_progression(series)
+
+    return WebSuccess(data=series)
 
 
 @blueprint.route('/scoreboard', methods=['GET'])
@@ -62,6 +103,72 @@ def get_scoreboard_hook():
     return WebSuccess(data=result)
 
 
+def _get_scoreboard_eligibility():
+    """
+    Reads the requested scoreboard. The ineligible scoreboard is only shown
+    to ineligible teams, as on /scoreboard.
+    """
+
+    eligible = bson.json_util.loads(request.args.get("eligible", "true"))
+    if not eligible:
+        if not api.auth.is_logged_in() or api.user.get_team()["eligible"]:
+            return None
+    return eligible
+
+
+@blueprint.route('/scoreboard/page', methods=['GET'])
+@api_wrapper
+@block_before_competition(WebError("The competition has not begun yet!"))
+def get_scoreboard_page_hook():
+    eligible = _get_scoreboard_eligibility()
+    if eligible is None:
+        return WebError("You can not view the ineligible scoreboard.")
+
+    try:
+        page = int(request.args.get("page", 1))
+        page_size = int(request.args.get("page_size", 50))
+    except ValueError:
+        return WebError("The page and page size must be numbers.")
+
+    return WebSuccess(data=api.scoreboard.get_scoreboard_page(
+        eligible, page=page, page_size=page_size))
+
+
+@blueprint.route('/scoreboard/top', methods=['GET'])
+@api_wrapper
+@block_before_competition(WebError("The competition has not begun yet!"))
+def get_scoreboard_top_hook():
+    eligible = _get_scoreboard_eligibility()
+    if eligible is None:
+        return WebError("You can not view the ineligible scoreboard.")
+
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return WebError("The limit must be a number.")
+
+    return WebSuccess(
+        data=api.scoreboard.get_top_teams(eligible, limit=limit))
+
+
+@blueprint.route('/scoreboard/team', methods=['GET'])
+@api_wrapper
+@require_login
+@block_before_competition(WebError("The competition has not begun yet!"))
+def get_scoreboard_team_hook():
+    try:
+        radius = int(request.args.get("radius", 5))
+    except ValueError:
+        return WebError("The radius must be a number.")
+
+    tid = api.user.get_team()["tid"]
+    neighbors = api.scoreboard.get_team_neighbors(tid, radius=radius)
+    if neighbors is None:
+        return WebError("Your team is not on the scoreboard yet.")
+
+    return WebSuccess(data=neighbors)
+
+
 @blueprint.route('/top_teams/score_progression', methods=['GET'])
 @api_wrapper
 def get_top_teams_score_progressions_hook():
@@ -69,16 +176,25 @@ def get_top_teams_score_progressions_hook():
 
     eligible = bson.json_util.loads(eligible)
 
-    return WebSuccess(
-        data=api.stats.get_top_teams_score_progressions(eligible=eligible))
+    view = _get_progression_view()
+    if view is None:
+        return WebError("The points must be a number.")
+
+    return WebSuccess(data=api.stats.get_top_teams_score_progressions(
+        eligible=eligible, **view))
 
 
 @blueprint.route('/group/score_progression', methods=['GET'])
 @api_wrapper
 def get_group_top_teams_score_progressions_hook():
     gid = request.args.get("gid", None)
-    return WebSuccess(
-        data=api.stats.get_top_teams_score_progressions(gid=gid, eligible=True))
+
+    view = _get_progression_view()
+    if view is None:
+        return WebError("The points must be a number.")
+
+    return WebSuccess(data=api.stats.get_top_teams_score_progressions(
+        gid=gid, eligible=True, **view))
 
 
 @blueprint.route('/registration', methods=['GET'])
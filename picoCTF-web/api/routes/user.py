@@ -185,8 +185,7 @@ def get_extdata_hook():
     """
     Return user extdata, or empty JSON object if unset.
     """
-    user = api.user.get_user(uid=None)
-    return WebSuccess(data=user['extdata'])
+    return WebSuccess(data=api.user.get_extdata())
 
 
 @blueprint.route('/extdata', methods=['PUT'])
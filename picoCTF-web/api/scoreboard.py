@@ -0,0 +1,671 @@
+"""
+Materialized team score table.
+
+Every team with a correct submission has a row in the team_scores collection
+that is kept up to date by api.problem.submit_key. The public scoreboard is
+read from this table with a single indexed query instead of recomputing the
+score of every team. Pages, ranks and neighbors of the ranked scoreboard are
+read with indexed range queries and counts, so they never load the whole
+table.
+
+The first_solves collection records the first eligible team to solve every
+problem. It is written once per problem by submit_key.
+"""
+
+import api
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+log = api.logger.use(__name__)
+
+# The tid breaks ties so that ranks and pages are stable.
+score_sort = [("score", pymongo.DESCENDING),
+              ("last_correct_submit", pymongo.ASCENDING),
+              ("tid", pymongo.ASCENDING)]
+
+max_page_size = 100
+
+score_projection = {
+    "_id": 0,
+    "tid": 1,
+    "name": 1,
+    "affiliation": 1,
+    "eligible": 1,
+    "score": 1
+}
+
+
+def is_team_hidden(tid):
+    """
+    Determines if a team is exclusively a member of hidden groups.
+    Such teams do not appear on the public scoreboard.
+
+    Args:
+        tid: the team id
+    Returns:
+        True if the team belongs to at least one group and all of them are hidden.
+    """
+
+    db = api.common.get_conn()
+
+    groups = list(
+        db.groups.find({
+            "$or": [{
+                "owner": tid
+            }, {
+                "teachers": tid
+            }, {
+                "members": tid
+            }]
+        }, {
+            "_id": 0,
+            "settings.hidden": 1
+        }))
+
+    return len(groups) > 0 and all(
+        group["settings"]["hidden"] for group in groups)
+
+
+def _team_fields(team):
+    """
+    Returns the denormalized team fields stored on a score row.
+    """
+
+    return {
+        "tid": team["tid"],
+        "name": team["team_name"],
+        "affiliation": team.get("affiliation"),
+        "eligible": team["eligible"],
+        "hidden": is_team_hidden(team["tid"])
+    }
+
+
+def record_solve(tid, pid, score, timestamp):
+    """
+    Atomically adds a solved problem to a team's score row.
+    Solving the same problem twice is a no-op.
+
+    Args:
+        tid: the team id
+        pid: the solved problem id
+        score: the points the problem is worth
+        timestamp: the time of the correct submission
+    """
+
+    db = api.common.get_conn()
+
+    update = {
+        "$inc": {
+            "score": score
+        },
+        "$max": {
+            "last_correct_submit": timestamp
+        },
+        "$addToSet": {
+            "solved": pid
+        },
+        "$push": {
+            "progression": [int(timestamp.timestamp()), score]
+        }
+    }
+
+    query = {"tid": tid, "solved": {"$ne": pid}}
+
+    result = db.team_scores.update_one(query, update)
+
+    if result.matched_count == 0:
+        # Either the row does not exist yet or the pid was already counted.
+        # The unique tid index turns the second case into a duplicate key.
+        update["$setOnInsert"] = _team_fields(api.team.get_team(tid=tid))
+        try:
+            db.team_scores.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            pass
+
+
+def compute_team_score(tid):
+    """
+    Computes a team's score row from its submissions.
+
+    Args:
+        tid: the team id
+    Returns:
+        The score row.
+    """
+
+    team = api.team.get_team(tid=tid)
+    solved = api.problem.get_solved_problems(tid=tid, cache=False)
+
+    row = _team_fields(team)
+    row["score"] = sum(problem["score"] for problem in solved)
+    row["solved"] = [problem["pid"] for problem in solved]
+    row["progression"] = [[
+        int(problem["solve_time"].timestamp()), problem["score"]
+    ] for problem in solved]
+
+    # Solves of members made before they joined count too.
+    row["last_correct_submit"] = max(
+        problem["solve_time"] for problem in solved) if solved else None
+
+    return row
+
+
+def rebuild_team_score(tid):
+    """
+    Recomputes a single team's score row from its submissions.
+
+    Args:
+        tid: the team id
+    """
+
+    db = api.common.get_conn()
+    db.team_scores.replace_one(
+        {"tid": tid}, compute_team_score(tid), upsert=True)
+    api.group.invalidate_team_groups(tid)
+
+
+def refresh_team_visibility(tid):
+    """
+    Updates the hidden group flag on a team's score row.
+    Should be called whenever the team's group membership changes.
+
+    Args:
+        tid: the team id
+    """
+
+    db = api.common.get_conn()
+    db.team_scores.update_one({
+        "tid": tid
+    }, {"$set": {
+        "hidden": is_team_hidden(tid)
+    }})
+    api.cache.invalidate("scoreboard")
+
+
+def get_solver_tids(pids):
+    """
+    Finds the teams credited with solves of problems, the same way
+    api.problem.get_solved_problems credits them: the team a correct
+    submission was made for and the current team of the submitting user.
+
+    Args:
+        pids: the problem ids
+    Returns:
+        The set of tids of the non-empty credited teams.
+    """
+
+    db = api.common.get_conn()
+
+    tids = set()
+    uids = set()
+    for submission in db.submissions.find({
+            "pid": {
+                "$in": list(pids)
+            },
+            "correct": True
+    }, {
+            "_id": 0,
+            "tid": 1,
+            "uid": 1
+    }):
+        tids.add(submission["tid"])
+        uids.add(submission["uid"])
+
+    for user in db.users.find({
+            "uid": {
+                "$in": list(uids)
+            }
+    }, {
+            "_id": 0,
+            "tid": 1
+    }):
+        tids.add(user["tid"])
+
+    return set(
+        team["tid"]
+        for team in db.teams.find({
+            "tid": {
+                "$in": list(tids)
+            },
+            "size": {
+                "$gt": 0
+            }
+        }, {
+            "_id": 0,
+            "tid": 1
+        }))
+
+
+def rebuild_solver_scores(pids):
+    """
+    Rebuilds the score rows of the teams credited with solves of problems,
+    e.g. after their scores or availability changed.
+
+    Args:
+        pids: the problem ids
+    Returns:
+        The number of rows written.
+    """
+
+    tids = get_solver_tids(pids)
+    for tid in tids:
+        rebuild_team_score(tid)
+
+    api.cache.invalidate("scoreboard")
+    return len(tids)
+
+
+def rebuild_team_scores():
+    """
+    Rebuilds the entire team score table from the submissions.
+
+    Returns:
+        The number of rows written.
+    """
+
+    db = api.common.get_conn()
+
+    count = 0
+    tids = set()
+    for team in api.team.get_all_teams(show_ineligible=True):
+        rebuild_team_score(team["tid"])
+        tids.add(team["tid"])
+        count += 1
+
+    # Remove rows of teams that no longer exist or became empty.
+    db.team_scores.remove({"tid": {"$nin": list(tids)}})
+    api.cache.invalidate("scoreboard")
+
+    return count
+
+
+def check_team_scores():
+    """
+    Compares the team score table against scores computed from submissions.
+
+    Returns:
+        A list of dicts describing every inconsistent row.
+    """
+
+    db = api.common.get_conn()
+
+    rows = {row["tid"]: row for row in db.team_scores.find({}, {"_id": 0})}
+
+    inconsistencies = []
+    for team in api.team.get_all_teams(show_ineligible=True):
+        expected = compute_team_score(team["tid"])
+        actual = rows.pop(team["tid"], None)
+
+        if actual is None:
+            if expected["score"] > 0:
+                inconsistencies.append({
+                    "tid": team["tid"],
+                    "problem": "missing",
+                    "expected": expected["score"]
+                })
+            continue
+
+        for field in ["score", "eligible", "hidden"]:
+            if actual.get(field) != expected[field]:
+                inconsistencies.append({
+                    "tid": team["tid"],
+                    "problem": field,
+                    "expected": expected[field],
+                    "actual": actual.get(field)
+                })
+
+        if "progression" in actual and api.progression.cumulate(
+                actual["progression"]) != api.progression.cumulate(
+                    expected["progression"]):
+            inconsistencies.append({
+                "tid": team["tid"],
+                "problem": "progression"
+            })
+
+        if set(actual.get("solved", [])) != set(expected["solved"]):
+            inconsistencies.append({
+                "tid": team["tid"],
+                "problem": "solved",
+                "expected": sorted(expected["solved"]),
+                "actual": sorted(actual.get("solved", []))
+            })
+
+    for tid in rows:
+        inconsistencies.append({"tid": tid, "problem": "orphaned"})
+
+    return inconsistencies
+
+
+def get_team_scores(eligible, limit=None):
+    """
+    Reads the public scoreboard from the team score table.
+    Teams exclusively in hidden groups and teams without points are excluded.
+
+    Args:
+        eligible: whether to return eligible or ineligible teams
+        limit: optional maximum number of teams to return
+    Returns:
+        A list of score rows ordered by score and then last correct submission.
+    """
+
+    db = api.common.get_conn()
+
+    cursor = db.team_scores.find(_ranked_match(eligible),
+                                 score_projection).sort(score_sort)
+
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    return list(cursor)
+
+
+def _ranked_match(eligible):
+    """
+    Matches the rows on the public scoreboard.
+    """
+
+    return {"eligible": eligible, "hidden": False, "score": {"$gt": 0}}
+
+
+def _relative_match(row, ahead):
+    """
+    Matches the rows of the same scoreboard as a row that rank before it, or
+    after it if ahead is False.
+    """
+
+    before, after = ("$gt", "$lt") if ahead else ("$lt", "$gt")
+
+    match = _ranked_match(row["eligible"])
+    match["$or"] = [{
+        "score": {
+            before: row["score"]
+        }
+    }, {
+        "score": row["score"],
+        "last_correct_submit": {
+            after: row["last_correct_submit"]
+        }
+    }, {
+        "score": row["score"],
+        "last_correct_submit": row["last_correct_submit"],
+        "tid": {
+            after: row["tid"]
+        }
+    }]
+    return match
+
+
+def _ranked(rows, first_rank):
+    result = []
+    for rank, row in enumerate(rows, first_rank):
+        row.pop("last_correct_submit", None)
+        row["rank"] = rank
+        result.append(row)
+    return result
+
+
+@api.cache.memoize(timeout=5, fast=True, tags=["scoreboard"])
+def count_ranked_teams(eligible):
+    """
+    Counts the teams on the public scoreboard.
+
+    Args:
+        eligible: whether to count eligible or ineligible teams
+    Returns:
+        The number of teams.
+    """
+
+    db = api.common.get_conn()
+    return db.team_scores.find(_ranked_match(eligible)).count()
+
+
+@api.cache.memoize(timeout=5, fast=True, tags=["scoreboard"])
+def get_scoreboard_page(eligible, page=1, page_size=50):
+    """
+    Reads a page of the public scoreboard.
+
+    Args:
+        eligible: whether to read the eligible or ineligible scoreboard
+        page: the page number, starting at 1
+        page_size: the number of teams per page, at most max_page_size
+    Returns:
+        A dict with the page, page_size, total number of teams and pages,
+        and the ranked score rows of the page.
+    """
+
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), max_page_size)
+    offset = (page - 1) * page_size
+
+    total = count_ranked_teams(eligible)
+
+    rows = []
+    if offset < total:
+        db = api.common.get_conn()
+        rows = list(
+            db.team_scores.find(_ranked_match(eligible), score_projection)
+            .sort(score_sort).skip(offset).limit(page_size))
+
+    return {
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "pages": (total + page_size - 1) // page_size,
+        "teams": _ranked(rows, offset + 1)
+    }
+
+
+@api.cache.memoize(timeout=5, fast=True, tags=["scoreboard"])
+def get_top_teams(eligible, limit=10):
+    """
+    Reads the top of the public scoreboard.
+
+    Args:
+        eligible: whether to read the eligible or ineligible scoreboard
+        limit: the number of teams, at most max_page_size
+    Returns:
+        The ranked score rows of the top teams.
+    """
+
+    limit = min(max(limit, 1), max_page_size)
+    return _ranked(get_team_scores(eligible, limit=limit), 1)
+
+
+def _get_ranked_row(tid):
+    db = api.common.get_conn()
+
+    projection = dict(score_projection, hidden=1, last_correct_submit=1)
+    row = db.team_scores.find_one({"tid": tid}, projection)
+    if row is None or row.pop("hidden") or row["score"] <= 0:
+        return None
+    return row
+
+
+def get_team_rank(tid):
+    """
+    Finds a team's rank on its public scoreboard with a single count.
+
+    Args:
+        tid: the team id
+    Returns:
+        The ranked score row of the team, or None if the team is not on the
+        scoreboard.
+    """
+
+    db = api.common.get_conn()
+
+    row = _get_ranked_row(tid)
+    if row is None:
+        return None
+
+    rank = db.team_scores.find(_relative_match(row, ahead=True)).count() + 1
+    return _ranked([row], rank)[0]
+
+
+def get_team_neighbors(tid, radius=5):
+    """
+    Reads a team's rank and the teams ranked right before and after it.
+
+    Args:
+        tid: the team id
+        radius: the number of teams before and after, at most max_page_size
+    Returns:
+        A dict with the team's ranked score row and the ranked rows of the
+        teams before (above) and after (below) it, or None if the team is
+        not on the scoreboard.
+    """
+
+    db = api.common.get_conn()
+
+    radius = min(max(radius, 0), max_page_size)
+
+    row = _get_ranked_row(tid)
+    if row is None:
+        return None
+
+    rank = db.team_scores.find(_relative_match(row, ahead=True)).count() + 1
+
+    reverse_sort = [(field, -direction) for field, direction in score_sort]
+    above = list(
+        db.team_scores.find(
+            _relative_match(row, ahead=True),
+            score_projection).sort(reverse_sort).limit(radius))
+    above.reverse()
+    below = list(
+        db.team_scores.find(
+            _relative_match(row, ahead=False),
+            score_projection).sort(score_sort).limit(radius))
+
+    return {
+        "team": _ranked([row], rank)[0],
+        "above": _ranked(above, rank - len(above)),
+        "below": _ranked(below, rank + 1)
+    }
+
+
+def record_first_solve(pid, tid, uid, timestamp):
+    """
+    Registers a correct eligible submission as the first solve of a problem
+    unless the problem already has one. Concurrent solves are decided by the
+    unique pid index, so exactly one team is first.
+
+    Args:
+        pid: the solved problem id
+        tid: the team id
+        uid: the user id
+        timestamp: the time of the correct submission
+    Returns:
+        True if this was the first solve of the problem.
+    """
+
+    db = api.common.get_conn()
+
+    try:
+        previous = db.first_solves.find_one_and_update(
+            {
+                "pid": pid
+            }, {
+                "$setOnInsert": {
+                    "tid": tid,
+                    "uid": uid,
+                    "timestamp": timestamp
+                }
+            },
+            upsert=True,
+            return_document=pymongo.ReturnDocument.BEFORE)
+    except DuplicateKeyError:
+        return False
+
+    return previous is None
+
+
+def get_first_solve(pid):
+    """
+    Returns the first solve of a problem.
+
+    Args:
+        pid: the problem id
+    Returns:
+        A dict with the pid, tid, uid and timestamp, or None if the problem
+        has not been solved.
+    """
+
+    db = api.common.get_conn()
+    return db.first_solves.find_one({"pid": pid}, {"_id": 0})
+
+
+def get_first_solves():
+    """
+    Returns the first solves of every solved problem.
+
+    Returns:
+        A dict of first solves by pid.
+    """
+
+    db = api.common.get_conn()
+    return {
+        first_solve["pid"]: first_solve
+        for first_solve in db.first_solves.find({}, {"_id": 0})
+    }
+
+
+def backfill_first_solves(pids=None):
+    """
+    Rebuilds the first solves from the submissions.
+
+    Args:
+        pids: the problems to rebuild, defaults to every problem
+    Returns:
+        The number of problems with a first solve.
+    """
+
+    db = api.common.get_conn()
+
+    match = {"correct": True, "eligible": True}
+    if pids is not None:
+        match["pid"] = {"$in": list(pids)}
+
+    pipeline = [{
+        "$match": match
+    }, {
+        "$sort": {
+            "timestamp": 1
+        }
+    }, {
+        "$group": {
+            "_id": "$pid",
+            "tid": {
+                "$first": "$tid"
+            },
+            "uid": {
+                "$first": "$uid"
+            },
+            "timestamp": {
+                "$first": "$timestamp"
+            }
+        }
+    }]
+    first_solves = list(db.submissions.aggregate(pipeline, allowDiskUse=True))
+
+    if len(first_solves) > 0:
+        db.first_solves.bulk_write(
+            [
+                pymongo.ReplaceOne(
+                    {"pid": first_solve["_id"]}, {
+                        "pid": first_solve["_id"],
+                        "tid": first_solve["tid"],
+                        "uid": first_solve["uid"],
+                        "timestamp": first_solve["timestamp"]
+                    },
+                    upsert=True) for first_solve in first_solves
+            ],
+            ordered=False)
+
+    # Problems whose solves are gone no longer have a first solve.
+    solved = [first_solve["_id"] for first_solve in first_solves]
+    stale = {"pid": {"$nin": solved}}
+    if pids is not None:
+        stale["pid"]["$in"] = list(pids)
+    db.first_solves.delete_many(stale)
+
+    return len(first_solves)
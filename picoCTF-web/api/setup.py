@@ -20,20 +20,74 @@ def index_mongo():
     db.users.ensure_index("username", unique=True, name="unique username")
 
     db.groups.ensure_index("gid", unique=True, name="unique gid")
+    db.groups.ensure_index("members", name="group members")
+    db.groups.ensure_index("owner", name="group owner")
+    db.groups.ensure_index("teachers", name="group teachers")
     db.problems.ensure_index("pid", unique=True, name="unique pid")
 
-    db.submissions.ensure_index("tid", name="submission tids")
+    # Superseded by the compound submission indexes below.
+    if "submission tids" in db.submissions.index_information():
+        db.submissions.drop_index("submission tids")
+
+    db.submissions.ensure_index(
+        [("tid", 1), ("correct", 1), ("timestamp", 1)],
+        name="team correct submissions")
+    db.submissions.ensure_index(
+        [("uid", 1), ("correct", 1), ("timestamp", 1)],
+        name="user correct submissions")
+    db.submissions.ensure_index(
+        [("pid", 1), ("correct", 1), ("eligible", 1)],
+        name="problem correct submissions")
+    db.submissions.ensure_index(
+        [("tid", 1), ("pid", 1), ("key_hash", 1)],
+        unique=True,
+        partialFilterExpression={"key_hash": {
+            "$exists": True
+        }},
+        name="unique team submission")
     db.ssh.ensure_index("tid", unique=True, name="unique ssh tid")
     db.teams.ensure_index("team_name", unique=True, name="unique team names")
 
     db.shell_servers.ensure_index("name", unique=True, name="unique shell name")
     db.shell_servers.ensure_index("sid", unique=True, name="unique shell sid")
 
+    db.team_scores.ensure_index("tid", unique=True, name="unique score tid")
+    # Superseded by the ranked scoreboard index below.
+    if "scoreboard order" in db.team_scores.index_information():
+        db.team_scores.drop_index("scoreboard order")
+
+    db.team_scores.ensure_index(
+        [("eligible", 1), ("hidden", 1), ("score", -1),
+         ("last_correct_submit", 1), ("tid", 1)],
+        name="ranked scoreboard order")
+    db.first_solves.ensure_index("pid", unique=True, name="unique first solve")
+
+    db.flag_sharing.ensure_index(
+        [("tid", 1), ("pid", 1), ("key_hash", 1)],
+        unique=True,
+        name="unique flagged submission")
+    db.flag_sharing.ensure_index("gids", name="flagged submission groups")
+
     db.cache.ensure_index("expireAt", expireAfterSeconds=0)
-    db.cache.ensure_index("kwargs", name="kwargs")
-    db.cache.ensure_index("kwargs.uid", name="kwargs.uid")
-    db.cache.ensure_index("kwargs.tid", name="kwargs.tid")
-    db.cache.ensure_index("args", name="args")
+    db.cache.ensure_index(
+        [("function", 1), ("args", 1), ("ordered_kwargs", 1)],
+        name="cache key")
+    db.cache.ensure_index("tags", name="tags")
+    db.cache_leases.ensure_index("expireAt", expireAfterSeconds=0)
+    db.cache_invalidations.ensure_index("expireAt", expireAfterSeconds=0)
+    db.cache_invalidations.ensure_index("at", name="invalidation time")
+    db.versions.ensure_index("name", unique=True, name="unique version name")
+
+    db.achievement_events.ensure_index(
+        [("claim", 1), ("created", 1)], name="achievement event queue")
+    db.earned_achievements.ensure_index("tid", name="earned achievement tids")
+    db.earned_achievements.ensure_index(
+        [("aid", 1), ("tid", 1), ("eid", 1)],
+        unique=True,
+        partialFilterExpression={"eid": {
+            "$exists": True
+        }},
+        name="unique earned achievement")
 
     db.shell_servers.ensure_index(
         "sid", unique=True, name="unique shell server id")
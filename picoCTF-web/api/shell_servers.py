@@ -375,10 +375,16 @@ def reassign_teams(include_assigned=False):
         if old_server_number != server_number:
             db.teams.update({
                 'tid': team["tid"]
-            }, {'$set': {
-                'server_number': server_number,
-                'instances': {}
-            }})
+            }, {
+                '$set': {
+                    'server_number': server_number,
+                    'instances': {}
+                },
+                '$inc': {
+                    'problem_view_version': 1
+                }
+            })
+            api.auth.invalidate_request_identity()
             # Re-assign instances
             safe_fail(api.problem.get_visible_problems, team["tid"])
 
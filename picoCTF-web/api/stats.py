@@ -1,5 +1,6 @@
 """ Module for getting competition statistics"""
 
+import csv
 import datetime
 import statistics
 from collections import defaultdict
@@ -8,6 +9,7 @@ from hashlib import sha1
 import api
 import pymongo
 from api.common import InternalException
+from bson import json_util
 
 _get_problem_names = lambda problems: [problem['name'] for problem in problems]
 top_teams = 5
@@ -53,21 +55,65 @@ def get_group_scores(gid=None, name=None):
         A dictionary containing name, tid, and score
     """
 
-    members = [
-        api.team.get_team(tid=tid)
-        for tid in api.group.get_group(gid=gid, name=name)['members']
-    ]
+    if gid is None:
+        gid = api.group.get_group(name=name)["gid"]
+
+    return get_group_scoreboard(gid)
+
+
+@api.cache.memoize(timeout=300)
+def get_group_scoreboard(gid):
+    """
+    Reads the scores of a group's members with one query over the teams and
+    one over the team score table. Cached until a member's score or the
+    members change, see api.group.invalidate_team_groups.
+
+    Args:
+        gid: The group id
+    Returns:
+        A list of dictionaries containing name, tid, affiliation, eligible
+        and score, ordered by score.
+    """
+
+    db = api.common.get_conn()
+
+    members = api.group.get_group(gid=gid)["members"]
+
+    scores = {
+        row["tid"]: row["score"]
+        for row in db.team_scores.find({
+            "tid": {
+                "$in": members
+            }
+        }, {
+            "_id": 0,
+            "tid": 1,
+            "score": 1
+        })
+    }
 
     result = []
-    for team in members:
-        if team["size"] > 0:
-            result.append({
-                "name": team['team_name'],
-                "tid": team['tid'],
-                "affiliation": team["affiliation"],
-                "eligible": team["eligible"],
-                "score": get_score(tid=team['tid'])
-            })
+    for team in db.teams.find({
+            "tid": {
+                "$in": members
+            },
+            "size": {
+                "$gt": 0
+            }
+    }, {
+            "_id": 0,
+            "tid": 1,
+            "team_name": 1,
+            "affiliation": 1,
+            "eligible": 1
+    }):
+        result.append({
+            "name": team['team_name'],
+            "tid": team['tid'],
+            "affiliation": team.get("affiliation"),
+            "eligible": team["eligible"],
+            "score": scores.get(team["tid"], 0)
+        })
 
     return sorted(result, key=lambda entry: entry['score'], reverse=True)
 
@@ -88,14 +134,14 @@ def get_group_average_score(gid=None, name=None):
     return int(total_score / len(group_scores)) if len(group_scores) > 0 else 0
 
 
-# Stored by the cache_stats daemon
-@api.cache.memoize()
-def get_all_team_scores(eligible=None):
+def get_all_team_scores(eligible=None, limit=None):
     """
     Gets the score for every team in the database.
+    Scores are read from the materialized team score table.
 
     Args:
         eligible: required boolean field
+        limit: optional maximum number of teams to return
 
     Returns:
         A list of dictionaries with name and score
@@ -104,57 +150,13 @@ def get_all_team_scores(eligible=None):
     if eligible is None:
         raise InternalException("Eligible must be set to either true or false")
 
-    if eligible:
-        teams = api.team.get_all_teams(eligible=True, ineligible=False)
-    else:
-        teams = api.team.get_all_teams(eligible=False, ineligible=True)
-
-    db = api.api.common.get_conn()
-
-    result = []
-    for team in teams:
-        # Get the full version of the group.
-        groups = [
-            api.group.get_group(group["gid"])
-            for group in api.team.get_groups(tid=team["tid"])
-        ]
-
-        # Determine if the user is exclusively a member of hidden groups.
-        # If they are, they won't be processed.
-        if len(groups) == 0 or any(
-            [not (group["settings"]["hidden"]) for group in groups]):
-            team_query = db.submissions.find({
-                'tid': team['tid'],
-                'eligible': eligible,
-                'correct': True
-            })
-            if team_query.count() > 0:
-                lastsubmit = team_query.sort(
-                    'timestamp', direction=pymongo.DESCENDING)[0]['timestamp']
-            else:
-                lastsubmit = datetime.datetime.now()
-            score = get_score(tid=team['tid'])
-            if score > 0:
-                result.append({
-                    "name": team['team_name'],
-                    "tid": team['tid'],
-                    "score": score,
-                    "affiliation": team["affiliation"],
-                    "eligible": team["eligible"],
-                    "lastsubmit": lastsubmit
-                })
-    time_ordered = sorted(result, key=lambda entry: entry['lastsubmit'])
-    time_ordered_time_removed = [{
-        'name': x['name'],
-        'eligible': x['eligible'],
-        'tid': x['tid'],
-        'score': x['score'],
-        'affiliation': x['affiliation']
-    } for x in time_ordered]
-    return sorted(
-        time_ordered_time_removed,
-        key=lambda entry: entry['score'],
-        reverse=True)
+    return [{
+        "name": row["name"],
+        "eligible": row["eligible"],
+        "tid": row["tid"],
+        "score": row["score"],
+        "affiliation": row["affiliation"]
+    } for row in api.scoreboard.get_team_scores(eligible, limit=limit)]
 
 
 def get_all_user_scores():
@@ -177,7 +179,6 @@ def get_all_user_scores():
     return sorted(result, key=lambda entry: entry['score'], reverse=True)
 
 
-@api.cache.memoize(timeout=120, fast=True)
 def get_problems_by_category():
     """
     Gets the list of all problems divided into categories
@@ -186,30 +187,27 @@ def get_problems_by_category():
         A dictionary of category:[problem list]
     """
 
+    catalog = api.catalog.get_catalog()
+
     result = {
-        cat: _get_problem_names(api.problem.get_all_problems(category=cat))
-        for cat in api.problem.get_all_categories()
+        cat: _get_problem_names(catalog.find(category=cat))
+        for cat in catalog.enabled_categories
     }
 
     return result
 
 
-@api.cache.memoize(timeout=120, fast=True)
 def get_pids_by_category():
+    catalog = api.catalog.get_catalog()
     result = {
-        cat: [x['pid'] for x in api.problem.get_all_problems(category=cat)
-             ] for cat in api.problem.get_all_categories()
+        cat: [x['pid'] for x in catalog.find(category=cat)]
+        for cat in catalog.enabled_categories
     }
     return result
 
 
-@api.cache.memoize(timeout=120, fast=True)
 def get_pid_categories():
-    pid_map = {}
-    for cat in api.problem.get_all_categories():
-        for p in api.problem.get_all_problems(category=cat):
-            pid_map[p['pid']] = cat
-    return pid_map
+    return {p['pid']: p['category'] for p in api.catalog.get_catalog().enabled}
 
 
 def get_team_member_stats(tid):
@@ -270,6 +268,19 @@ def get_score_progression(tid=None, uid=None, category=None):
     solved = api.problem.get_solved_problems(
         tid=tid, uid=uid, category=category)
 
+    return compute_score_progression(solved)
+
+
+def compute_score_progression(solved):
+    """
+    Finds the score and time after each solve of a list of solved problems.
+
+    Args:
+        solved: the solved problems with their solve_time
+    Returns:
+        A list of dictionaries containing score and time
+    """
+
     result = []
     score = 0
 
@@ -303,14 +314,90 @@ def get_top_teams(gid=None, eligible=None):
         if eligible is None:
             raise InternalException(
                 "Eligible must be set to either true or false")
-        all_teams = api.stats.get_all_team_scores(eligible=eligible)
-    else:
-        all_teams = api.stats.get_group_scores(gid=gid)
+        return get_all_team_scores(eligible=eligible, limit=top_teams)
+
+    all_teams = api.stats.get_group_scores(gid=gid)
     return all_teams if len(all_teams) < top_teams else all_teams[:top_teams]
 
 
-# Stored by the cache_stats daemon
-@api.cache.memoize()
+# The solve counters live in a single document, kept up to date by submit_key.
+solve_counts_id = "solves"
+
+
+def count_solve(pid):
+    """
+    Adds a solve to a problem's solve counter.
+
+    Args:
+        pid: the solved problem id
+    """
+
+    db = api.common.get_conn()
+    db.solve_counts.update_one(
+        {"_id": solve_counts_id}, {"$inc": {"counts." + pid: 1}}, upsert=True)
+
+
+def rebuild_solve_counts(pids=None):
+    """
+    Recounts the solves of problems from the submissions, e.g. after they
+    were re-evaluated or cleared.
+
+    Args:
+        pids: the problems to recount, defaults to every problem
+    Returns:
+        A dict of solve counts by pid.
+    """
+
+    db = api.common.get_conn()
+
+    match = {"correct": True}
+    if pids is not None:
+        match["pid"] = {"$in": list(pids)}
+
+    counts = {
+        count["_id"]: count["solves"]
+        for count in db.submissions.aggregate([{
+            "$match": match
+        }, {
+            "$group": {
+                "_id": "$pid",
+                "solves": {
+                    "$sum": 1
+                }
+            }
+        }])
+    }
+
+    if pids is None:
+        db.solve_counts.replace_one(
+            {"_id": solve_counts_id}, {"counts": counts}, upsert=True)
+    elif len(pids) > 0:
+        update = {"counts." + pid: counts.get(pid, 0) for pid in pids}
+        db.solve_counts.update_one(
+            {"_id": solve_counts_id}, {"$set": update}, upsert=True)
+
+    return counts
+
+
+def get_solve_counts():
+    """
+    Returns the number of solves of every problem from the solve counters.
+    Shared by every team's problem list.
+
+    Returns:
+        A dict of solve counts by pid. Unsolved problems may be missing.
+    """
+
+    db = api.common.get_conn()
+
+    document = db.solve_counts.find_one({"_id": solve_counts_id})
+    if document is None:
+        # Counters were never built, e.g. on a database from before them.
+        return rebuild_solve_counts()
+
+    return document["counts"]
+
+
 def get_problem_solves(name=None, pid=None):
     """
     Returns the number of solves for a particular problem.
@@ -325,177 +412,207 @@ def get_problem_solves(name=None, pid=None):
         raise InternalException(
             "You must supply either a pid or name of the problem.")
 
-    db = api.common.get_conn()
-
     problem = api.problem.get_problem(name=name, pid=pid)
 
-    return db.submissions.find({'pid': problem["pid"], 'correct': True}).count()
+    return get_solve_counts().get(problem["pid"], 0)
 
 
-@api.cache.memoize()
-def get_top_teams_score_progressions(gid=None, eligible=True):
+# Stored by the cache_stats daemon
+@api.cache.memoize(timeout=60, single_flight=True, stale=600)
+def get_top_teams_score_progressions(
+        gid=None,
+        eligible=True,
+        points=api.progression.default_points,
+        resolution=None,
+        compact=False):
     """
     Gets the score_progressions for the top teams
 
     Args:
         gid: If specified, compute the progressions for the top teams from this group only
+        points: maximum number of points per team, None for every solve
+        resolution: optional bucket resolution, e.g. "minute", overrides points
+        compact: return [epoch, score] pairs instead of score and time dicts
 
     Returns:
         The top teams and their score progressions.
         A dict of {name: name, score_progression: score_progression}
     """
 
+    teams = get_top_teams(gid=gid, eligible=eligible)
+    progressions = api.progression.get_progressions(
+        [team["tid"] for team in teams], points=points, resolution=resolution)
+
     return [{
-        "name": team["name"],
-        "affiliation": team["affiliation"],
-        "score_progression": get_score_progression(tid=team["tid"]),
-    } for team in get_top_teams(gid=gid, eligible=eligible)]
+        "name":
+        team["name"],
+        "affiliation":
+        team["affiliation"],
+        "score_progression":
+        progressions[team["tid"]] if compact else
+        api.progression.to_score_progression(progressions[team["tid"]]),
+    } for team in teams]
 
 
 # Custom statistics not necessarily to be served publicly
+#
+# The report reads every collection a fixed number of times: the teams and
+# users once, the submissions with two aggregation pipelines and the
+# achievements and reviews with one each. The helpers below take these shared
+# tables as optional arguments and only build them when called on their own.
 
 
 def bar():
     print("------------------")
 
 
-def get_stats():
-    bar()
-    print("Average Eligible, Scoring Team Score: {0:.3f} +/- {1:.3f}".format(
-        *get_average_eligible_score()))
-    print("Median Eligible, Scoring Team Score: {0:.3f}".format(
-        get_median_eligible_score()))
-    bar()
-    print(
-        "Average Number of Problems Solved per Team (eligible, scoring): {0:.3f} +/- {1:.3f}".
-        format(*get_average_problems_solved()))
-    print(
-        "Median Number of Problems Solved per Team (eligible, scoring): {:.3f}".
-        format(get_median_problems_solved()))
-    bar()
-    user_breakdown = get_team_member_solve_stats()
-    print(
-        "Average Number of Problems Solved per User (eligible, user scoring): {0:.3f} +/- {1:.3f}".
-        format(*get_average_problems_solved_per_user(
-            user_breakdown=user_breakdown)))
-    print(
-        "Median Number of Problems Solved per User (eligible, user scoring): {:.3f}".
-        format(
-            get_median_problems_solved_per_user(user_breakdown=user_breakdown)))
-    bar()
-    print("Team participation averages:")
-    correct_percent, any_percent = get_team_participation_percentage(
-        user_breakdown=user_breakdown)
-    for size in sorted(correct_percent.keys()):
-        print(
-            "\tTeam size: {0}\t{1:.3f} submitted a correct answer\t{2:.3f} submitted some answer".
-            format(size, correct_percent[size], any_percent[size]))
+def _mean_stdev(values):
+    if len(values) == 0:
+        return 0, 0
+    if len(values) == 1:
+        return values[0], 0
+    return statistics.mean(values), statistics.stdev(values)
 
-    bar()
-    print("User background breakdown:")
-    for background, count in sorted(
-            get_user_backgrounds().items(), key=lambda x: x[1], reverse=True):
-        print("{0:30} {1}".format(background, count))
-    bar()
-    print("User country breakdown:")
-    for country, count in sorted(
-            get_user_countries().items(), key=lambda x: x[1],
-            reverse=True)[0:15]:
-        print("%s: %s" % (country, count))
-    print("...")
-    bar()
-    print("Event ID breakdown:")
-    for eventid, count in sorted(
-            get_user_game_progress().items(), key=lambda x: x[0]):
-        print("{0:60} {1}".format(eventid, count))
-    bar()
-    print("Average Achievement Number:")
-    print("Average Number of Achievements per Team (all teams): %s +/- %s" %
-          get_average_achievement_number())
-    print("Achievement breakdown:")
-    for achievement, count in sorted(
-            get_achievement_frequency().items(), key=lambda x: x[1],
-            reverse=True):
-        print("{0:30} {1}".format(achievement, count))
-    bar()
-    print("Average # per category per eligible team")
-    for cat, count in get_category_solves().items():
-        print("{0:30} {1:.3f}".format(cat, count))
-    bar()
-    print("Number of days worked by teams")
-    for number, count in get_days_active_breakdown(
-            user_breakdown=user_breakdown).items():
-        print("%s Days: %s Teams" % (number, count))
-    bar()
-    print("REVIEWS:")
-    bar()
-    review_data = get_review_stats()
-    print("Problems by Reviewed Educational Value (10+ Reviews)")
-    for problem in sorted(review_data, key=lambda x: x['education']):
-        if problem['votes'] > 10:
-            print(
-                "{name:30} {education:.3f} ({votes} reviews)".format(**problem))
-    bar()
-    print("Problems by Reviewed Enjoyment (10+ Reviews)")
-    for problem in sorted(review_data, key=lambda x: x['enjoyment']):
-        if problem['votes'] > 10:
-            print(
-                "{name:30} {enjoyment:.3f} ({votes} reviews)".format(**problem))
-    bar()
-    print("Problems by Reviewed Difficulty (10+ Reviews)")
-    for problem in sorted(review_data, key=lambda x: x['difficulty']):
-        if problem['votes'] > 10:
-            print("{name:30} {difficulty:.3f} ({votes} reviews)".format(
-                **problem))
-    bar()
 
+def _median(values):
+    return statistics.median(values) if len(values) > 0 else 0
+
+
+def get_report_teams(eligible=True):
+    """
+    Loads the teams the report covers and their enabled members.
+
+    Args:
+        eligible: only cover eligible teams, otherwise every team
+    Returns:
+        A dict of teams by tid, each with a members list of uids.
+    """
+
+    db = api.common.get_conn()
+
+    match = {"size": {"$gt": 0}}
+    if eligible:
+        match["eligible"] = True
+
+    teams = {
+        team["tid"]: dict(team, members=[])
+        for team in db.teams.find(match, {
+            "_id": 0,
+            "tid": 1,
+            "team_name": 1,
+            "eligible": 1
+        })
+    }
+
+    for user in db.users.find({
+            "disabled": False
+    }, {
+            "_id": 0,
+            "uid": 1,
+            "tid": 1
+    }):
+        if user["tid"] in teams:
+            teams[user["tid"]]["members"].append(user["uid"])
+
+    return teams
+
+
+def get_team_solved_pids(eligible=True, teams=None):
+    """
+    Finds the enabled problems every team solved with one aggregation.
+    Solves are attributed to the team they were submitted for.
+
+    Args:
+        eligible: only cover eligible teams, otherwise every team
+        teams: the report teams, see get_report_teams
+    Returns:
+        A dict of sets of pids by tid.
+    """
+
+    db = api.common.get_conn()
+
+    if teams is None:
+        teams = get_report_teams(eligible)
+
+    enabled = set(p["pid"] for p in api.catalog.get_catalog().enabled)
 
-def get_average_eligible_score():
-    return (statistics.mean([x['score'] for x in get_all_team_scores()]),
-            statistics.stdev([x['score'] for x in get_all_team_scores()]))
+    solved = {tid: set() for tid in teams}
+    for team in db.submissions.aggregate([{
+            "$match": {
+                "correct": True
+            }
+    }, {
+            "$group": {
+                "_id": "$tid",
+                "pids": {
+                    "$addToSet": "$pid"
+                }
+            }
+    }], allowDiskUse=True):
+        if team["_id"] in solved:
+            solved[team["_id"]] = set(team["pids"]) & enabled
 
+    return solved
 
-def get_median_eligible_score():
-    return statistics.median([x['score'] for x in get_all_team_scores()])
 
+def get_average_eligible_score(solved=None):
+    if solved is None:
+        solved = get_team_solved_pids()
+    scores = _team_scores(solved)
+    return _mean_stdev(scores)
 
-def get_average_problems_solved(eligible=True, scoring=True):
-    teams = api.team.get_all_teams(show_ineligible=(not eligible))
-    values = [
-        len(api.problem.get_solved_pids(tid=t['tid']))
-        for t in teams
-        if not scoring or len(api.problem.get_solved_pids(tid=t['tid'])) > 0
+
+def get_median_eligible_score(solved=None):
+    if solved is None:
+        solved = get_team_solved_pids()
+    return _median(_team_scores(solved))
+
+
+def _team_scores(solved):
+    """
+    Returns the scores of the scoring teams of a solved pids table.
+    """
+
+    problems = api.catalog.get_catalog().by_pid
+    scores = [
+        sum(problems[pid]["score"] for pid in pids)
+        for pids in solved.values()
     ]
-    return statistics.mean(values), statistics.stdev(values)
+    return [score for score in scores if score > 0]
 
 
-def get_median_problems_solved(eligible=True, scoring=True):
-    teams = api.team.get_all_teams(show_ineligible=(not eligible))
-    return statistics.median([
-        len(api.problem.get_solved_pids(tid=t['tid']))
-        for t in teams
-        if not scoring or len(api.problem.get_solved_pids(tid=t['tid'])) > 0
+def get_average_problems_solved(eligible=True, scoring=True, solved=None):
+    if solved is None:
+        solved = get_team_solved_pids(eligible)
+    return _mean_stdev([
+        len(pids) for pids in solved.values() if not scoring or len(pids) > 0
     ])
 
 
+def get_median_problems_solved(eligible=True, scoring=True, solved=None):
+    if solved is None:
+        solved = get_team_solved_pids(eligible)
+    return _median([
+        len(pids) for pids in solved.values() if not scoring or len(pids) > 0
+    ])
+
+
+def _user_solves(user_breakdown, scoring):
+    solves = []
+    for tid, breakdown in user_breakdown.items():
+        for uid, ubreakdown in breakdown.items():
+            solved = 0 if ubreakdown is None else ubreakdown["correct"]
+            if solved > 0 or not scoring:
+                solves.append(solved)
+    return solves
+
+
 def get_average_problems_solved_per_user(eligible=True,
                                          scoring=True,
                                          user_breakdown=None):
     if user_breakdown is None:
         user_breakdown = get_team_member_solve_stats(eligible)
-    solves = []
-    for tid, breakdown in user_breakdown.items():
-        for uid, ubreakdown in breakdown.items():
-            if ubreakdown is None:
-                solved = 0
-            else:
-                if 'correct' in ubreakdown:
-                    solved = ubreakdown['correct']
-                else:
-                    solved = 0
-            if solved > 0 or not scoring:
-                solves += [solved]
-    return (statistics.mean(solves), statistics.stdev(solves))
+    return _mean_stdev(_user_solves(user_breakdown, scoring))
 
 
 def get_median_problems_solved_per_user(eligible=True,
@@ -503,80 +620,123 @@ def get_median_problems_solved_per_user(eligible=True,
                                         user_breakdown=None):
     if user_breakdown is None:
         user_breakdown = get_team_member_solve_stats(eligible)
-    solves = []
-    for tid, breakdown in user_breakdown.items():
-        for uid, ubreakdown in breakdown.items():
-            if ubreakdown is None:
-                solved = 0
-            else:
-                if 'correct' in ubreakdown:
-                    solved = ubreakdown['correct']
-                else:
-                    solved = 0
-            if solved > 0 or not scoring:
-                solves += [solved]
-    return statistics.median(solves)
+    return _median(_user_solves(user_breakdown, scoring))
+
+
+def _count_users_by(field):
+    db = api.common.get_conn()
+    return {
+        str(group["_id"]): group["count"]
+        for group in db.users.aggregate([{
+            "$group": {
+                "_id": "$" + field,
+                "count": {
+                    "$sum": 1
+                }
+            }
+        }])
+    }
 
 
 def get_user_backgrounds():
-    db = api.api.common.get_conn()
-    all_users = db.users.find()
-    backgrounds = defaultdict(int)
-    for user in all_users:
-        if 'background' in user:
-            backgrounds[user['background']] += 1
-        else:
-            print("No background for user %s" % user)
-    return backgrounds
+    return _count_users_by("background")
 
 
 def get_user_countries():
-    db = api.api.common.get_conn()
-    all_users = db.users.find()
-    countries = defaultdict(int)
-    for user in all_users:
-        countries[user['country']] += 1
-    return countries
+    return _count_users_by("country")
 
 
-def get_team_size_distribution(eligible=True):
-    teams = api.team.get_all_teams(show_ineligible=(not eligible))
+def get_team_size_distribution(eligible=True, teams=None):
+    if teams is None:
+        teams = get_report_teams(eligible)
     size_dist = defaultdict(int)
-    for t in teams:
-        members = api.team.get_team_members(tid=t['tid'], show_disabled=False)
-        if len(members) > api.team.max_team_users:
-            print("WARNING: Team %s has too many members" % t['team_name'])
-        size_dist[len(members)] += 1
+    for team in teams.values():
+        if len(team["members"]) > api.team.max_team_users:
+            print("WARNING: Team %s has too many members" % team["team_name"])
+        size_dist[len(team["members"])] += 1
     return size_dist
 
 
-def get_team_member_solve_stats(eligible=True):
-    db = api.api.common.get_conn()
-    teams = api.team.get_all_teams(show_ineligible=(not eligible))
-    user_breakdowns = {}
-    for t in teams:
-        uid_map = defaultdict(lambda: defaultdict(int))
-        members = api.team.get_team_members(tid=t['tid'], show_disabled=False)
-        subs = db.submissions.find({'tid': t['tid']})
-        for sub in subs:
-            uid = sub['uid']
-            uid_map[uid]['submits'] += 1
-            if uid_map[uid]['times'] == 0:
-                uid_map[uid]['times'] = list()
-            uid_map[uid]['times'].append(sub['timestamp'])
-            if sub['correct']:
-                uid_map[uid]['correct'] += 1
-                uid_map[uid][sub['category']] += 1
-            else:
-                uid_map[uid]['incorrect'] += 1
-        user_breakdowns[t['tid']] = uid_map
-        for member in members:
-            if member['uid'] not in uid_map:
-                uid_map[uid] = None
+def get_team_member_solve_stats(eligible=True, teams=None):
+    """
+    Summarizes the submissions of every member of every team with one
+    aggregation.
+
+    Args:
+        eligible: only cover eligible teams, otherwise every team
+        teams: the report teams, see get_report_teams
+    Returns:
+        A dict by tid of dicts by uid of the member's submits, correct and
+        incorrect submission counts, correct submissions per category and
+        the days with a submission. Members without submissions are None.
+    """
+
+    db = api.common.get_conn()
+
+    if teams is None:
+        teams = get_report_teams(eligible)
+
+    user_breakdowns = {
+        tid: {uid: None
+              for uid in team["members"]}
+        for tid, team in teams.items()
+    }
+
+    for group in db.submissions.aggregate([{
+            "$group": {
+                "_id": {
+                    "tid": "$tid",
+                    "uid": "$uid",
+                    "category": "$category",
+                    "correct": "$correct"
+                },
+                "count": {
+                    "$sum": 1
+                },
+                "days": {
+                    "$addToSet": {
+                        "$dateToString": {
+                            "format": "%Y-%m-%d",
+                            "date": "$timestamp"
+                        }
+                    }
+                }
+            }
+    }], allowDiskUse=True):
+        key = group["_id"]
+        # Only the enabled members of the report teams are covered.
+        if key["uid"] not in user_breakdowns.get(key["tid"], {}):
+            continue
+
+        breakdown = user_breakdowns[key["tid"]]
+        if breakdown[key["uid"]] is None:
+            breakdown[key["uid"]] = {
+                "submits": 0,
+                "correct": 0,
+                "incorrect": 0,
+                "categories": defaultdict(int),
+                "days": set()
+            }
+
+        work = breakdown[key["uid"]]
+        work["submits"] += group["count"]
+        work["days"].update(group["days"])
+        if key["correct"]:
+            work["correct"] += group["count"]
+            work["categories"][key["category"]] += group["count"]
+        else:
+            work["incorrect"] += group["count"]
+
     return user_breakdowns
 
 
 def get_team_participation_percentage(eligible=True, user_breakdown=None):
+    """
+    Returns:
+        The average number of members that submitted a correct answer and
+        that submitted any answer, by team size.
+    """
+
     if user_breakdown is None:
         user_breakdown = get_team_member_solve_stats(eligible)
     team_size_any = defaultdict(list)
@@ -591,39 +751,55 @@ def get_team_participation_percentage(eligible=True, user_breakdown=None):
                     count_correct += 1
         team_size_any[len(breakdown.keys())].append(count_any)
         team_size_correct[len(breakdown.keys())].append(count_correct)
-    return {x: statistics.mean(y) for x, y in team_size_any.items()}, \
-           {x: statistics.mean(y) for x, y in team_size_correct.items()}
+    return {x: statistics.mean(y) for x, y in team_size_correct.items()}, \
+           {x: statistics.mean(y) for x, y in team_size_any.items()}
 
 
 def get_achievement_frequency():
-    earned_achievements = api.achievement.get_earned_achievement_instances()
-    frequency = defaultdict(int)
-    for achievement in earned_achievements:
-        frequency[achievement['name']] += 1
-    return frequency
-
-
-def get_average_achievement_number():
-    earned_achievements = api.achievement.get_earned_achievement_instances()
-    frequency = defaultdict(int)
-    for achievement in earned_achievements:
-        frequency[achievement['uid']] += 1
-    extra = len(api.team.get_all_teams(show_ineligible=False)) - len(
-        frequency.keys())
-    values = [0] * extra
-    for val in frequency.values():
-        values.append(val)
-    return statistics.mean(values), statistics.stdev(values)
+    db = api.common.get_conn()
+    return {
+        group["_id"]: group["count"]
+        for group in db.earned_achievements.aggregate([{
+            "$group": {
+                "_id": "$name",
+                "count": {
+                    "$sum": 1
+                }
+            }
+        }])
+    }
 
 
-def get_category_solves(eligible=True):
-    teams = api.team.get_all_teams(show_ineligible=(not eligible))
+def get_average_achievement_number(eligible=True, teams=None):
+    db = api.common.get_conn()
+
+    if teams is None:
+        teams = get_report_teams(eligible)
+
+    counts = {tid: 0 for tid in teams}
+    for group in db.earned_achievements.aggregate([{
+            "$group": {
+                "_id": "$tid",
+                "count": {
+                    "$sum": 1
+                }
+            }
+    }]):
+        if group["_id"] in counts:
+            counts[group["_id"]] = group["count"]
+
+    return _mean_stdev(list(counts.values()))
+
+
+def get_category_solves(eligible=True, solved=None):
+    if solved is None:
+        solved = get_team_solved_pids(eligible)
+    problems = api.catalog.get_catalog().by_pid
     category_breakdown = defaultdict(int)
-    for team in teams:
-        problems = api.problem.get_solved_problems(tid=team['tid'])
-        for problem in problems:
-            category_breakdown[problem['category']] += 1
-    team_count = len(api.team.get_all_teams(show_ineligible=False))
+    for pids in solved.values():
+        for pid in pids:
+            category_breakdown[problems[pid]["category"]] += 1
+    team_count = max(len(solved), 1)
     return {x: y / team_count for x, y in category_breakdown.items()}
 
 
@@ -634,71 +810,251 @@ def get_days_active_breakdown(eligible=True, user_breakdown=None):
     for tid, breakdown in user_breakdown.items():
         days_active = set()
         for uid, work in breakdown.items():
-            if work is None:
-                continue
-            for time in work['times']:
-                days_active.add(time.date())
+            if work is not None:
+                days_active.update(work["days"])
         day_breakdown[len(days_active)] += 1
     return day_breakdown
 
 
-@api.cache.memoize(timeout=300)
+def get_stats_report(eligible=True):
+    """
+    Computes every statistic of the post competition report from shared
+    tables.
+
+    Args:
+        eligible: only cover eligible teams, otherwise every team
+    Returns:
+        A dict of statistics.
+    """
+
+    teams = get_report_teams(eligible)
+    solved = get_team_solved_pids(eligible, teams=teams)
+    user_breakdown = get_team_member_solve_stats(eligible, teams=teams)
+
+    def summary(mean_stdev, median):
+        return {
+            "mean": mean_stdev[0],
+            "stdev": mean_stdev[1],
+            "median": median
+        }
+
+    correct_percent, any_percent = get_team_participation_percentage(
+        user_breakdown=user_breakdown)
+    achievements_mean, achievements_stdev = get_average_achievement_number(
+        teams=teams)
+
+    return {
+        "generated": datetime.datetime.utcnow(),
+        "eligible": eligible,
+        "teams": len(teams),
+        "team_score":
+        summary(
+            get_average_eligible_score(solved=solved),
+            get_median_eligible_score(solved=solved)),
+        "team_problems_solved":
+        summary(
+            get_average_problems_solved(solved=solved),
+            get_median_problems_solved(solved=solved)),
+        "user_problems_solved":
+        summary(
+            get_average_problems_solved_per_user(
+                user_breakdown=user_breakdown),
+            get_median_problems_solved_per_user(
+                user_breakdown=user_breakdown)),
+        "team_participation": {
+            size: {
+                "correct": correct_percent[size],
+                "any": any_percent[size]
+            }
+            for size in correct_percent
+        },
+        "team_sizes": dict(get_team_size_distribution(teams=teams)),
+        "user_backgrounds": get_user_backgrounds(),
+        "user_countries": get_user_countries(),
+        "achievements": {
+            "mean": achievements_mean,
+            "stdev": achievements_stdev,
+            "frequency": get_achievement_frequency()
+        },
+        "category_solves": get_category_solves(solved=solved),
+        "days_active": dict(
+            get_days_active_breakdown(user_breakdown=user_breakdown)),
+        "reviews": get_review_stats()
+    }
+
+
+def _flatten(value, prefix=""):
+    """
+    Yields (name, value) pairs of the leaves of nested dicts and lists.
+    """
+
+    if isinstance(value, dict):
+        items = sorted(value.items(), key=lambda item: str(item[0]))
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        yield prefix, value
+        return
+
+    for key, child in items:
+        name = "{}.{}".format(prefix, key) if prefix else str(key)
+        for leaf in _flatten(child, name):
+            yield leaf
+
+
+def write_stats_report(report, output, output_format="json"):
+    """
+    Writes a statistics report.
+
+    Args:
+        report: the report from get_stats_report
+        output: a file object
+        output_format: "json", or "csv" for one statistic per row
+    """
+
+    if output_format == "json":
+        output.write(json_util.dumps(report, indent=2, sort_keys=True))
+        output.write("\n")
+    elif output_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(["statistic", "value"])
+        for name, value in _flatten(report):
+            writer.writerow([name, value])
+    else:
+        raise InternalException(
+            "Unknown report format '{}'.".format(output_format))
+
+
+def get_stats(eligible=True):
+    report = get_stats_report(eligible)
+
+    bar()
+    print("Average Eligible, Scoring Team Score: {0:.3f} +/- {1:.3f}".format(
+        report["team_score"]["mean"], report["team_score"]["stdev"]))
+    print("Median Eligible, Scoring Team Score: {0:.3f}".format(
+        report["team_score"]["median"]))
+    bar()
+    print(
+        "Average Number of Problems Solved per Team (eligible, scoring): {0:.3f} +/- {1:.3f}".
+        format(report["team_problems_solved"]["mean"],
+               report["team_problems_solved"]["stdev"]))
+    print(
+        "Median Number of Problems Solved per Team (eligible, scoring): {:.3f}".
+        format(report["team_problems_solved"]["median"]))
+    bar()
+    print(
+        "Average Number of Problems Solved per User (eligible, user scoring): {0:.3f} +/- {1:.3f}".
+        format(report["user_problems_solved"]["mean"],
+               report["user_problems_solved"]["stdev"]))
+    print(
+        "Median Number of Problems Solved per User (eligible, user scoring): {:.3f}".
+        format(report["user_problems_solved"]["median"]))
+    bar()
+    print("Team participation averages:")
+    for size, participation in sorted(report["team_participation"].items()):
+        print(
+            "\tTeam size: {0}\t{1:.3f} submitted a correct answer\t{2:.3f} submitted some answer".
+            format(size, participation["correct"], participation["any"]))
+    bar()
+    print("User background breakdown:")
+    for background, count in sorted(
+            report["user_backgrounds"].items(),
+            key=lambda x: x[1],
+            reverse=True):
+        print("{0:30} {1}".format(background, count))
+    bar()
+    print("User country breakdown:")
+    for country, count in sorted(
+            report["user_countries"].items(), key=lambda x: x[1],
+            reverse=True)[0:15]:
+        print("%s: %s" % (country, count))
+    print("...")
+    bar()
+    print("Average Achievement Number:")
+    print("Average Number of Achievements per Team: %s +/- %s" %
+          (report["achievements"]["mean"], report["achievements"]["stdev"]))
+    print("Achievement breakdown:")
+    for achievement, count in sorted(
+            report["achievements"]["frequency"].items(),
+            key=lambda x: x[1],
+            reverse=True):
+        print("{0:30} {1}".format(achievement, count))
+    bar()
+    print("Average # per category per eligible team")
+    for cat, count in report["category_solves"].items():
+        print("{0:30} {1:.3f}".format(cat, count))
+    bar()
+    print("Number of days worked by teams")
+    for number, count in sorted(report["days_active"].items()):
+        print("%s Days: %s Teams" % (number, count))
+    bar()
+    print("REVIEWS:")
+    bar()
+    review_data = report["reviews"]
+    print("Problems by Reviewed Educational Value (10+ Reviews)")
+    for problem in sorted(review_data, key=lambda x: x['education']):
+        if problem['votes'] > 10:
+            print(
+                "{name:30} {education:.3f} ({votes} reviews)".format(**problem))
+    bar()
+    print("Problems by Reviewed Enjoyment (10+ Reviews)")
+    for problem in sorted(review_data, key=lambda x: x['enjoyment']):
+        if problem['votes'] > 10:
+            print(
+                "{name:30} {enjoyment:.3f} ({votes} reviews)".format(**problem))
+    bar()
+    print("Problems by Reviewed Difficulty (10+ Reviews)")
+    for problem in sorted(review_data, key=lambda x: x['difficulty']):
+        if problem['votes'] > 10:
+            print("{name:30} {difficulty:.3f} ({votes} reviews)".format(
+                **problem))
+    bar()
+
+
 def check_invalid_instance_submissions(gid=None):
-    db = api.api.common.get_conn()
-    badteams = set()
-    shared_key_submissions = []
-
-    group = None
-    if gid is not None:
-        group = api.group.get_group(gid=gid)
-
-    for problem in api.problem.get_all_problems(show_disabled=True):
-        valid_keys = [instance['flag'] for instance in problem['instances']]
-        incorrect_submissions = db.submissions.find({
-            'pid': problem['pid'],
-            'correct': False
-        }, {"_id": 0})
-        for submission in incorrect_submissions:
-            if submission['key'] in valid_keys:
-                # make sure that the key is still invalid
-                if not api.problem.grade_problem(
-                        submission['pid'], submission['key'],
-                        tid=submission['tid'])['correct']:
-                    if group is None or submission['tid'] in group['members']:
-                        submission['username'] = api.user.get_user(
-                            uid=submission['uid'])['username']
-                        submission["problem_name"] = problem["name"]
-                        shared_key_submissions.append(submission)
-
-    return shared_key_submissions
+    """
+    Gets the submissions of flags of other teams' instances.
+
+    Args:
+        gid: optional group whose members' submissions to return
+    Returns:
+        A list of flagged submissions, see api.flag_sharing.
+    """
+
+    return api.flag_sharing.get_flagged_submissions(gid=gid)
 
 
 def get_review_stats():
+    db = api.common.get_conn()
+    problems = api.catalog.get_catalog().by_pid
+
     results = []
-    problems = api.problem.get_all_problems()
-    for p in problems:
-        timespent = 0
-        enjoyment = 0
-        difficulty = 0
-        edval = 0
-        counter = 0
-        for item in api.problem_feedback.get_problem_feedback(pid=p['pid']):
-            counter += 1
-            metrics = item['feedback']['metrics']
-            edval += metrics['educational-value']
-            difficulty += metrics['difficulty']
-            enjoyment += metrics['enjoyment']
-            timespent += item['feedback']['timeSpent']
-        if counter > 0:
-            results.append({
-                'name': p['name'],
-                'education': edval / counter,
-                'difficulty': difficulty / counter,
-                'enjoyment': enjoyment / counter,
-                'time': timespent / counter,
-                'votes': counter
-            })
-    return results
+    for review in db.problem_feedback.aggregate([{
+            "$group": {
+                "_id": "$pid",
+                "education": {
+                    "$avg": "$feedback.metrics.educational-value"
+                },
+                "difficulty": {
+                    "$avg": "$feedback.metrics.difficulty"
+                },
+                "enjoyment": {
+                    "$avg": "$feedback.metrics.enjoyment"
+                },
+                "time": {
+                    "$avg": "$feedback.timeSpent"
+                },
+                "votes": {
+                    "$sum": 1
+                }
+            }
+    }]):
+        problem = problems.get(review["_id"])
+        if problem is not None and not problem["disabled"]:
+            review["name"] = problem["name"]
+            review.pop("_id")
+            results.append(review)
+    return sorted(results, key=lambda review: review["name"])
 
 
 def print_review_comments():
@@ -718,7 +1074,8 @@ def print_review_comments():
                 print("'%s'" % comment)
 
 
-@api.cache.memoize()
+# Stored by the cache_stats daemon
+@api.cache.memoize(timeout=60, single_flight=True, stale=600)
 def get_registration_count():
     db = api.common.get_conn()
     users = db.users.count();
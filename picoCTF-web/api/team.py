@@ -51,7 +51,9 @@ update_team_schema = Schema(
 
 def get_team(tid=None, name=None):
     """
-    Retrieve a team based on a property (tid, name, etc.).
+    Retrieve a team based on a property (tid, name, etc.). Every team is
+    returned without its password and instances, see
+    api.auth.request_team_projection and get_team_instances.
 
     Args:
         tid: team id
@@ -64,15 +66,22 @@ def get_team(tid=None, name=None):
 
     match = {}
     if tid is not None:
+        if tid == api.auth.get_request_tid():
+            team = api.auth.get_request_team()
+            if team is not None:
+                return team
         match.update({'tid': tid})
     elif name is not None:
         match.update({'team_name': name})
     elif api.auth.is_logged_in():
-        match.update({"tid": api.user.get_user()["tid"]})
+        team = api.auth.get_request_team()
+        if team is None:
+            raise InternalException("Team does not exist.")
+        return team
     else:
         raise InternalException("Must supply tid or team name to get_team")
 
-    team = db.teams.find_one(match, {"_id": 0})
+    team = db.teams.find_one(match, api.auth.request_team_projection)
 
     if team is None:
         raise InternalException("Team does not exist.")
@@ -80,6 +89,45 @@ def get_team(tid=None, name=None):
     return team
 
 
+def get_team_instances(tid):
+    """
+    Returns the problem instances assigned to a team. The current request's
+    own team is served from the request context.
+
+    Args:
+        tid: the team id
+    Returns:
+        A dict of the assigned iids by pid.
+    """
+
+    if tid == api.auth.get_request_tid():
+        instances = api.auth.get_request_team_instances()
+        if instances is not None:
+            return instances
+
+    db = api.common.get_conn()
+
+    team = db.teams.find_one({"tid": tid}, {"_id": 0, "instances": 1})
+    if team is None:
+        raise InternalException("Team does not exist.")
+
+    return team["instances"]
+
+
+def bump_problem_view_version(tid):
+    """
+    Marks the team's serialized problem view as outdated. Must be called
+    whenever the team's solved or unlocked problems or its instances change.
+
+    Args:
+        tid: the team id
+    """
+
+    db = api.common.get_conn()
+    db.teams.update_one({"tid": tid}, {"$inc": {"problem_view_version": 1}})
+    api.auth.invalidate_request_identity()
+
+
 def get_groups(tid=None, uid=None):
     """
     Get the group membership for a team.
@@ -119,8 +167,22 @@ def get_groups(tid=None, uid=None):
     } if not admin else {}
     associated_groups = db.groups.find(group_query, group_projection)
 
-    for group in list(associated_groups):
-        owner = api.team.get_team(tid=group['owner'])['team_name']
+    associated_groups = list(associated_groups)
+    owners = {
+        team["tid"]: team["team_name"]
+        for team in db.teams.find({
+            "tid": {
+                "$in": list(set(group["owner"] for group in associated_groups))
+            }
+        }, {
+            "_id": 0,
+            "tid": 1,
+            "team_name": 1
+        })
+    }
+
+    for group in associated_groups:
+        owner = owners[group['owner']]
         groups.append({
             'name':
             group['name'],
@@ -251,56 +313,154 @@ def get_team_uids(tid=None, name=None, show_disabled=True):
     ]
 
 
-def get_team_information(tid=None, gid=None):
+# Fields get_team_information adds to the team document.
+team_information_fields = [
+    "score", "members", "competition_active", "progression",
+    "flagged_submissions", "max_team_size", "achievements", "solved_problems"
+]
+
+
+def get_team_information(tid=None, gid=None, fields=None):
     """
-    Retrieves the information of a team.
+    Retrieves the information of a team. Viewing it marks the team's
+    achievements seen.
 
     Args:
         tid: the team id
+        gid: optional group whose teachers are flagged in the members
+        fields: optional list of team_information_fields to compute,
+                defaults to all of them
     Returns:
         A dict of team information.
             team_name
             members
     """
 
-    team_info = get_team(tid=tid)
-
     if tid is None:
-        tid = team_info["tid"]
-
-    if gid is not None:
-        group = api.group.get_group(gid=gid)
-        roles = api.group.get_roles_in_group(group["gid"], tid=tid)
-
-    team_info["score"] = api.stats.get_score(tid=tid)
-    team_info["members"] = [{
-        "username": member["username"],
-        "firstname": member["firstname"],
-        "lastname": member["lastname"],
-        "email": member["email"],
-        "uid": member["uid"],
-        "affiliation": member.get("affiliation", "None"),
-        "teacher": roles["teacher"] if gid else False
-    } for member in get_team_members(tid=tid, show_disabled=False)]
-    team_info["competition_active"] = api.utilities.check_competition_active()
-    team_info["progression"] = api.stats.get_score_progression(tid=tid)
-    team_info["flagged_submissions"] = [
-        sub for sub in api.stats.check_invalid_instance_submissions()
-        if sub['tid'] == tid
-    ]
-    team_info["max_team_size"] = api.config.get_settings()["max_team_size"]
+        tid = get_team()["tid"]
+
+    return get_teams_information(
+        [tid], gid=gid, fields=fields, mark_achievements_seen=True)[0]
+
+
+def get_teams_information(tids, gid=None, fields=None,
+                          mark_achievements_seen=False):
+    """
+    Retrieves the information of several teams. The number of queries does
+    not depend on the number of teams.
+
+    Args:
+        tids: the team ids
+        gid: optional group whose teachers are flagged in the members
+        fields: optional list of team_information_fields to compute,
+                defaults to all of them
+        mark_achievements_seen: whether to mark the teams' achievements seen
+    Returns:
+        A list of team information dicts in the order of the tids.
+    """
 
-    if api.config.get_settings()["achievements"]["enable_achievements"]:
-        team_info["achievements"] = api.achievement.get_earned_achievements(
-            tid=tid)
+    db = api.common.get_conn()
+    settings = api.config.get_settings()
 
-    team_info["solved_problems"] = []
-    for solved_problem in api.problem.get_solved_problems(tid=tid):
-        solved_problem.pop("instances", None)
-        solved_problem.pop("pkg_dependencies", None)
-        team_info["solved_problems"].append(solved_problem)
+    fields = set(team_information_fields if fields is None else fields)
+    unknown = fields.difference(team_information_fields)
+    if len(unknown) > 0:
+        raise InternalException("Unknown team information fields: {}".format(
+            ", ".join(sorted(unknown))))
+
+    teams = {
+        team["tid"]: team
+        for team in db.teams.find({
+            "tid": {
+                "$in": list(tids)
+            }
+        }, api.auth.request_team_projection)
+    }
+    if len(teams) < len(set(tids)):
+        raise InternalException("Team does not exist.")
 
-    return team_info
+    information = {tid: dict(teams[tid]) for tid in tids}
+
+    if fields.intersection(
+        ["members", "score", "progression", "solved_problems"]):
+        members = {tid: [] for tid in tids}
+        for user in db.users.find({
+                "tid": {
+                    "$in": list(tids)
+                }
+        }, {
+                "_id": 0,
+                "uid": 1,
+                "tid": 1,
+                "username": 1,
+                "firstname": 1,
+                "lastname": 1,
+                "email": 1,
+                "affiliation": 1,
+                "disabled": 1
+        }):
+            members[user["tid"]].append(user)
+
+    if "members" in fields:
+        teachers = set()
+        if gid is not None:
+            group = api.group.get_group(gid=gid)
+            teachers = set(group["teachers"] + [group["owner"]])
+
+        for tid in tids:
+            information[tid]["members"] = [{
+                "username": member["username"],
+                "firstname": member["firstname"],
+                "lastname": member["lastname"],
+                "email": member["email"],
+                "uid": member["uid"],
+                "affiliation": member.get("affiliation", "None"),
+                "teacher": tid in teachers
+            } for member in members[tid] if not member.get("disabled", False)]
+
+    if fields.intersection(["score", "progression", "solved_problems"]):
+        solved = api.problem.get_teams_solved_problems({
+            tid: [member["uid"] for member in members[tid]]
+            for tid in tids
+        })
+
+        for tid in tids:
+            if "score" in fields:
+                information[tid]["score"] = sum(
+                    problem["score"] for problem in solved[tid])
+            if "progression" in fields:
+                information[tid]["progression"] = \
+                    api.stats.compute_score_progression(solved[tid])
+            if "solved_problems" in fields:
+                for problem in solved[tid]:
+                    problem.pop("instances", None)
+                    problem.pop("pkg_dependencies", None)
+                information[tid]["solved_problems"] = solved[tid]
+
+    if "flagged_submissions" in fields:
+        for tid in tids:
+            information[tid]["flagged_submissions"] = []
+        for submission in api.flag_sharing.get_flagged_submissions(tids=tids):
+            information[submission["tid"]]["flagged_submissions"].append(
+                submission)
+
+    if "competition_active" in fields:
+        competition_active = api.utilities.check_competition_active()
+        for tid in tids:
+            information[tid]["competition_active"] = competition_active
+
+    if "max_team_size" in fields:
+        for tid in tids:
+            information[tid]["max_team_size"] = settings["max_team_size"]
+
+    if "achievements" in fields and \
+            settings["achievements"]["enable_achievements"]:
+        achievements = api.achievement.get_teams_earned_achievements(
+            tids, mark_seen=mark_achievements_seen)
+        for tid in tids:
+            information[tid]["achievements"] = achievements[tid]
+
+    return [information[tid] for tid in tids]
 
 
 def get_all_teams(ineligible=False, eligible=True, show_ineligible=False):
@@ -368,7 +528,14 @@ def join_team(team_name, password, uid=None):
     db = api.common.get_conn()
     max_team_size = api.config.get_settings()["max_team_size"]
 
-    if api.auth.confirm_password(password, desired_team["password"]
+    password_hash = db.teams.find_one({
+        "tid": desired_team["tid"]
+    }, {
+        "_id": 0,
+        "password": 1
+    })["password"]
+
+    if api.auth.confirm_password(password, password_hash
                                 ) and desired_team["size"] < max_team_size:
         user_team_update = db.users.find_and_modify(
             query={
@@ -391,7 +558,8 @@ def join_team(team_name, password, uid=None):
                 }
             },
             update={"$inc": {
-                "size": 1
+                "size": 1,
+                "problem_view_version": 1
             }},
             new=True)
 
@@ -407,6 +575,8 @@ def join_team(team_name, password, uid=None):
             }},
             new=True)
 
+        api.auth.invalidate_request_identity()
+
         if not desired_team_size_update or not current_team_size_update:
             raise InternalException(
                 "There was an issue switching your team! Please contact an administrator."
@@ -425,22 +595,14 @@ def join_team(team_name, password, uid=None):
                         api.group.join_group(gid=group["gid"], tid=desired_team["tid"])
 
 
-        # Called from within get_solved_problems, clear first
-        api.cache.invalidate_memoization(api.problem.get_unlocked_pids,
-                                         {"args": [desired_team["tid"]]})
-
-        # Clear solved
-        api.cache.invalidate_memoization(api.problem.get_solved_problems,
-                                         {"kwargs.tid": desired_team["tid"]},
-                                         {"kwargs.uid": uid})
-
-        # Make sure team score is reflected as well
-        api.cache.invalidate_memoization(api.stats.get_score,
-                                         {"kwargs.tid": desired_team["tid"]})
+        # Clear solved and unlocked problems, scores and score progressions
+        api.cache.invalidate(
+            api.cache.tag("tid", desired_team["tid"]),
+            api.cache.tag("tid", current_team["tid"]),
+            api.cache.tag("uid", user["uid"]))
 
-        # Update score progression
-        api.cache.invalidate_memoization(api.stats.get_score_progression,
-                                         {"kwargs.tid": desired_team["tid"]})
+        # The new member's solves now count towards the team.
+        api.scoreboard.rebuild_team_score(desired_team["tid"])
 
         return True
     else:
@@ -490,6 +652,7 @@ def update_password(tid, password):
     }, {'$set': {
         'password': api.common.hash_password(password)
     }})
+    api.auth.invalidate_request_identity()
 
 
 def is_teacher_team(tid):
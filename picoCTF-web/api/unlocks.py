@@ -0,0 +1,120 @@
+"""
+Compiled problem unlock graph.
+
+Bundles specify, per problem, a threshold and a weight map over other
+problems. The graph compiles the dependencies of all bundles with enabled
+dependencies once, so checking a problem does not read the bundles again,
+and indexes which problems reference each problem so that a single solve
+only re-checks the problems it can unlock.
+
+Every process keeps its own graph. It is rebuilt when the bundles change
+and other processes notice the change through the "bundles" version.
+"""
+
+from collections import defaultdict
+
+import api
+
+log = api.logger.use(__name__)
+
+
+class UnlockGraph(object):
+    """
+    Unlock constraints of every problem, keyed by sanitized name.
+    """
+
+    def __init__(self, bundles):
+        self.constraints = defaultdict(list)
+        self.dependents = defaultdict(set)
+
+        for bundle in bundles:
+            if "dependencies" not in bundle or \
+                    not bundle.get("dependencies_enabled", False):
+                continue
+
+            for name, dependency in bundle["dependencies"].items():
+                if name not in bundle["problems"]:
+                    continue
+
+                weightmap = dict(dependency["weightmap"])
+                self.constraints[name].append((dependency["threshold"],
+                                               weightmap))
+                for referenced in weightmap:
+                    self.dependents[referenced].add(name)
+
+    def is_unlocked(self, name, solved):
+        """
+        Checks if a problem is unlocked. A problem is unlocked if it meets
+        the threshold of every bundle that specifies a dependency for it.
+
+        Args:
+            name: the sanitized name of the problem
+            solved: set of sanitized names of the solved problems
+        Returns:
+            True if the problem is unlocked.
+        """
+
+        for threshold, weightmap in self.constraints.get(name, []):
+            weightsum = sum(weight for referenced, weight in weightmap.items()
+                            if referenced in solved)
+            if weightsum < threshold:
+                return False
+
+        return True
+
+    def newly_unlocked(self, solved, name):
+        """
+        Determines the problems unlocked by solving a single problem. Only
+        problems whose weight maps reference the solved problem are checked.
+
+        Args:
+            solved: set of sanitized names of the solved problems
+            name: the sanitized name of the newly solved problem
+        Returns:
+            List of sanitized names that were locked before the solve and
+            are unlocked after it.
+        """
+
+        before = set(solved) - {name}
+        after = before | {name}
+
+        return sorted(
+            dependent for dependent in self.dependents.get(name, [])
+            if dependent not in after and self.is_unlocked(dependent, after) and
+            not self.is_unlocked(dependent, before))
+
+
+def _build_graph():
+    db = api.common.get_conn()
+    return UnlockGraph(db.bundles.find({}, {"_id": 0}))
+
+
+_graph = api.cache.VersionedSnapshot("bundles", _build_graph)
+
+
+def rebuild_graph():
+    """
+    Signals that the bundles changed. Every process rebuilds its graph.
+    """
+
+    _graph.invalidate()
+
+
+def get_graph():
+    """
+    Returns the unlock graph, rebuilding it if the bundles changed.
+
+    Returns:
+        The UnlockGraph.
+    """
+
+    return _graph.get()
+
+
+def get_version():
+    """
+    Returns the bundles version the current graph was built from.
+    """
+
+    get_graph()
+    return _graph.version
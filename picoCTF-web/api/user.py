@@ -154,12 +154,14 @@ def get_user(name=None, uid=None):
 
     match = {}
 
+    if name is None and uid in (None, api.auth.get_request_uid()) and \
+            api.auth.is_logged_in():
+        return api.auth.get_request_user()
+
     if uid is not None:
         match.update({'uid': uid})
     elif name is not None:
         match.update({'username': name})
-    elif api.auth.is_logged_in():
-        match.update({'uid': api.auth.get_uid()})
     else:
         raise InternalException("Uid or name must be specified for get_user")
 
@@ -442,6 +444,7 @@ def verify_user(uid, token_value):
 
     if token_user["uid"] == uid:
         db.users.find_and_modify({"uid": uid}, {"$set": {"verified": True}})
+        api.auth.invalidate_request_identity()
         api.token.delete_token({"uid": uid}, "email_verification")
         return True
     else:
@@ -493,6 +496,7 @@ def update_password(uid, password):
     }, {'$set': {
         'password_hash': api.common.hash_password(password)
     }})
+    api.auth.invalidate_request_identity()
 
 
 def disable_account(uid):
@@ -529,6 +533,8 @@ def disable_account(uid):
             }},
             new=True)
 
+    api.auth.invalidate_request_identity()
+
 
 @log_action
 def disable_account_request(params, uid=None, check_current=False):
@@ -553,6 +559,26 @@ def disable_account_request(params, uid=None, check_current=False):
     api.auth.logout()
 
 
+def get_extdata(uid=None):
+    """
+    Get user extdata. It is not part of the request's user document.
+
+    Args:
+        uid: the user's uid, defaults to the logged in user
+    Returns:
+        The extdata or an empty dict if unset.
+    """
+
+    db = api.common.get_conn()
+    user = db.users.find_one({
+        "uid": get_user(uid=uid)["uid"]
+    }, {
+        "_id": 0,
+        "extdata": 1
+    })
+    return user.get("extdata", {})
+
+
 def update_extdata(params):
     """
     Update user extdata.
@@ -566,3 +592,4 @@ def update_extdata(params):
     db = api.common.get_conn()
     params.pop('token', None)
     db.users.update_one({'uid': user['uid']}, {'$set': {'extdata': params}})
+    api.auth.invalidate_request_identity()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import api
+
+# Upper bound of batches per run, so other daemons still get their turn.
+max_batches = 50
+
+
+def run():
+    if not api.config.get_settings()["achievements"]["enable_achievements"]:
+        return
+
+    events = failed = earned = 0
+    for _ in range(max_batches):
+        result = api.achievement.process_achievement_events()
+        events += result["events"]
+        failed += result["failed"]
+        earned += result["earned"]
+        if result["events"] < api.achievement.event_batch_size:
+            break
+
+    if events > 0:
+        print("Processed {} achievement events, {} failed, {} achievements "
+              "earned.".format(events, failed, earned))
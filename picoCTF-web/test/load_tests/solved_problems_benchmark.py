@@ -0,0 +1,174 @@
+"""
+Benchmark of api.problem.get_solved_problems.
+
+Compares the current single query implementation against the previous one,
+which queried the submissions of the team and of every member separately and
+looked up every solved problem on its own. The benchmark seeds a scratch
+database with teams of 5 members and 200 solves each.
+
+Usage:
+    python3 solved_problems_benchmark.py [--teams N] [--rounds N] [--db NAME]
+
+The database given by --db (default: pico_benchmark) must not exist yet or
+be empty. It is dropped afterwards.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import api
+import api.app
+
+members_per_team = 5
+solves_per_team = 200
+
+
+def seed(db, teams):
+    """
+    Inserts the problems, teams, users and submissions of the benchmark.
+
+    Returns:
+        The list of tids.
+    """
+
+    problems = [{
+        "pid": "benchmark-pid-{}".format(i),
+        "name": "benchmark-{}".format(i),
+        "sanitized_name": "benchmark-{}".format(i),
+        "category": "Category {}".format(i % 5),
+        "score": 10 + i % 50,
+        "author": "benchmark",
+        "description": "Benchmark problem {}".format(i),
+        "hints": [],
+        "disabled": False,
+        "instances": []
+    } for i in range(solves_per_team)]
+    db.problems.insert_many(problems)
+
+    start = datetime.utcnow() - timedelta(days=1)
+    tids = []
+    for t in range(teams):
+        tid = "benchmark-tid-{}".format(t)
+        uids = ["benchmark-uid-{}-{}".format(t, m)
+                for m in range(members_per_team)]
+        tids.append(tid)
+
+        db.teams.insert_one({
+            "tid": tid,
+            "team_name": "benchmark team {}".format(t),
+            "size": members_per_team,
+            "eligible": True,
+            "instances": {}
+        })
+        db.users.insert_many([{
+            "uid": uid,
+            "tid": tid,
+            "username": uid,
+            "disabled": False
+        } for uid in uids])
+
+        submissions = []
+        for i, problem in enumerate(problems):
+            # A wrong submission before every solve
+            for correct in [False, True]:
+                submissions.append({
+                    "uid": random.choice(uids),
+                    "tid": tid,
+                    "pid": problem["pid"],
+                    "key": "flag-{}-{}".format(i, correct),
+                    "category": problem["category"],
+                    "correct": correct,
+                    "eligible": True,
+                    "timestamp": start + timedelta(seconds=len(submissions))
+                })
+        db.submissions.insert_many(submissions)
+
+    return tids
+
+
+def legacy_get_solved_problems(tid):
+    """
+    The previous implementation of get_solved_problems for a team.
+    """
+
+    db = api.common.get_conn()
+
+    team = api.team.get_team(tid=tid)
+    members = api.team.get_team_uids(tid=team["tid"])
+
+    submissions = api.problem.get_submissions(tid=tid, correctness=True)
+    for uid in members:
+        submissions += api.problem.get_submissions(uid=uid, correctness=True)
+
+    pids = []
+    result = []
+    for submission in submissions:
+        if submission["pid"] not in pids:
+            pids.append(submission["pid"])
+            problem = api.problem.unlocked_filter(
+                db.problems.find_one({"pid": submission["pid"]}, {"_id": 0}),
+                True)
+            problem["solve_time"] = submission["timestamp"]
+            if not problem["disabled"]:
+                result.append(problem)
+
+    return result
+
+
+def current_get_solved_problems(tid):
+    return api.problem.get_solved_problems(tid=tid, cache=False)
+
+
+def benchmark(name, f, tids, rounds):
+    """
+    Times f over every team for the given number of rounds.
+    """
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for tid in tids:
+            f(tid)
+    elapsed = time.perf_counter() - start
+
+    calls = rounds * len(tids)
+    print("{:<10} {:>8} calls {:>10.2f} ms/call".format(
+        name, calls, 1000 * elapsed / calls))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--teams", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--db", default="pico_benchmark")
+    args = parser.parse_args()
+
+    api.app.app.config["MONGO_DB_NAME"] = args.db
+    db = api.common.get_conn()
+    if len(db.collection_names()) > 0:
+        parser.error("The database {} is not empty.".format(args.db))
+    api.setup.index_mongo()
+
+    try:
+        tids = seed(db, args.teams)
+
+        for tid in tids:
+            legacy = legacy_get_solved_problems(tid)
+            current = current_get_solved_problems(tid)
+            assert sorted(p["pid"] for p in legacy) == sorted(
+                p["pid"] for p in current), "Solved problems differ"
+            assert len(current) == solves_per_team
+
+        legacy = benchmark("legacy", legacy_get_solved_problems, tids,
+                           args.rounds)
+        current = benchmark("current", current_get_solved_problems, tids,
+                            args.rounds)
+        print("speedup    {:.1f}x".format(legacy / current))
+    finally:
+        db.client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -68,7 +68,7 @@ for user in queue:
         set(api.problem.get_solved_pids(team["tid"]))
     ]
     problem = random.choice(unlocked)
-    iid = api.user.get_team(uid=user["uid"])["instances"][problem["pid"]]
+    iid = api.team.get_team_instances(team["tid"])[problem["pid"]]
     instance = api.problem.get_problem_instance(problem["pid"], team["tid"])
     api.problem.submit_key(
         team["tid"], problem["pid"], instance["flag"], uid=user["uid"])
@@ -0,0 +1,423 @@
+"""
+Cache Testing Module
+"""
+
+import datetime
+import threading
+import time
+
+import api.cache
+import pytest
+from api.cache import FastCache
+from common import clear_cache, clear_collections
+from conftest import setup_db, teardown_db
+
+calls = []
+
+
+@api.cache.memoize(tags=["problems"])
+def tagged(pid, tid=None):
+    calls.append(pid)
+    return len(calls)
+
+
+@api.cache.memoize(timeout=60, fast=True)
+def fast_tagged(pid):
+    calls.append(pid)
+    return len(calls)
+
+
+@api.cache.memoize(timeout=60, single_flight=True)
+def single_flight(pid):
+    calls.append(pid)
+    return len(calls)
+
+
+@api.cache.memoize(timeout=60, stale=60)
+def stale(pid):
+    calls.append(pid)
+    return len(calls)
+
+
+class TestFastCache(object):
+
+    def test_eviction_order(self):
+        """
+        Tests that the least recently used entries are evicted first.
+
+        Covers:
+            cache.FastCache.set
+            cache.FastCache.get
+        """
+
+        cache = FastCache(max_entries=3)
+        cache.set("test.f$a", 1)
+        cache.set("test.f$b", 2)
+        cache.set("test.f$c", 3)
+
+        # Reading a makes b the least recently used entry.
+        assert cache.get("test.f$a") == 1
+        cache.set("test.f$d", 4)
+
+        assert "test.f$b" not in cache, "The least recently used entry was kept"
+        assert "test.f$a" in cache and "test.f$c" in cache and \
+            "test.f$d" in cache, "A recently used entry was evicted"
+        assert len(cache) == 3
+
+    def test_byte_limit_eviction(self):
+        """
+        Tests that entries are evicted once the byte budget is exceeded.
+
+        Covers:
+            cache.FastCache.set
+            cache.FastCache.configure
+        """
+
+        value = "x" * 1000
+        size = api.cache._estimate_size(value)
+
+        cache = FastCache(max_bytes=size * 2)
+        cache.set("test.f$a", value)
+        cache.set("test.f$b", value)
+        assert len(cache) == 2
+
+        cache.set("test.f$c", value)
+        assert "test.f$a" not in cache, "The byte budget was exceeded"
+        assert cache.get_stats()["bytes"] <= size * 2
+
+        cache.configure(max_bytes=size)
+        assert len(cache) == 1 and "test.f$c" in cache, \
+            "Lowering the budget did not evict the oldest entries"
+
+        # A single entry larger than the budget is not kept.
+        cache.set("test.f$d", value * 2)
+        assert len(cache) == 0
+
+    def test_expiry(self, monkeypatch):
+        """
+        Tests that entries expire after their timeout.
+
+        Covers:
+            cache.FastCache.get
+            cache.FastCache.sweep
+        """
+
+        now = [1000.0]
+        monkeypatch.setattr(api.cache.time, "time", lambda: now[0])
+
+        cache = FastCache()
+        cache.set("test.f$a", 1, timeout=10)
+        cache.set("test.f$b", 2, timeout=10)
+        cache.set("test.f$c", 3)
+
+        now[0] += 5
+        assert cache.get("test.f$a") == 1, "The entry expired too early"
+
+        now[0] += 10
+        assert cache.get("test.f$a", "missing") == "missing", \
+            "The entry did not expire"
+        assert cache.sweep() == 1, "The sweep did not remove the expired entry"
+        assert "test.f$b" not in cache
+        assert cache.get("test.f$c") == 3, "An entry without timeout expired"
+
+    def test_counters(self, monkeypatch):
+        """
+        Tests the hit, miss, expiration and eviction counters.
+
+        Covers:
+            cache.FastCache.get_stats
+        """
+
+        now = [1000.0]
+        monkeypatch.setattr(api.cache.time, "time", lambda: now[0])
+
+        cache = FastCache(max_entries=2)
+        cache.set("test.f$a", 1, timeout=10)
+        cache.get("test.f$a")
+        cache.get("test.f$a")
+        cache.get("test.f$missing")
+
+        cache.set("test.g$a", 1)
+        cache.set("test.g$b", 2)
+        now[0] += 20
+        cache.get("test.g$b")
+
+        stats = cache.get_stats()
+        f = stats["functions"]["test.f"]
+        g = stats["functions"]["test.g"]
+
+        assert f["hits"] == 2 and f["misses"] == 1
+        assert f["evictions"] == 1, "The eviction of test.f$a was not counted"
+        assert g["hits"] == 1 and g["misses"] == 0 and g["evictions"] == 0
+        assert f["expirations"] == 0 and g["expirations"] == 0
+        assert stats["entries"] == 2 and g["entries"] == 2
+
+    def test_invalidate(self):
+        """
+        Tests that invalidating a tag removes exactly the entries carrying it.
+
+        Covers:
+            cache.FastCache.invalidate
+        """
+
+        cache = FastCache()
+        cache.set("test.f$a", 1, tags=["tid:a", "problems"])
+        cache.set("test.f$b", 2, tags=["tid:b"])
+        cache.set("test.f$c", 3)
+
+        assert cache.invalidate("tid:a", "missing") == 1
+        assert "test.f$a" not in cache
+        assert "test.f$b" in cache and "test.f$c" in cache
+
+        assert cache.invalidate("problems") == 0, \
+            "Tags of a removed entry were kept"
+
+    def test_get_tags(self):
+        """
+        Tests that the tags of a call are its static tags and a tag for every
+        given tid, uid, pid or gid argument.
+
+        Covers:
+            cache.tag
+            cache.get_tags
+        """
+
+        assert api.cache.get_tags(tagged, "a") == ["problems", "pid:a"]
+        assert api.cache.get_tags(tagged, "a", "b") == \
+            ["problems", "tid:b", "pid:a"]
+        assert api.cache.get_tags(tagged, pid="a", tid="b") == \
+            ["problems", "tid:b", "pid:a"]
+        assert api.cache.get_tags(tagged, "a", tid=None) == \
+            ["problems", "pid:a"], "A tag was added for a missing argument"
+        assert api.cache.get_tags(fast_tagged, "a") == ["pid:a"]
+
+
+class TestInvalidation(object):
+    """
+    API Tests for the tag based invalidation of cache.py
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_cache()
+    def test_invalidate(self):
+        """
+        Tests that invalidating a tag recomputes exactly the results that
+        depend on it in both tiers.
+
+        Covers:
+            cache.invalidate
+            cache.memoize
+        """
+
+        del calls[:]
+        api.cache.sync_fast_cache(force=True)
+
+        a, b = tagged("a"), tagged("b")
+        fast = fast_tagged("a")
+        assert tagged("a") == a and tagged("b") == b and \
+            fast_tagged("a") == fast, "The results were not cached"
+
+        api.cache.invalidate(api.cache.tag("pid", "a"))
+        assert tagged("a") != a, "The invalidated mongo result was kept"
+        assert fast_tagged("a") != fast, "The invalidated fast result was kept"
+        assert tagged("b") == b, "An unrelated result was invalidated"
+
+        b = tagged("b")
+        api.cache.invalidate("problems")
+        assert tagged("b") != b, "A static tag was not invalidated"
+
+    @clear_collections("cache_invalidations")
+    def test_sync_fast_cache(self, monkeypatch):
+        """
+        Tests that invalidations recorded by other processes reach the fast
+        tier of this process.
+
+        Covers:
+            cache.sync_fast_cache
+        """
+
+        cache = FastCache()
+        monkeypatch.setattr(api.cache, "fast_cache", cache)
+        monkeypatch.setattr(api.cache, "_fast_synced_at",
+                            datetime.datetime.utcnow())
+
+        cache.set("test.f$a", 1, tags=["tid:a"])
+        cache.set("test.f$b", 2, tags=["tid:b"])
+
+        # Another process invalidates tid:a.
+        api.cache._record_invalidation(["tid:a"])
+
+        api.cache.sync_fast_cache()
+        assert "test.f$a" in cache, "Checked again within the sync interval"
+
+        api.cache.sync_fast_cache(force=True)
+        assert "test.f$a" not in cache, "The invalidation was not applied"
+        assert "test.f$b" in cache, "An unrelated entry was invalidated"
+
+        # Another process clears the cache.
+        api.cache._record_invalidation([], clear=True)
+        api.cache.sync_fast_cache(force=True)
+        assert len(cache) == 0, "The clear was not applied"
+
+        # Records older than the retention can be gone already.
+        cache.set("test.f$c", 3)
+        monkeypatch.setattr(
+            api.cache, "_fast_synced_at",
+            datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=api.cache.invalidation_retention + 1))
+        api.cache.sync_fast_cache()
+        assert len(cache) == 0, "A cache older than the retention was kept"
+
+
+class TestLeases(object):
+    """
+    API Tests for the recomputation leases of cache.py
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    def expire(self, f, *args):
+        """
+        Marks the cached result of a call as no longer fresh.
+        """
+
+        db = api.common.get_conn()
+        key = api.cache.get_mongo_key(f, *args)
+        db.cache.update_one(api.cache._get_partial_key(key), {
+            "$set": {
+                "freshUntil":
+                datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+            }
+        })
+        return api.cache.get_lease_id(key)
+
+    @clear_collections("cache_leases")
+    def test_acquire_release(self):
+        """
+        Tests that a lease is held by one owner at a time and only its owner
+        releases it.
+
+        Covers:
+            cache.acquire_lease
+            cache.release_lease
+        """
+
+        owner = api.cache.acquire_lease("lease")
+        assert owner is not None
+        assert api.cache.acquire_lease("lease") is None, \
+            "A held lease was acquired twice"
+        assert api.cache.acquire_lease("other lease") is not None
+
+        api.cache.release_lease("lease", "not the owner")
+        assert api.cache.acquire_lease("lease") is None, \
+            "The lease was released by another worker"
+
+        api.cache.release_lease("lease", owner)
+        assert api.cache.acquire_lease("lease") is not None, \
+            "The lease was not released by its owner"
+
+    @clear_collections("cache_leases")
+    def test_expired_lease(self):
+        """
+        Tests that an expired lease is taken over and the previous owner can
+        no longer release it.
+
+        Covers:
+            cache.acquire_lease
+            cache.release_lease
+        """
+
+        expired = api.cache.acquire_lease("lease", duration=-1)
+        assert expired is not None
+
+        owner = api.cache.acquire_lease("lease")
+        assert owner is not None and owner != expired, \
+            "The expired lease was not taken over"
+
+        api.cache.release_lease("lease", expired)
+        assert api.cache.acquire_lease("lease") is None, \
+            "The previous owner released the lease of the new owner"
+
+    @clear_cache()
+    @clear_collections("cache_leases")
+    def test_single_flight(self, monkeypatch):
+        """
+        Tests that a worker waits for the lease holder's result and computes
+        it itself once the lease holder takes too long.
+
+        Covers:
+            cache.memoize
+        """
+
+        del calls[:]
+        monkeypatch.setattr(api.cache, "lease_wait", 1)
+
+        key = api.cache.get_mongo_key(single_flight, "a")
+        lease_id = api.cache.get_lease_id(key)
+        owner = api.cache.acquire_lease(lease_id)
+
+        # The lease holder stores its result while we wait.
+        threading.Timer(0.2, api.cache.set, (key, "holder"), {
+            "timeout": 60
+        }).start()
+
+        assert single_flight("a") == "holder", \
+            "The result of the lease holder was not used"
+        assert calls == [], "The result was computed twice"
+
+        api.cache.release_lease(lease_id, owner)
+
+        # The lease holder never finishes.
+        lease_id = api.cache.get_lease_id(
+            api.cache.get_mongo_key(single_flight, "b"))
+        owner = api.cache.acquire_lease(lease_id)
+
+        assert single_flight("b") == 1
+        assert calls == ["b"], "The result was not computed after the wait"
+
+        api.cache.release_lease(lease_id, owner)
+
+    @clear_cache()
+    @clear_collections("cache_leases")
+    def test_stale(self):
+        """
+        Tests that an expired result is served while a single worker
+        recomputes it.
+
+        Covers:
+            cache.memoize
+        """
+
+        del calls[:]
+
+        assert stale("a") == 1
+        lease_id = self.expire(stale, "a")
+
+        # Another worker is revalidating, we serve the stale result.
+        owner = api.cache.acquire_lease(lease_id)
+        assert stale("a") == 1
+        time.sleep(0.2)
+        assert calls == ["a"], "The result was revalidated twice"
+        api.cache.release_lease(lease_id, owner)
+
+        # We revalidate in the background and serve the stale result.
+        assert stale("a") == 1, "The stale result was not served"
+
+        deadline = time.time() + 5
+        while time.time() < deadline and len(calls) < 2:
+            time.sleep(0.05)
+        assert calls == ["a", "a"], "The stale result was not revalidated"
+
+        while time.time() < deadline and stale("a") != 2:
+            time.sleep(0.05)
+        assert stale("a") == 2, "The revalidated result was not stored"
+        assert calls == ["a", "a"]
@@ -0,0 +1,232 @@
+"""
+Flag Sharing Testing Module
+"""
+
+from datetime import datetime
+
+import api
+import pytest
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+
+class TestFlagSharing(object):
+    """
+    API Tests for flag_sharing.py
+    """
+
+    pid = "flag-sharing-0"
+    other_pid = "flag-sharing-1"
+
+    problems = [{
+        "pid": pid,
+        "name": "flag sharing 0",
+        "sanitized_name": "flag-sharing-0",
+        "category": "Web Exploitation",
+        "score": 10,
+        "disabled": False,
+        "instances": [{
+            "iid": "iid-a",
+            "flag": "flag-a",
+            "instance_number": 0
+        }, {
+            "iid": "iid-b",
+            "flag": "flag-b",
+            "instance_number": 1
+        }]
+    }, {
+        "pid": other_pid,
+        "name": "flag sharing 1",
+        "sanitized_name": "flag-sharing-1",
+        "category": "Web Exploitation",
+        "score": 20,
+        "disabled": False,
+        "instances": [{
+            "iid": "iid-c",
+            "flag": "flag-c",
+            "instance_number": 0
+        }]
+    }]
+
+    def setup_class(self):
+        """
+        Class setup code
+        """
+
+        db = setup_db()
+
+        db.problems.insert_many([dict(problem) for problem in self.problems])
+        api.catalog.invalidate_catalog()
+
+        # Team a owns instance a of both problems, team b instance b, team c
+        # has no instances and is a member of a classroom.
+        db.teams.insert_many([{
+            "tid": "tid-a",
+            "team_name": "team a",
+            "size": 1,
+            "eligible": True,
+            "instances": {
+                self.pid: "iid-a",
+                self.other_pid: "iid-c"
+            }
+        }, {
+            "tid": "tid-b",
+            "team_name": "team b",
+            "size": 1,
+            "eligible": True,
+            "instances": {
+                self.pid: "iid-b"
+            }
+        }, {
+            "tid": "tid-c",
+            "team_name": "team c",
+            "size": 1,
+            "eligible": True,
+            "instances": {}
+        }])
+        db.users.insert_many([{
+            "uid": "uid-" + name,
+            "tid": "tid-" + name,
+            "username": "user " + name,
+            "disabled": False
+        } for name in "abc"])
+        db.groups.insert_many([{
+            "gid": "gid-" + name,
+            "name": "classroom " + name,
+            "owner": "tid-a",
+            "teachers": [],
+            "members": members,
+            "settings": {
+                "hidden": False,
+                "email_filter": []
+            }
+        } for name, members in [("1", ["tid-c"]), ("2", [])]])
+
+    def teardown_class(self):
+        teardown_db()
+
+    def submission(self, tid, key, pid=None):
+        return {
+            "uid": "uid" + tid[3:],
+            "tid": tid,
+            "pid": pid or self.pid,
+            "key": key,
+            "key_hash": api.common.hash(key),
+            "correct": False,
+            "timestamp": datetime.utcnow()
+        }
+
+    @clear_collections("flag_sharing")
+    def test_own_flag(self):
+        """
+        Tests that a team submitting its own instance's flag is not flagged.
+
+        Covers:
+            flag_sharing.check_submission
+        """
+
+        db = api.common.get_conn()
+
+        assert not api.flag_sharing.check_submission(
+            self.submission("tid-a", "flag-a"), "user a", "flag sharing 0")
+        assert not api.flag_sharing.check_submission(
+            self.submission("tid-c", "not a flag"), "user c",
+            "flag sharing 0")
+        assert db.flag_sharing.count() == 0, "An innocent submission was flagged"
+
+    @clear_collections("flag_sharing")
+    def test_other_flag(self):
+        """
+        Tests that another team's flag is recorded with its owners and groups.
+
+        Covers:
+            flag_sharing.check_submission
+            flag_sharing.get_flagged_submissions
+        """
+
+        assert api.flag_sharing.check_submission(
+            self.submission("tid-c", "flag-a"), "user c", "flag sharing 0")
+
+        flagged = api.flag_sharing.get_flagged_submissions(tids=["tid-c"])
+        assert len(flagged) == 1
+        assert flagged[0]["iid"] == "iid-a"
+        assert flagged[0]["owners"] == ["tid-a"]
+        assert flagged[0]["gids"] == ["gid-1"]
+        assert flagged[0]["username"] == "user c"
+        assert flagged[0]["problem_name"] == "flag sharing 0"
+
+        assert len(api.flag_sharing.get_flagged_submissions(gid="gid-1")) == 1
+        assert len(api.flag_sharing.get_flagged_submissions(gid="gid-2")) == 0
+        assert len(api.flag_sharing.get_flagged_submissions(
+            tids=["tid-a"])) == 0
+
+    @clear_collections("flag_sharing", "submissions")
+    def test_backfill(self):
+        """
+        Tests that the backfill flags the stored submissions and removes the
+        stale flagged submissions of the rebuilt problems only.
+
+        Covers:
+            flag_sharing.backfill_flag_sharing
+        """
+
+        db = api.common.get_conn()
+
+        db.submissions.insert_many([
+            self.submission("tid-c", "flag-a"),
+            self.submission("tid-c", "flag-c", pid=self.other_pid),
+            self.submission("tid-b", "flag-b"),
+            self.submission("tid-b", "wrong")
+        ])
+        db.flag_sharing.insert_many([{
+            "tid": "tid-b",
+            "pid": pid,
+            "key_hash": "stale",
+            "refresh": "previous"
+        } for pid in [self.pid, self.other_pid]])
+
+        assert api.flag_sharing.backfill_flag_sharing([self.pid]) == 1
+        assert db.flag_sharing.count({"pid": self.pid}) == 1
+        assert db.flag_sharing.count({
+            "pid": self.pid,
+            "key_hash": "stale"
+        }) == 0, "Stale submission of the rebuilt problem was kept"
+        assert db.flag_sharing.count({
+            "pid": self.other_pid,
+            "key_hash": "stale"
+        }) == 1, "Stale submission of another problem was removed"
+
+        assert api.flag_sharing.backfill_flag_sharing() == 2
+        assert db.flag_sharing.count({"key_hash": "stale"}) == 0
+        assert sorted(
+            (submission["pid"], submission["owners"])
+            for submission in api.flag_sharing.get_flagged_submissions(
+                tids=["tid-c"])) == [(self.pid, ["tid-a"]),
+                                     (self.other_pid, ["tid-a"])]
+
+    @clear_collections("flag_sharing")
+    def test_sync_team_groups(self):
+        """
+        Tests that flagged submissions follow their team's classrooms.
+
+        Covers:
+            flag_sharing.sync_team_groups
+            group.join_group
+            group.leave_group
+        """
+
+        api.flag_sharing.check_submission(
+            self.submission("tid-c", "flag-b"), "user c", "flag sharing 0")
+
+        try:
+            api.group.join_group("gid-2", "tid-c")
+            assert len(
+                api.flag_sharing.get_flagged_submissions(gid="gid-2")) == 1
+            assert sorted(api.flag_sharing.get_flagged_submissions(
+                tids=["tid-c"])[0]["gids"]) == ["gid-1", "gid-2"]
+        finally:
+            api.group.leave_group("gid-2", "tid-c")
+
+        assert len(api.flag_sharing.get_flagged_submissions(gid="gid-2")) == 0
+        assert api.flag_sharing.get_flagged_submissions(
+            tids=["tid-c"])[0]["gids"] == ["gid-1"]
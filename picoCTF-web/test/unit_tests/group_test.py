@@ -2,13 +2,16 @@
 Group Testing Module
 """
 
+from datetime import datetime
+
 import api.common
 import api.team
 import api.user
 import bcrypt
 import pytest
 from api.common import InternalException, WebException
-from common import clear_collections, ensure_empty_collections, new_team_user
+from common import (clear_cache, clear_collections, ensure_empty_collections,
+                    new_team_user)
 from conftest import setup_db, teardown_db
 
 
@@ -106,3 +109,66 @@ class TestGroups(object):
         with pytest.raises(InternalException):
             api.group.leave_group(gid, self.owner_tid)
             assert False, "Was able to leave group twice!"
+
+    @ensure_empty_collections("groups", "team_scores")
+    @clear_collections("groups", "team_scores")
+    @clear_cache()
+    def test_group_scoreboard_invalidation(self):
+        """
+        Tests that a group's cached scoreboard is invalidated when a member
+        solves a problem, joins or leaves, and only then.
+
+        Covers:
+            group.invalidate_team_groups
+            group.join_group
+            group.leave_group
+            stats.get_group_scoreboard
+        """
+
+        db = api.common.get_conn()
+
+        member, other, joining = self.tids[:3]
+        db.teams.update_many({
+            "tid": {
+                "$in": [member, other, joining]
+            }
+        }, {"$set": {
+            "size": 1
+        }})
+
+        gid = api.group.create_group(self.owner_tid, "scoreboard group")
+        other_gid = api.group.create_group(self.owner_tid,
+                                           "other scoreboard group")
+        api.group.join_group(gid, member)
+        api.group.join_group(other_gid, other)
+
+        scores = lambda gid: {
+            entry["tid"]: entry["score"]
+            for entry in api.stats.get_group_scoreboard(gid)
+        }
+
+        assert scores(gid) == {member: 0}
+        assert scores(other_gid) == {other: 0}
+
+        # The scores are cached until the groups of a scoring team are
+        # invalidated, as submit_key does after a solve.
+        api.scoreboard.record_solve(member, "pid-1", 10, datetime.utcnow())
+        api.scoreboard.record_solve(other, "pid-1", 10, datetime.utcnow())
+        assert scores(gid) == {member: 0}, "The scoreboard was not cached"
+
+        api.group.invalidate_team_groups(member)
+        assert scores(gid) == {member: 10}, \
+            "The scoreboard of the member's group was not invalidated"
+        assert scores(other_gid) == {other: 0}, \
+            "The scoreboard of another group was invalidated"
+
+        api.group.invalidate_team_groups(member, other)
+        assert scores(other_gid) == {other: 10}
+
+        api.group.join_group(gid, joining)
+        assert scores(gid) == {member: 10, joining: 0}, \
+            "The scoreboard was not invalidated when a team joined"
+
+        api.group.leave_group(gid, member)
+        assert scores(gid) == {joining: 0}, \
+            "The scoreboard was not invalidated when a team left"
@@ -215,7 +215,7 @@ class TestProblems(object):
             assert problem['pid'] in self.all_pids
 
     @ensure_empty_collections("submissions")
-    @clear_collections("submissions")
+    @clear_collections("submissions", "first_solves", "solve_counts")
     @clear_cache()
     def test_submissions(self):
         """
@@ -238,6 +238,9 @@ class TestProblems(object):
             solved = api.problem.get_solved_pids(self.tid)
             assert problem['pid'] in solved
 
+            first_solve = api.scoreboard.get_first_solve(problem['pid'])
+            assert first_solve["tid"] == self.tid, "First solve was not recorded"
+
         # test incorrect submissions
         for problem in self.base_problems[2:]:
             result = api.problem.submit_key(
@@ -249,6 +252,15 @@ class TestProblems(object):
             solved = api.problem.get_solved_problems(self.tid)
             assert api.problem.get_problem(pid=problem['pid']) not in solved
 
+        # test submitting the same wrong key twice
+        with pytest.raises(APIException):
+            api.problem.submit_key(
+                self.tid,
+                self.base_problems[2]['pid'],
+                self.wrong + "asd",
+                uid=self.uid)
+            assert False, "Submitted the same wrong key twice"
+
         # test submitting correct twice
         with pytest.raises(APIException):
             api.problem.submit_key(
@@ -273,6 +285,66 @@ class TestProblems(object):
         assert len(api.problem.get_submissions(tid=self.tid)) == len(
             self.base_problems)
 
+    @ensure_empty_collections("submissions")
+    @clear_collections("submissions", "first_solves", "solve_counts",
+                       "team_scores")
+    @clear_cache()
+    def test_reevaluation(self):
+        """
+        Tests re-grading submissions after a flag changed.
+
+        Covers:
+            reevaluation.reevaluate_submissions
+            scoreboard.rebuild_team_score
+        """
+
+        db = api.common.get_conn()
+
+        other_uid = api.user.create_simple_user_request(
+            dict(new_team_user, username="reevaluated",
+                 email="reevaluated@hs.edu"))
+        other_tid = api.user.get_team(uid=other_uid)['tid']
+
+        changed = self.base_problems[0]['pid']
+        unchanged = self.base_problems[1]['pid']
+        new_flag = "changed"
+
+        api.problem.submit_key(
+            self.tid, unchanged, self.correct, uid=self.uid)
+        api.problem.submit_key(other_tid, changed, new_flag, uid=other_uid)
+
+        row = lambda tid: db.team_scores.find_one({"tid": tid}, {"_id": 0})
+        submission = lambda tid, pid: db.submissions.find_one({
+            "tid": tid,
+            "pid": pid
+        })
+        team_row = row(self.tid)
+        assert row(other_tid) is None or row(other_tid)["score"] == 0
+
+        instances = api.problem.get_problem(pid=changed)["instances"]
+        try:
+            api.problem.update_problem(changed, {
+                "instances": [
+                    dict(instance, flag=new_flag) for instance in instances
+                ]
+            })
+
+            summary = api.reevaluation.reevaluate_submissions()
+            assert summary["changed"] == 1, "Only one submission changed"
+            assert summary["tids"] == [other_tid]
+
+            assert submission(other_tid, changed)["correct"], \
+                "Submission of the new flag was not re-graded"
+            assert submission(self.tid, unchanged)["correct"], \
+                "Unaffected submission was re-graded"
+
+            assert row(other_tid)["score"] == self.base_problems[0]["score"], \
+                "Score row of the affected team was not rebuilt"
+            assert row(self.tid) == team_row, \
+                "Score row of an unaffected team changed"
+        finally:
+            api.problem.update_problem(changed, {"instances": instances})
+
     @ensure_empty_collections("submissions")
     @clear_collections("submissions")
     @clear_cache()
@@ -305,7 +377,7 @@ class TestProblems(object):
             assert pid in unlocked_pids, "Level1 problem didn't unlock"
 
     @ensure_empty_collections("submissions")
-    @clear_collections("submissions", "problems")
+    @clear_collections("submissions", "problems", "team_scores")
     @clear_cache()
     def test_scoring(self):
         correct_total = 0
@@ -327,3 +399,50 @@ class TestProblems(object):
             assert api.stats.get_score(
                 uid=self.uid
             ) == correct_total, "User score is calculating incorrectly!"
+
+            scoreboard = api.stats.get_all_team_scores(eligible=True)
+            assert scoreboard[0]["tid"] == self.tid
+            assert scoreboard[0][
+                "score"] == correct_total, "Team score table is out of date!"
+
+            assert api.scoreboard.get_team_rank(self.tid)["rank"] == 1
+            page = api.scoreboard.get_scoreboard_page(True, page=1)
+            assert page["teams"][0]["tid"] == self.tid
+            assert page["teams"][0][
+                "score"] == correct_total, "Scoreboard page is out of date!"
+
+            series = api.progression.get_progression(self.tid, points=None)
+            assert len(series) == i + 1
+            assert series[-1][
+                1] == correct_total, "Score progression is out of date!"
+            assert len(api.progression.get_progression(self.tid, points=1)) == 1
+
+        assert len(api.scoreboard.check_team_scores()
+                  ) == 0, "Team score table is inconsistent!"
+
+    def test_unlock_graph(self):
+        """
+        Tests the compiled unlock graph.
+
+        Covers:
+            unlocks.UnlockGraph
+            unlocks.get_graph
+        """
+
+        graph = api.unlocks.get_graph()
+
+        base_names = [p["sanitized_name"] for p in self.base_problems]
+        level1_names = [p["sanitized_name"] for p in self.level1_problems]
+
+        for name in base_names:
+            assert graph.is_unlocked(name, set()), "Base problem is locked"
+        for name in level1_names:
+            assert not graph.is_unlocked(
+                name, set(base_names[:-1])), "Level1 problem unlocked early"
+
+        assert graph.newly_unlocked(set(base_names[:-2]),
+                                    base_names[-2]) == []
+        assert graph.newly_unlocked(
+            set(base_names[:-1]),
+            base_names[-1]) == sorted(level1_names), "Solve did not unlock"
+        assert graph.newly_unlocked(set(level1_names), base_names[0]) == []
@@ -0,0 +1,204 @@
+"""
+Stats Testing Module
+"""
+
+import csv
+import io
+from datetime import datetime
+
+import api
+import pytest
+from api.common import InternalException
+from bson import json_util
+from conftest import setup_db, teardown_db
+
+
+class TestStatsReport(object):
+    """
+    API Tests for the post competition report of stats.py
+    """
+
+    problems = [{
+        "pid": "stats-web",
+        "name": "stats web",
+        "sanitized_name": "stats-web",
+        "category": "Web Exploitation",
+        "score": 10,
+        "disabled": False,
+        "instances": []
+    }, {
+        "pid": "stats-crypto",
+        "name": "stats crypto",
+        "sanitized_name": "stats-crypto",
+        "category": "Cryptography",
+        "score": 20,
+        "disabled": False,
+        "instances": []
+    }, {
+        "pid": "stats-disabled",
+        "name": "stats disabled",
+        "sanitized_name": "stats-disabled",
+        "category": "Web Exploitation",
+        "score": 30,
+        "disabled": True,
+        "instances": []
+    }]
+
+    def setup_class(self):
+        """
+        Seeds three eligible teams, an ineligible one and an empty one.
+
+        tid-1 has the members uid-1, uid-2 and the disabled uid-6, tid-2 has
+        uid-3, who solved a problem for a previous team, tid-3 has uid-4,
+        who never submitted, and the ineligible tid-4 has uid-5.
+        """
+
+        db = setup_db()
+
+        db.problems.insert_many([dict(problem) for problem in self.problems])
+        api.catalog.invalidate_catalog()
+
+        db.teams.insert_many([{
+            "tid": tid,
+            "team_name": "team " + tid,
+            "size": size,
+            "eligible": eligible
+        } for tid, size, eligible in [("tid-1", 2, True), (
+            "tid-2", 1, True), ("tid-3", 1, True), ("tid-4", 1, False),
+                                      ("tid-5", 0, True)]])
+        db.users.insert_many([{
+            "uid": uid,
+            "tid": tid,
+            "username": "user " + uid,
+            "disabled": disabled
+        } for uid, tid, disabled in [("uid-1", "tid-1", False), (
+            "uid-2", "tid-1", False), ("uid-3", "tid-2", False), (
+                "uid-4", "tid-3", False), ("uid-5", "tid-4", False),
+                                     ("uid-6", "tid-1", True)]])
+
+        categories = {
+            problem["pid"]: problem["category"]
+            for problem in self.problems
+        }
+        db.submissions.insert_many([{
+            "uid": uid,
+            "tid": tid,
+            "pid": pid,
+            "category": categories[pid],
+            "correct": correct,
+            "timestamp": datetime(2020, 1, day, 12)
+        } for uid, tid, pid, correct, day in [
+            ("uid-1", "tid-1", "stats-web", True, 1),
+            ("uid-2", "tid-1", "stats-web", False, 2),
+            ("uid-2", "tid-1", "stats-crypto", True, 2),
+            ("uid-6", "tid-1", "stats-disabled", True, 3),
+            ("uid-6", "tid-1", "stats-crypto", False, 4),
+            ("uid-3", "tid-2", "stats-web", True, 1),
+            ("uid-3", "tid-old", "stats-crypto", True, 1),
+            ("uid-5", "tid-4", "stats-crypto", True, 5)
+        ]])
+
+    def teardown_class(self):
+        teardown_db()
+
+    def test_report(self):
+        """
+        Tests the report tables against the hand computed statistics.
+
+        Covers:
+            stats.get_stats_report
+        """
+
+        report = api.stats.get_stats_report()
+
+        assert report["teams"] == 3, "An ineligible or empty team was covered"
+
+        # tid-1 scored 10 + 20, tid-2 10 and tid-3 nothing.
+        assert report["team_score"]["mean"] == 20
+        assert report["team_score"]["stdev"] == pytest.approx(2**0.5 * 10)
+        assert report["team_score"]["median"] == 20
+
+        assert report["team_problems_solved"]["mean"] == 1.5
+        assert report["team_problems_solved"]["stdev"] == pytest.approx(
+            0.5**0.5)
+        assert report["team_problems_solved"]["median"] == 1.5
+
+        # uid-1, uid-2 and uid-3 solved one problem each.
+        assert report["user_problems_solved"] == {
+            "mean": 1,
+            "stdev": 0,
+            "median": 1
+        }
+
+        assert report["team_participation"] == {
+            1: {
+                "correct": 0.5,
+                "any": 0.5
+            },
+            2: {
+                "correct": 2,
+                "any": 2
+            }
+        }
+        assert report["team_sizes"] == {1: 2, 2: 1}
+
+        # Two of three teams solved the web problem, one the crypto problem.
+        assert report["category_solves"] == pytest.approx({
+            "Web Exploitation": 2 / 3,
+            "Cryptography": 1 / 3
+        })
+
+        # The days of the disabled uid-6 are not counted for tid-1.
+        assert report["days_active"] == {0: 1, 1: 1, 2: 1}
+
+        assert report["achievements"]["mean"] == 0
+        assert report["reviews"] == []
+
+    def test_ineligible_report(self):
+        """
+        Tests that the report of every team covers the ineligible teams.
+
+        Covers:
+            stats.get_stats_report
+        """
+
+        report = api.stats.get_stats_report(eligible=False)
+
+        assert report["teams"] == 4
+        assert report["team_sizes"] == {1: 3, 2: 1}
+        assert report["category_solves"] == pytest.approx({
+            "Web Exploitation": 2 / 4,
+            "Cryptography": 2 / 4
+        })
+        assert report["days_active"] == {0: 1, 1: 2, 2: 1}
+
+    def test_write_report(self):
+        """
+        Tests writing the report as json and csv.
+
+        Covers:
+            stats.write_stats_report
+        """
+
+        report = api.stats.get_stats_report()
+
+        output = io.StringIO()
+        api.stats.write_stats_report(report, output)
+        written = json_util.loads(output.getvalue())
+        assert written["teams"] == 3
+        assert written["team_score"]["median"] == 20
+        assert written["days_active"] == {"0": 1, "1": 1, "2": 1}
+
+        output = io.StringIO()
+        api.stats.write_stats_report(report, output, output_format="csv")
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        assert rows[0] == ["statistic", "value"]
+        values = dict(rows[1:])
+        assert float(values["team_score.mean"]) == 20
+        assert float(values["category_solves.Cryptography"]) == \
+            pytest.approx(1 / 3)
+        assert values["team_participation.2.any"] == "2"
+
+        with pytest.raises(InternalException):
+            api.stats.write_stats_report(report, io.StringIO(), "xml")
+            assert False, "Unknown format was accepted"
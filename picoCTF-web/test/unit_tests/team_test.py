@@ -83,6 +83,9 @@ class TestTeams(object):
             team_from_name = api.team.get_team(name=name)
 
             assert team_from_tid == team_from_name, "Team lookup from tid and name are not the same."
+            assert "password" not in team_from_tid and \
+                "instances" not in team_from_tid, \
+                "Team lookup returned private fields."
 
     @ensure_empty_collections("teams", "users")
     @clear_collections("teams", "users")
@@ -150,3 +153,47 @@ class TestTeams(object):
         test_user['username'] += "addition"
         uid = api.user.create_simple_user_request(test_user)
         api.team.join_team(team["team_name"], team["password"], uid)
+
+    @ensure_empty_collections("teams", "users")
+    @clear_collections("teams", "users")
+    def test_get_teams_information(self):
+        """
+        Tests retrieving the information of several teams at once.
+
+        Covers:
+            team.get_teams_information
+        """
+
+        team = base_team.copy()
+        tid = api.team.create_team(team)
+
+        uid = api.user.create_simple_user_request(base_user.copy())
+        own_tid = api.user.get_team(uid=uid)["tid"]
+        api.team.join_team(team["team_name"], team["password"], uid)
+
+        db = api.common.get_conn()
+        db.teams.update({"tid": tid}, {"$set": {"instances": {"pid": "iid"}}})
+
+        information = api.team.get_teams_information(
+            [tid, own_tid], fields=["members", "max_team_size"])
+
+        assert [info["tid"] for info in information] == [tid, own_tid], \
+            "Teams were not returned in the order of the tids."
+        for info in information:
+            assert "password" not in info and "instances" not in info, \
+                "Private team fields were returned."
+            assert "max_team_size" in info
+            assert "score" not in info and "achievements" not in info, \
+                "Fields were computed that were not asked for."
+
+        assert [member["uid"] for member in information[0]["members"]] == \
+            [uid]
+        assert information[1]["members"] == []
+
+        with pytest.raises(InternalException):
+            api.team.get_teams_information([tid], fields=["members", "secret"])
+            assert False, "Unknown field was accepted"
+
+        with pytest.raises(InternalException):
+            api.team.get_teams_information([tid, "missing"])
+            assert False, "Unknown team was accepted"
@@ -5,16 +5,12 @@ def process(api, data):
     Data Required: tid, pid
     """
 
-    submission_count = api.problem.count_submissions(
-        pid=data["pid"], correctness=True, eligibility=True)
-    if submission_count == 1:
-        submissions = api.problem.get_submissions(
-            pid=data["pid"], correctness=True, eligibility=True)
+    first_solve = api.scoreboard.get_first_solve(data["pid"])
+    if first_solve is not None and first_solve["tid"] == data["tid"]:
         problem = api.problem.get_problem(pid=data["pid"])
-        valid = submissions[0]['tid'] == data['tid']
-        return valid, {
+        return True, {
             "name":
-            "Breakthrough!".format(problem["name"]),
+            "Breakthrough!",
             "description":
             "Your team was the first team to solve {}.".format(problem["name"])
         }
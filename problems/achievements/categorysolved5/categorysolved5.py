@@ -1,9 +1,10 @@
 def process(api, data):
+    context = data["context"]
     pid = data["pid"]
-    pid_map = api.stats.get_pid_categories()
+    pid_map = context.get_pid_categories()
     category = pid_map[pid]
-    category_pids = api.stats.get_pids_by_category()[category]
-    solved_pids = api.problem.get_solved_pids(tid=data['tid'])
+    category_pids = context.get_pids_by_category()[category]
+    solved_pids = context.get_solved_pids(data['tid'])
 
     solve_count = 0
     for pid in category_pids:
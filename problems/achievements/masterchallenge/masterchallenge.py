@@ -1,5 +1,5 @@
 def process(api, data):
     pid = data["pid"]
-    pid_map = api.stats.get_pid_categories()
+    pid_map = data["context"].get_pid_categories()
     category = pid_map[pid]
     return category == "Master Challenge", {}